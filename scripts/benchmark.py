@@ -0,0 +1,39 @@
+import sys
+import os
+import argparse
+
+# Add project root to path so we can import src modules
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+
+def parse_args():
+    from src.config import MODEL_WORKERS, BENCHMARK_SCALE_FACTORS
+
+    parser = argparse.ArgumentParser(
+        description="Time the pipeline per layer and table on generated data at several scale factors.",
+    )
+    parser.add_argument(
+        "--scale-factors", type=float, nargs="+", default=BENCHMARK_SCALE_FACTORS,
+        help=f"data sizes to run at, 1 being the shipped CSVs (default: {BENCHMARK_SCALE_FACTORS})",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=MODEL_WORKERS,
+        help=f"models to build at the same time (default: {MODEL_WORKERS})",
+    )
+    parser.add_argument(
+        "--regenerate", action="store_true",
+        help="generate the source CSVs again even if they already exist",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    from src.benchmark import run_benchmark
+    run_benchmark(args.scale_factors, workers=args.workers, regenerate=args.regenerate)
+
+
+if __name__ == "__main__":
+    main()
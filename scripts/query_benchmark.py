@@ -0,0 +1,50 @@
+import sys
+import os
+import argparse
+
+# Add project root to path so we can import src modules
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+
+def parse_args():
+    from src.config import DB_PATH
+
+    parser = argparse.ArgumentParser(
+        description="Time the dashboard query suite over the marts, cold and warm, against a stored baseline.",
+    )
+    parser.add_argument(
+        "--db", default=DB_PATH,
+        help=f"database to query (default: {DB_PATH})",
+    )
+    parser.add_argument(
+        "--scale-factor", type=float,
+        help="query the database built by scripts/benchmark.py at this scale factor instead of --db",
+    )
+    parser.add_argument(
+        "--warm-runs", type=int, default=20,
+        help="timed runs per query after the cold run (default: 20)",
+    )
+    parser.add_argument(
+        "--save-baseline", action="store_true",
+        help="store this run as the baseline later runs are compared with",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    from src.benchmark import scale_factor_dir
+    from src.query_benchmark import run_query_benchmark
+
+    db_path = args.db
+    if args.scale_factor is not None:
+        db_path = os.path.join(scale_factor_dir(args.scale_factor), "iff_supply_chain.duckdb")
+    _, comparison = run_query_benchmark(db_path, warm_runs=args.warm_runs, save_baseline=args.save_baseline)
+    if any(row["regressed"] for row in comparison):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,17 +2,18 @@ import sys
 import subprocess
 import os
 import importlib
+import argparse
 
 # Add project root to path so we can import src modules
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, PROJECT_ROOT)
 
 
-def run_step(step_name, module_path, func_name):
+def run_step(step_name, module_path, func_name, **kwargs):
     try:
         module = importlib.import_module(module_path)
         func = getattr(module, func_name)
-        func()
+        return func(**kwargs)
     except Exception as e:
         print(f"\nERROR in {step_name}: {e}")
         import traceback
@@ -22,7 +23,7 @@ def run_step(step_name, module_path, func_name):
 
 def run_tests():
 
-    print("STEP 5: Running data quality tests")
+    print("STEP 5: Running data quality tests (pytest)")
     result = subprocess.run(
         [sys.executable, "-m", "pytest", "src/tests/test_data_quality.py", "-v"],
         cwd=PROJECT_ROOT,
@@ -32,20 +33,68 @@ def run_tests():
         sys.exit(1)
 
 
+def parse_args():
+    from src.config import MODEL_WORKERS
+
+    parser = argparse.ArgumentParser(description="Build the IFF supply chain dimensional model.")
+    parser.add_argument(
+        "--select",
+        help="only build these models, e.g. 'int_flavours_scd2+' for a model and everything downstream of it",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=MODEL_WORKERS,
+        help=f"models to build at the same time (default: {MODEL_WORKERS})",
+    )
+    parser.add_argument(
+        "--full-refresh", action="store_true",
+        help="rebuild models even if their inputs haven't changed since the last build",
+    )
+    parser.add_argument(
+        "--transactional", action="store_true",
+        help="build on one shared connection with each layer in its own transaction "
+             "(models within a layer run one at a time)",
+    )
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="continue the last run if it failed or was interrupted, rebuilding only the models it "
+             "didn't finish (uses that run's --select, --full-refresh and --transactional)",
+    )
+    parser.add_argument(
+        "--pytest", action="store_true",
+        help="run the data quality tests through pytest instead of the in-process checks",
+    )
+    return parser.parse_args()
+
+
 def main():
-    # Run pipeline steps in order
-    run_step("Raw Data Loading", "src.pipeline.01_load_raw", "load_raw_data")
-    run_step("Staging Layer", "src.pipeline.02_staging", "create_staging_tables")
-    run_step("Intermediate Layer", "src.pipeline.03_intermediate", "create_intermediate_tables")
-    run_step("Marts Layer", "src.pipeline.04_marts", "create_mart_tables")
-    run_tests()
+    args = parse_args()
+
+    # Build every model (raw -> staging -> intermediate -> marts) in dependency order
+    built = run_step(
+        "Model Build", "src.dag", "run_models",
+        select=args.select, workers=args.workers, full_refresh=args.full_refresh,
+        transactional=args.transactional, resume=args.resume,
+    )
+    if built:
+        if args.pytest:
+            run_tests()
+        elif not run_step("Data Quality", "src.quality", "run_quality_checks"):
+            print("\nERROR: Data quality checks failed! See meta.dq_results for details.")
+            sys.exit(1)
+    else:
+        print("Nothing changed since the last build, skipping data quality tests.\n")
+
+    # Parquet copies of the marts for readers that shouldn't lock the database
+    run_step("Export", "src.pipeline.05_export", "export_marts", full_refresh=args.full_refresh)
+
+    from src.config import DB_PATH
 
     print("Pipeline completed successfully!")
-    print(f"\nDatabase file: {os.path.join(PROJECT_ROOT, 'iff_supply_chain.duckdb')}")
+    print(f"\nDatabase file: {DB_PATH}")
     print("\nTo query the database, run:")
-    print("duckdb iff_supply_chain.duckdb")
+    print(f"duckdb {DB_PATH}")
     print("or")
-    print("python3 -c \"import duckdb; con = duckdb.connect('iff_supply_chain.duckdb')\"")
+    print(f"python3 -c \"import duckdb; con = duckdb.connect('{DB_PATH}')\"")
     print()
 
 
@@ -0,0 +1,156 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import duckdb
+from src.config import DB_PATH, SCHEMA_MARTS, ARROW_BATCH_ROWS
+
+
+# Comparison operators accepted in filters, see get_filter_sql()
+FILTER_OPERATORS = ("=", "!=", "<", "<=", ">", ">=", "in", "not in", "is null", "is not null")
+
+Filter = Union[Tuple[str, str], Tuple[str, str, Any]]
+
+
+def _pyarrow():
+    # pyarrow is only needed by this module, so the pipeline runs without it
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise ImportError("Streaming Arrow exports need pyarrow: pip install pyarrow") from e
+    return pyarrow
+
+
+def _quote(identifier):
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def mart_columns(con, table):
+    """Column names of marts.<table> in order, raising ValueError if there is no such table or view."""
+    columns = [row[0] for row in con.execute("""
+        SELECT column_name
+        FROM information_schema.columns
+        WHERE table_schema = ? AND table_name = ?
+        ORDER BY ordinal_position
+    """, [SCHEMA_MARTS, table]).fetchall()]
+    if not columns:
+        raise ValueError(f"Unknown mart table: {table}")
+    return columns
+
+
+def get_filter_sql(filters, columns):
+    """
+    WHERE clause and parameters for filters on a relation with the given
+    columns. A dict is a set of equality filters; otherwise each filter is
+    (column, operator, value), or (column, operator) for "is null" and
+    "is not null". Values are bound as parameters, and DuckDB pushes the
+    comparisons into the table scan, where they can skip row groups.
+    """
+    if isinstance(filters, dict):
+        filters = [(column, "=", value) for column, value in filters.items()]
+
+    conditions, params = [], []
+    for column, operator, *value in filters:
+        operator = operator.lower()
+        if column not in columns:
+            raise ValueError(f"Unknown column: {column!r}")
+        if operator not in FILTER_OPERATORS:
+            raise ValueError(f"Unsupported filter operator: {operator!r}, use one of {FILTER_OPERATORS}")
+        if len(value) != (0 if operator in ("is null", "is not null") else 1):
+            raise ValueError(f"Filter on {column!r} with {operator!r} takes {'no' if operator.startswith('is') else 'one'} value")
+        if operator in ("is null", "is not null"):
+            conditions.append(f"{_quote(column)} {operator.upper()}")
+        elif operator in ("in", "not in"):
+            values = list(value[0])
+            if not values:
+                # x IN () matches nothing, x NOT IN () everything
+                conditions.append("FALSE" if operator == "in" else "TRUE")
+                continue
+            conditions.append(f"{_quote(column)} {operator.upper()} ({', '.join('?' for _ in values)})")
+            params.extend(values)
+        else:
+            conditions.append(f"{_quote(column)} {operator} ?")
+            params.append(value[0])
+    return " AND ".join(conditions) or "TRUE", params
+
+
+def get_table_sql(con, table, columns=None, filters=None):
+    """SELECT over marts.<table> with only columns and only rows matching filters. Returns (sql, params)."""
+    table_columns = mart_columns(con, table)
+    columns = list(columns) if columns else table_columns
+    unknown = [column for column in columns if column not in table_columns]
+    if unknown:
+        raise ValueError(f"Unknown columns in {SCHEMA_MARTS}.{table}: {unknown}")
+
+    where_clause, params = get_filter_sql(filters or [], table_columns)
+    return f"""
+        SELECT {", ".join(_quote(column) for column in columns)}
+        FROM {SCHEMA_MARTS}.{_quote(table)}
+        WHERE {where_clause}
+    """, params
+
+
+def _stream(con, sql, params, batch_size, close):
+    """RecordBatchReader over sql, closing con once the reader is exhausted or dropped when close is set."""
+    pyarrow = _pyarrow()
+    try:
+        reader = con.execute(sql, params).to_arrow_reader(batch_size)
+    except Exception:
+        if close:
+            con.close()
+        raise
+    if not close:
+        return reader
+
+    def batches():
+        try:
+            yield from reader
+        finally:
+            con.close()
+
+    return pyarrow.RecordBatchReader.from_batches(reader.schema, batches())
+
+
+def stream_query(sql, params=None, batch_size=ARROW_BATCH_ROWS, con=None, db_path=DB_PATH):
+    """
+    Stream the result of sql as Arrow record batches of up to batch_size
+    rows. Only one batch is materialized at a time, and its buffers go to
+    pyarrow, pandas or Polars without being copied into Python objects.
+
+    Without con, a read-only connection to db_path is opened and closed
+    once the reader is exhausted.
+
+        reader = stream_query("SELECT * FROM marts.dim_flavours WHERE is_current")
+        for batch in reader:
+            frame = batch.to_pandas()
+    """
+    close = con is None
+    if close:
+        con = duckdb.connect(db_path, read_only=True)
+    return _stream(con, sql, params or [], batch_size, close)
+
+
+def stream_table(table, columns: Optional[Sequence[str]] = None,
+                 filters: Optional[Union[Dict[str, Any], List[Filter]]] = None,
+                 batch_size=ARROW_BATCH_ROWS, con=None, db_path=DB_PATH):
+    """
+    Stream a mart table as Arrow record batches of up to batch_size rows,
+    reading only columns (all by default) and only the rows matching
+    filters (see get_filter_sql()). Both are pushed down into DuckDB's
+    scan, so unread columns and skipped row groups are never decoded.
+
+        reader = stream_table(
+            "fct_sales_transactions",
+            columns=["transaction_date", "customer_id", "amount_dollars"],
+            filters=[("transaction_date", ">=", date(2024, 1, 1)), ("customer_id", "in", [8, 30])],
+        )
+        polars.from_arrow(reader)
+    """
+    close = con is None
+    if close:
+        con = duckdb.connect(db_path, read_only=True)
+    try:
+        sql, params = get_table_sql(con, table, columns, filters)
+    except Exception:
+        if close:
+            con.close()
+        raise
+    return _stream(con, sql, params, batch_size, close)
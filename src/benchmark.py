@@ -0,0 +1,205 @@
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import duckdb
+from src.config import (
+    PROJECT_ROOT, CSV_FILES, MODEL_WORKERS, BENCHMARK_DIR, BENCHMARK_RESULTS_DB,
+    BENCHMARK_SCALE_FACTORS, BENCHMARK_REGRESSION_THRESHOLD, BENCHMARK_NOISE_SECONDS,
+)
+from src.metrics import RUN_METRICS_TABLE, new_run_id
+from src.synthetic import generate_sources
+from src.utils import log
+
+
+BENCHMARK_RESULTS_TABLE = "benchmark_results"
+
+
+def scale_factor_dir(scale_factor):
+    return os.path.join(BENCHMARK_DIR, f"sf{scale_factor:g}")
+
+
+def prepare_sources(scale_factor, regenerate=False):
+    """Directory holding the generated CSVs for scale_factor, generating them if missing."""
+    raw_dir = os.path.join(scale_factor_dir(scale_factor), "raw")
+    missing = [name for name in CSV_FILES.values() if not os.path.exists(os.path.join(raw_dir, name))]
+    if regenerate or missing:
+        log(f"  generating SF{scale_factor:g} sources in {raw_dir}")
+        start = time.perf_counter()
+        counts = generate_sources(scale_factor, raw_dir)
+        log(f"  -> {sum(counts.values()):,} rows in {time.perf_counter() - start:.1f}s")
+    return raw_dir
+
+
+def build_from_scratch(scale_factor, raw_dir, workers):
+    """
+    Build every model into a new database for scale_factor and return its
+    path. The build runs in a subprocess so it picks up the benchmark's
+    DB_PATH, RAW_DATA_DIR and RAW_CACHE_DIR (see src/config.py) and starts
+    cold. The raw CSV cache is kept per scale factor, so only the first
+    build after generating sources parses them.
+    """
+    db_path = os.path.join(scale_factor_dir(scale_factor), "iff_supply_chain.duckdb")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    env = dict(
+        os.environ,
+        IFF_DB_PATH=db_path,
+        IFF_RAW_DATA_DIR=raw_dir,
+        IFF_RAW_CACHE_DIR=os.path.join(scale_factor_dir(scale_factor), "raw_cache"),
+    )
+    subprocess.run(
+        [sys.executable, "-c", f"from src.dag import run_models; run_models(workers={workers})"],
+        cwd=PROJECT_ROOT, env=env, check=True, stdout=subprocess.DEVNULL,
+    )
+    return db_path
+
+
+def collect_timings(db_path):
+    """
+    Timings of the build in db_path from its meta.run_metrics: one row per
+    table, and one per layer spanning its first table's start to its last
+    table's end (tables in a layer build concurrently).
+    """
+    con = duckdb.connect(db_path, read_only=True)
+    try:
+        return con.execute(f"""
+            WITH tables AS (
+                SELECT
+                    split_part(relation, '.', 1) AS layer,
+                    relation,
+                    started_at,
+                    started_at + to_microseconds((wall_seconds * 1e6)::BIGINT) AS finished_at,
+                    wall_seconds,
+                    rows_written,
+                    peak_memory_bytes
+                FROM {RUN_METRICS_TABLE}
+            )
+            SELECT level, name, wall_seconds, rows_written, peak_memory_bytes
+            FROM (
+                SELECT 'table' AS level, relation AS name, wall_seconds, rows_written, peak_memory_bytes, started_at
+                FROM tables
+                UNION ALL
+                SELECT
+                    'layer',
+                    layer,
+                    epoch(MAX(finished_at) - MIN(started_at)),
+                    SUM(rows_written),
+                    MAX(peak_memory_bytes),
+                    MIN(started_at)
+                FROM tables
+                GROUP BY layer
+            )
+            ORDER BY level, started_at
+        """).fetchall()
+    finally:
+        con.close()
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=PROJECT_ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def create_results_table(con):
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {BENCHMARK_RESULTS_TABLE} (
+            run_id VARCHAR,
+            git_commit VARCHAR,
+            scale_factor DOUBLE,
+            level VARCHAR,
+            name VARCHAR,
+            wall_seconds DOUBLE,
+            rows_written BIGINT,
+            peak_memory_bytes BIGINT,
+            recorded_at TIMESTAMP
+        )
+    """)
+
+
+def find_regressions(con, run_id, threshold=BENCHMARK_REGRESSION_THRESHOLD):
+    """
+    Layers and tables of run_id that took more than threshold times as long
+    as in the previous run at the same scale factor, ignoring differences
+    under BENCHMARK_NOISE_SECONDS. Returns
+    (scale_factor, level, name, previous seconds, seconds) tuples.
+    """
+    return con.execute(f"""
+        WITH previous AS (
+            SELECT scale_factor, MAX(run_id) AS run_id
+            FROM {BENCHMARK_RESULTS_TABLE}
+            WHERE run_id < ?
+            GROUP BY scale_factor
+        )
+        SELECT c.scale_factor, c.level, c.name, p.wall_seconds, c.wall_seconds
+        FROM {BENCHMARK_RESULTS_TABLE} c
+        JOIN previous USING (scale_factor)
+        JOIN {BENCHMARK_RESULTS_TABLE} p
+            ON p.run_id = previous.run_id
+           AND p.scale_factor = c.scale_factor
+           AND p.level = c.level
+           AND p.name = c.name
+        WHERE c.run_id = ?
+          AND c.wall_seconds > p.wall_seconds * ?
+          AND c.wall_seconds - p.wall_seconds > ?
+        ORDER BY c.scale_factor, c.level, c.name
+    """, [run_id, run_id, threshold, BENCHMARK_NOISE_SECONDS]).fetchall()
+
+
+def run_benchmark(scale_factors=None, workers=MODEL_WORKERS, regenerate=False):
+    """
+    Generate sources at each scale factor (SF1 is the size of the shipped
+    CSVs), build the whole pipeline from scratch on them and record the
+    wall time, rows and peak memory of every layer and table in
+    BENCHMARK_RESULTS_DB. Results are compared with the previous run at the
+    same scale factor. Returns the run id.
+    """
+    scale_factors = scale_factors or BENCHMARK_SCALE_FACTORS
+    run_id = new_run_id()
+    commit = git_commit()
+    print(f"Benchmark run id: {run_id} (commit {commit or 'unknown'})")
+
+    os.makedirs(BENCHMARK_DIR, exist_ok=True)
+    results = duckdb.connect(BENCHMARK_RESULTS_DB)
+    try:
+        create_results_table(results)
+        for scale_factor in scale_factors:
+            print(f"\nSF{scale_factor:g}")
+            raw_dir = prepare_sources(scale_factor, regenerate)
+
+            start = time.perf_counter()
+            db_path = build_from_scratch(scale_factor, raw_dir, workers)
+            total_seconds = time.perf_counter() - start
+
+            timings = collect_timings(db_path)
+            recorded_at = datetime.now()
+            results.executemany(f"""
+                INSERT INTO {BENCHMARK_RESULTS_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, [
+                [run_id, commit, scale_factor, level, name, seconds, rows, peak, recorded_at]
+                for level, name, seconds, rows, peak in [("total", "pipeline", total_seconds, None, None), *timings]
+            ])
+
+            log(f"  pipeline: {total_seconds:.2f}s")
+            for level, name, seconds, rows, _ in timings:
+                if level == "layer":
+                    log(f"  {name}: {seconds:.2f}s, {rows or 0:,} rows")
+
+        regressions = find_regressions(results, run_id)
+    finally:
+        results.close()
+
+    if regressions:
+        print(f"\n{len(regressions)} regressions against the previous run:")
+        for scale_factor, level, name, before, after in regressions:
+            log(f"  SF{scale_factor:g} {level} {name}: {before:.2f}s -> {after:.2f}s")
+    print(f"\nResults stored in {BENCHMARK_RESULTS_DB}\n")
+    return run_id
@@ -0,0 +1,184 @@
+import ast
+import hashlib
+import inspect
+import os
+
+from src.config import SCHEMA_META
+from src.layout import get_order_by_sql
+from src.utils import create_schema_if_not_exists, relation_binds, table_exists
+
+
+MANIFEST_TABLE = f"{SCHEMA_META}.build_manifest"
+FILE_HASH_TABLE = f"{SCHEMA_META}.file_hashes"
+
+# Functions defined under here count as the project's code, see _function_code()
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def create_manifest_tables(con):
+    create_schema_if_not_exists(con, SCHEMA_META)
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+            relation VARCHAR PRIMARY KEY,
+            fingerprint VARCHAR,
+            built_at TIMESTAMP
+        )
+    """)
+    con.execute(f"ALTER TABLE {MANIFEST_TABLE} ADD COLUMN IF NOT EXISTS code_hash VARCHAR")
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {FILE_HASH_TABLE} (
+            path VARCHAR PRIMARY KEY,
+            file_size BIGINT,
+            file_mtime DOUBLE,
+            sha256 VARCHAR
+        )
+    """)
+
+
+def hash_file(con, path):
+    """
+    SHA-256 of a file's contents. The hash is remembered per path and only
+    recomputed when the file's size or mtime changes.
+    """
+    if not os.path.exists(path):
+        return "missing"
+
+    stat = os.stat(path)
+    row = con.execute(f"""
+        SELECT sha256
+        FROM {FILE_HASH_TABLE}
+        WHERE path = ? AND file_size = ? AND file_mtime = ?
+    """, [path, stat.st_size, stat.st_mtime]).fetchone()
+    if row is not None:
+        return row[0]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    sha256 = digest.hexdigest()
+
+    con.execute(f"""
+        INSERT OR REPLACE INTO {FILE_HASH_TABLE} VALUES (?, ?, ?, ?)
+    """, [path, stat.st_size, stat.st_mtime, sha256])
+    return sha256
+
+
+def _names_used(code):
+    # Global names read by a code object and the ones nested in it (comprehensions, inner functions)
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names |= _names_used(const)
+    return names
+
+
+def _is_literal(value):
+    try:
+        return ast.literal_eval(repr(value)) == value
+    except (ValueError, SyntaxError):
+        return False
+
+
+def _function_code(func, seen):
+    """
+    Source of func and of every function of this project it calls, with
+    the values of the constants and closure variables they read, following
+    calls through closures and module globals.
+    """
+    if func in seen:
+        return ""
+    seen.add(func)
+
+    values = []
+    for cell in func.__closure__ or ():
+        try:
+            values.append(cell.cell_contents)
+        except ValueError:
+            # Closure variable not assigned yet
+            pass
+    values += [func.__globals__[name] for name in sorted(_names_used(func.__code__)) if name in func.__globals__]
+
+    parts = [inspect.getsource(func)]
+    for value in values:
+        if inspect.isfunction(value) and (inspect.getsourcefile(value) or "").startswith(SOURCE_DIR):
+            parts.append(_function_code(value, seen))
+        elif not inspect.ismodule(value) and not callable(value) and _is_literal(value):
+            parts.append(repr(value))
+    return "\n".join(parts)
+
+
+def _model_code(model):
+    # SQL models are identified by their SQL text, row order and how they
+    # are stored. Custom run() models by the source of run() and of the
+    # helpers it calls, so editing an unrelated model in the same module
+    # doesn't count as a change.
+    if model.sql is not None:
+        code = model.sql + get_order_by_sql(model.sort_by)
+        if model.materialized != "table":
+            code += f" -- materialized: {model.materialized}"
+        return code
+    return _function_code(model.run, set())
+
+
+def code_hash(model):
+    return hashlib.sha256(_model_code(model).encode()).hexdigest()
+
+
+def code_changed(con, model):
+    """True if the model was built before with different code."""
+    row = con.execute(f"""
+        SELECT code_hash
+        FROM {MANIFEST_TABLE}
+        WHERE relation = ?
+    """, [model.relation]).fetchone()
+    return row is not None and row[0] != code_hash(model)
+
+
+def compute_fingerprints(con, models):
+    """
+    Fingerprint every model from its code, its params, the contents of its
+    source files and the fingerprints of its upstream models.
+    """
+    by_relation = {model.relation: model for model in models}
+    fingerprints = {}
+
+    def fingerprint(relation):
+        if relation not in fingerprints:
+            model = by_relation[relation]
+            digest = hashlib.sha256()
+            digest.update(relation.encode())
+            digest.update(_model_code(model).encode())
+            digest.update(repr(sorted(model.params.items())).encode())
+            for path in model.source_files:
+                digest.update(hash_file(con, path).encode())
+            for dep in sorted(model.depends_on):
+                digest.update(fingerprint(dep).encode())
+            fingerprints[relation] = digest.hexdigest()
+        return fingerprints[relation]
+
+    for model in models:
+        fingerprint(model.relation)
+    return fingerprints
+
+
+def is_up_to_date(con, model, fingerprint):
+    row = con.execute(f"""
+        SELECT fingerprint
+        FROM {MANIFEST_TABLE}
+        WHERE relation = ?
+    """, [model.relation]).fetchone()
+    if row is None or row[0] != fingerprint:
+        return False
+    # Ephemeral models store nothing to check for
+    if model.materialized == "ephemeral":
+        return True
+    # Views must still bind, e.g. raw views whose cached Parquet files were deleted
+    return table_exists(con, model.schema, model.name) and relation_binds(con, model.relation)
+
+
+def record_build(con, model, fingerprint):
+    con.execute(f"""
+        INSERT OR REPLACE INTO {MANIFEST_TABLE} (relation, fingerprint, built_at, code_hash)
+        VALUES (?, ?, CURRENT_TIMESTAMP, ?)
+    """, [model.relation, fingerprint, code_hash(model)])
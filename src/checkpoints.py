@@ -0,0 +1,149 @@
+from datetime import datetime
+
+from src.config import SCHEMA_META
+from src.utils import create_schema_if_not_exists, log, relation_binds, table_exists
+
+
+PIPELINE_RUNS_TABLE = f"{SCHEMA_META}.pipeline_runs"
+CHECKPOINTS_TABLE = f"{SCHEMA_META}.model_checkpoints"
+
+
+def create_checkpoint_tables(con):
+    create_schema_if_not_exists(con, SCHEMA_META)
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {PIPELINE_RUNS_TABLE} (
+            run_id VARCHAR PRIMARY KEY,
+            selector VARCHAR,
+            full_refresh BOOLEAN,
+            transactional BOOLEAN,
+            status VARCHAR,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    """)
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {CHECKPOINTS_TABLE} (
+            run_id VARCHAR,
+            relation VARCHAR,
+            status VARCHAR,
+            fingerprint VARCHAR,
+            row_count BIGINT,
+            error VARCHAR,
+            updated_at TIMESTAMP,
+            PRIMARY KEY (run_id, relation)
+        )
+    """)
+
+
+def start_run(con, run_id, select, full_refresh, transactional):
+    con.execute(f"""
+        INSERT OR REPLACE INTO {PIPELINE_RUNS_TABLE} VALUES (?, ?, ?, ?, 'running', ?, NULL)
+    """, [run_id, select, full_refresh, transactional, datetime.now()])
+
+
+def finish_run(con, run_id, status):
+    con.execute(f"""
+        UPDATE {PIPELINE_RUNS_TABLE}
+        SET status = ?, finished_at = ?
+        WHERE run_id = ?
+    """, [status, datetime.now(), run_id])
+
+
+def last_unfinished_run(con):
+    """The most recent run if it failed or never finished (e.g. the process was killed), else None."""
+    row = con.execute(f"""
+        SELECT run_id, selector, full_refresh, transactional, status
+        FROM {PIPELINE_RUNS_TABLE}
+        ORDER BY started_at DESC
+        LIMIT 1
+    """).fetchone()
+    if row is None or row[4] == "succeeded":
+        return None
+    return {"run_id": row[0], "select": row[1], "full_refresh": row[2], "transactional": row[3]}
+
+
+def save_checkpoint(con, run_id, relation, status, fingerprint=None, row_count=None, error=None):
+    """
+    Record where a model got to in a run: "running", "done" (built),
+    "skipped" (already up to date) or "failed".
+    """
+    con.execute(f"""
+        INSERT OR REPLACE INTO {CHECKPOINTS_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, [run_id, relation, status, fingerprint, row_count, error, datetime.now()])
+
+
+def _estimated_row_count(con, relation):
+    row = con.execute("""
+        SELECT estimated_size
+        FROM duckdb_tables()
+        WHERE schema_name || '.' || table_name = ?
+    """, [relation]).fetchone()
+    return row[0] if row else None
+
+
+def output_row_count(con, model, metrics):
+    """
+    Rows in a model's table, recorded with its checkpoint without scanning
+    it. SQL models report their whole table as rows written. Run models may
+    only have appended or upserted rows, so they get DuckDB's catalog
+    estimate, which doesn't see uncommitted rows. None for views, ephemeral
+    models and raw tables that are views over cached Parquet.
+    """
+    if model.materialized in ("view", "ephemeral"):
+        return None
+    if model.run is None:
+        return metrics["rows_written"]
+    return _estimated_row_count(con, model.relation)
+
+
+def is_intact(con, model, checkpoint, fingerprint):
+    """
+    True if a model checkpointed as done or skipped can be trusted without
+    building it again: its inputs and code still have the fingerprint it
+    was checkpointed with, and its output still exists with the same
+    number of rows (counted for SQL models, estimated for run models, as
+    in output_row_count). Views must still bind, so e.g. a raw view whose
+    Parquet file is gone is rebuilt.
+    """
+    status, checkpoint_fingerprint, row_count = checkpoint
+    if status not in ("done", "skipped") or checkpoint_fingerprint != fingerprint:
+        return False
+    if model.materialized == "ephemeral":
+        return True
+    if not (table_exists(con, model.schema, model.name) and relation_binds(con, model.relation)):
+        return False
+    if row_count is None:
+        return True
+    if model.run is None:
+        return con.execute(f"SELECT COUNT(*) FROM {model.relation}").fetchone()[0] == row_count
+    return _estimated_row_count(con, model.relation) == row_count
+
+
+def completed_models(con, run_id, models, fingerprints):
+    """
+    Relations of models (in dependency order) that run_id already finished
+    and that don't need building again on resume: the model itself is
+    intact, and so is every upstream model in the run. Anything
+    downstream of a model that has to be rebuilt is rebuilt too.
+    """
+    checkpoints = {
+        row[0]: row[1:]
+        for row in con.execute(f"""
+            SELECT relation, status, fingerprint, row_count
+            FROM {CHECKPOINTS_TABLE}
+            WHERE run_id = ?
+        """, [run_id]).fetchall()
+    }
+    relations = {model.relation for model in models}
+    completed = set()
+    for model in models:
+        checkpoint = checkpoints.get(model.relation)
+        if checkpoint is None:
+            continue
+        if not all(dep in completed for dep in model.depends_on if dep in relations):
+            continue
+        if is_intact(con, model, checkpoint, fingerprints[model.relation]):
+            completed.add(model.relation)
+        elif checkpoint[0] in ("done", "skipped"):
+            log(f"  {model.relation}: output changed since run {run_id} checkpointed it, rebuilding")
+    return completed
@@ -3,14 +3,16 @@ import os
 # The root of the project (two levels up from this file: src/config.py -> project root)
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-DB_PATH = os.path.join(PROJECT_ROOT, "iff_supply_chain.duckdb")
+# Both can be pointed elsewhere, e.g. at generated data for benchmarks (src/benchmark.py)
+DB_PATH = os.environ.get("IFF_DB_PATH", os.path.join(PROJECT_ROOT, "iff_supply_chain.duckdb"))
 
-RAW_DATA_DIR = os.path.join(PROJECT_ROOT, "data", "raw")
+RAW_DATA_DIR = os.environ.get("IFF_RAW_DATA_DIR", os.path.join(PROJECT_ROOT, "data", "raw"))
 
 SCHEMA_RAW = "raw"
 SCHEMA_STAGING = "staging"
 SCHEMA_INTERMEDIATE = "intermediate"
 SCHEMA_MARTS = "marts"
+SCHEMA_META = "meta"
 
 CSV_FILES = {
     "customers": "customers.csv",
@@ -21,3 +23,151 @@ CSV_FILES = {
     "recipes": "recipes.csv",
     "sales_transactions": "sales_transactions.csv",
 }
+
+# Date formats found in the source files. Two-digit years must be tried
+# before four-digit ones: '%m/%d/%Y' happily reads '5/5/24' as year 0024.
+DATE_FORMATS = ["%m/%d/%y", "%m/%d/%Y", "%-d-%b-%y"]
+
+# Source contracts: the columns each CSV must have, in file order, with the
+# type the raw loader reads them as. Columns are nullable unless marked
+# otherwise. Dates stay as text in the raw layer; "date_formats" lists the
+# formats every value must match and staging parses them with.
+SOURCE_SCHEMAS = {
+    "customers": {
+        "customer_id": {"type": "BIGINT", "nullable": False},
+        "name": {"type": "VARCHAR"},
+        "location_city": {"type": "VARCHAR"},
+        "location_country": {"type": "VARCHAR"},
+        "generation_date": {"type": "VARCHAR", "date_formats": ["%m/%d/%Y"]},
+        "batch_number": {"type": "INTEGER", "nullable": False},
+    },
+    "providers": {
+        "provider_id": {"type": "BIGINT", "nullable": False},
+        "name": {"type": "VARCHAR"},
+        "location_city": {"type": "VARCHAR"},
+        "location_country": {"type": "VARCHAR"},
+        "generation_date": {"type": "VARCHAR", "date_formats": ["%m/%d/%y"]},
+        "batch_number": {"type": "INTEGER", "nullable": False},
+    },
+    "raw_materials": {
+        "raw_material_id": {"type": "BIGINT", "nullable": False},
+        "name": {"type": "VARCHAR"},
+        "generation_date": {"type": "VARCHAR", "date_formats": ["%m/%d/%y"]},
+        "batch_number": {"type": "INTEGER", "nullable": False},
+    },
+    "ingredients": {
+        "ingredient_id": {"type": "BIGINT", "nullable": False},
+        "name": {"type": "VARCHAR"},
+        "chemical_formula": {"type": "VARCHAR"},
+        "weight_in_grams": {"type": "DOUBLE"},
+        "cost_per_gram": {"type": "DOUBLE"},
+        "provider_id": {"type": "BIGINT"},
+        "generation_date": {"type": "VARCHAR", "date_formats": ["%-d-%b-%y"]},
+        "batch_number": {"type": "INTEGER", "nullable": False},
+    },
+    "flavours": {
+        "flavour_id": {"type": "BIGINT", "nullable": False},
+        "name": {"type": "VARCHAR"},
+        "description": {"type": "VARCHAR"},
+        "generation_date": {"type": "VARCHAR", "date_formats": ["%m/%d/%y"]},
+        "batch_number": {"type": "INTEGER", "nullable": False},
+    },
+    "recipes": {
+        "recipe_id": {"type": "VARCHAR", "nullable": False},
+        "raw_material_id": {"type": "BIGINT"},
+        "raw_material_ratio": {"type": "DOUBLE"},
+        "flavour_id": {"type": "BIGINT"},
+        "flavour_ratio": {"type": "DOUBLE"},
+        "ingredient_id": {"type": "BIGINT"},
+        "ingredient_ratio": {"type": "DOUBLE"},
+        "heat_process": {"type": "VARCHAR"},
+        "yield": {"type": "DOUBLE"},
+        "generation_date": {"type": "VARCHAR", "date_formats": DATE_FORMATS},
+        "batch_number": {"type": "INTEGER", "nullable": False},
+    },
+    "sales_transactions": {
+        "transaction_id": {"type": "BIGINT", "nullable": False},
+        "customer_id": {"type": "BIGINT"},
+        "flavour_id": {"type": "BIGINT"},
+        "quantity_liters": {"type": "BIGINT"},
+        "transaction_date": {"type": "VARCHAR", "date_formats": ["%m/%d/%y"]},
+        "transaction_country": {"type": "VARCHAR"},
+        "transaction_town": {"type": "VARCHAR"},
+        "postal_code": {"type": "VARCHAR"},
+        "amount_dollar": {"type": "DOUBLE"},
+        "generation_date": {"type": "VARCHAR", "date_formats": ["%m/%d/%y"]},
+        "batch_number": {"type": "INTEGER", "nullable": False},
+    },
+}
+
+# "incremental" appends only new batches (tracked in meta.raw_watermarks);
+# "full" rebuilds every raw table from its CSV on each run.
+RAW_LOAD_MODE = "incremental"
+
+# Column used as the per-table load watermark. Batches are append-only.
+RAW_WATERMARK_COLUMN = "batch_number"
+
+# Worker threads used to parse raw CSVs concurrently. Parsed files are
+# committed to the database one at a time. Set to 1 to load sequentially.
+RAW_LOAD_WORKERS = min(len(CSV_FILES), os.cpu_count() or 1)
+
+# Parquet copies of parsed raw CSVs, see src/pipeline/01_load_raw.py. A full
+# load of a CSV that was parsed before, under the same source contract,
+# reads the copy instead of parsing the text again. IFF_RAW_CACHE=0 turns
+# the cache off.
+RAW_CACHE_ENABLED = os.environ.get("IFF_RAW_CACHE", "1") == "1"
+RAW_CACHE_DIR = os.environ.get("IFF_RAW_CACHE_DIR", os.path.join(PROJECT_ROOT, ".raw_cache"))
+RAW_CACHE_COMPRESSION = "zstd"
+
+# Log how many row groups a filter on each sort column reads after a sorted
+# model is built (src/layout.py). Measuring it scans the table, so it is only
+# done with IFF_PRUNING_STATS=1.
+PRUNING_STATS = os.environ.get("IFF_PRUNING_STATS", "0") == "1"
+
+# Models (tables) built at the same time by the DAG runner, see src/dag.py.
+MODEL_WORKERS = min(4, os.cpu_count() or 1)
+
+# Threads used by the in-process data quality checks, see src/quality.py.
+# Each table scan and each referential-integrity query is one task.
+DQ_WORKERS = min(8, os.cpu_count() or 1)
+
+# Parquet export of the marts layer, see src/pipeline/05_export.py.
+# Partitioned tables are written Hive-style (column=value directories) and
+# rows are sorted within every file so readers can prune row groups by min/max.
+EXPORT_DIR = os.environ.get("IFF_EXPORT_DIR", os.path.join(PROJECT_ROOT, "export"))
+EXPORT_PARTITION_BY = {
+    "fct_sales_transactions": ["transaction_year", "transaction_quarter"],
+}
+EXPORT_SORT_BY = {
+    "fct_sales_transactions": ["transaction_date", "customer_id"],
+}
+
+# Rows per record batch streamed by the Arrow export API (src/arrow_export.py).
+# Only one batch is held in memory at a time.
+ARROW_BATCH_ROWS = 122_880
+
+# Out-of-core mode for data larger than RAM, switched on with IFF_OUT_OF_CORE=1.
+# Every connection then gets a memory cap and spills to TEMP_DIRECTORY, and
+# models with a chunk_by column are built about CHUNK_ROWS rows at a time
+# (see Model in src/dag.py).
+OUT_OF_CORE = os.environ.get("IFF_OUT_OF_CORE") == "1"
+MEMORY_LIMIT = os.environ.get("IFF_MEMORY_LIMIT", "2GB")
+THREADS = int(os.environ.get("IFF_THREADS", min(4, os.cpu_count() or 1)))
+TEMP_DIRECTORY = os.environ.get("IFF_TEMP_DIRECTORY", os.path.join(PROJECT_ROOT, ".duckdb_tmp"))
+CHUNK_ROWS = int(os.environ.get("IFF_CHUNK_ROWS", 1_000_000))
+
+# Read-only connections kept open by the query-serving API (src/serving), and
+# how many recent calls per query its latency percentiles are computed over.
+SERVING_POOL_SIZE = min(8, os.cpu_count() or 1)
+SERVING_LATENCY_WINDOW = 1000
+
+# Pipeline benchmarks on generated data, see src/benchmark.py. Each scale
+# factor gets its own CSVs and database under BENCHMARK_DIR, and results
+# from every run are kept in BENCHMARK_RESULTS_DB for comparison.
+BENCHMARK_DIR = os.environ.get("IFF_BENCHMARK_DIR", os.path.join(PROJECT_ROOT, "benchmarks"))
+BENCHMARK_RESULTS_DB = os.path.join(BENCHMARK_DIR, "results.duckdb")
+BENCHMARK_SCALE_FACTORS = [1, 10, 100, 1000]
+# A table or layer counts as a regression when it is this much slower than
+# last time, and by more than BENCHMARK_NOISE_SECONDS
+BENCHMARK_REGRESSION_THRESHOLD = 1.2
+BENCHMARK_NOISE_SECONDS = 0.1
@@ -0,0 +1,549 @@
+import glob
+import importlib
+import os
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional
+
+import duckdb
+from src.build_cache import (
+    create_manifest_tables, compute_fingerprints, code_changed, is_up_to_date, record_build,
+)
+from src.checkpoints import (
+    create_checkpoint_tables, start_run, finish_run, last_unfinished_run,
+    save_checkpoint, output_row_count, completed_models,
+)
+from src.config import MODEL_WORKERS, OUT_OF_CORE, CHUNK_ROWS, TEMP_DIRECTORY, PRUNING_STATS
+from src.incremental import create_incremental_state_table, reset_incremental
+from src.layout import get_order_by_sql, log_pruning_stats
+from src.metrics import new_run_id, create_run_metrics_table, build_with_metrics, record_metrics
+from src.utils import get_connection, create_schema_if_not_exists, drop_relation, log, transaction
+
+
+# Layer modules, in layer order. Each one exposes a MODELS list.
+PIPELINE_MODULES = [
+    "src.pipeline.01_load_raw",
+    "src.pipeline.02_staging",
+    "src.pipeline.03_intermediate",
+    "src.pipeline.04_marts",
+]
+
+# How a model is stored, see Model.materialized
+MATERIALIZATIONS = ("table", "view", "ephemeral", "incremental")
+
+
+@dataclass
+class Model:
+    """
+    One table in the pipeline.
+
+    A model is either a single SELECT (``sql``), materialized with
+    CREATE OR REPLACE TABLE, or a custom ``run(con)`` callable for builds
+    that need more than one statement and return the number of rows they
+    wrote. ``depends_on`` lists the upstream relations as "schema.table".
+
+    ``materialized`` says how a SQL model is stored: a "table" (the
+    default), a "view", or "ephemeral", which stores nothing and is inlined
+    as a CTE into the SQL of every model reading it. Views and ephemeral
+    models save copying data that is only read once downstream. Run models
+    can't read ephemeral models.
+
+    ``source_files`` and ``params`` are the model's other inputs (files it
+    reads, settings it is built with). Together with the code and upstream
+    models they make up its build fingerprint, see src/build_cache.py.
+
+    "incremental" run models merge new data into the table they built last
+    time and keep their progress in meta.incremental_state (src/incremental.py).
+    A full refresh, or a change to the model's code, drops that table and
+    state before building. Run models that keep their progress elsewhere,
+    like the raw loaders' watermarks, pass a ``reset(con)`` callable that
+    forgets it, and a full refresh calls that instead.
+
+    SQL models that only transform rows one at a time can set ``chunk_by``
+    to one of their output columns. In out-of-core mode they are then
+    built in hash buckets of that column, about CHUNK_ROWS rows each, so
+    no single statement has to hold the whole table. The input is read
+    once, into one Parquet file per bucket under TEMP_DIRECTORY, and the
+    buckets are then appended one at a time.
+
+    ``sort_by`` columns set the physical row order of SQL models, so
+    DuckDB's per-row-group min/max statistics can skip row groups for
+    filters on them (src/layout.py). Chunked builds then split on ranges of
+    the first sort column instead of hash buckets, keeping the table in
+    order. Run models apply their own ordering. With PRUNING_STATS, the
+    pruning statistics of each sort column are logged after every build.
+    Neither applies to views and ephemeral models.
+    """
+    name: str
+    schema: str
+    sql: Optional[str] = None
+    depends_on: List[str] = field(default_factory=list)
+    run: Optional[Callable[[duckdb.DuckDBPyConnection], Optional[int]]] = None
+    reset: Optional[Callable[[duckdb.DuckDBPyConnection], None]] = None
+    source_files: List[str] = field(default_factory=list)
+    params: Dict[str, Any] = field(default_factory=dict)
+    materialized: str = "table"
+    chunk_by: Optional[str] = None
+    sort_by: List[str] = field(default_factory=list)
+
+    def __post_init__(self):
+        if self.materialized not in MATERIALIZATIONS:
+            raise ValueError(f"{self.relation}: materialized must be one of {MATERIALIZATIONS}")
+        if self.materialized in ("view", "ephemeral") and self.sql is None:
+            raise ValueError(f"{self.relation}: only SQL models can be {self.materialized}")
+        if self.materialized == "incremental" and self.run is None:
+            raise ValueError(f"{self.relation}: incremental models need a run() callable")
+
+    @property
+    def relation(self) -> str:
+        return f"{self.schema}.{self.name}"
+
+    @property
+    def incremental(self) -> bool:
+        return self.materialized == "incremental"
+
+    def reset_progress(self, con: duckdb.DuckDBPyConnection):
+        """Forget what earlier builds loaded or merged, so the next build starts from scratch."""
+        if self.reset is not None:
+            self.reset(con)
+        elif self.incremental:
+            reset_incremental(con, self.relation)
+
+    def build(self, con: duckdb.DuckDBPyConnection) -> Optional[int]:
+        """Build the model and return the number of rows written (None for views and ephemeral models)."""
+        rows = self.materialize(con)
+        self.log_layout(con)
+        return rows
+
+    def materialize(self, con: duckdb.DuckDBPyConnection) -> Optional[int]:
+        """build() without the logging afterwards, so the model's own statement is the last one run."""
+        if self.materialized == "ephemeral":
+            # Nothing to store, drop whatever an earlier materialization left
+            drop_relation(con, self.relation)
+            log(f"  {self.relation}: ephemeral, inlined into its consumers")
+            return None
+
+        if self.materialized == "view":
+            drop_relation(con, self.relation, keep="view")
+            con.execute(f"CREATE OR REPLACE VIEW {self.relation} AS {self.compiled_sql()}")
+            log(f"  {self.relation}: view")
+            return None
+
+        if self.run is not None:
+            rows = self.run(con)
+        else:
+            drop_relation(con, self.relation, keep="table")
+            chunks = self.chunk_count(con)
+            if chunks > 1:
+                rows = self.build_chunked(con, chunks)
+            else:
+                rows = con.execute(f"""
+                    CREATE OR REPLACE TABLE {self.relation} AS
+                    SELECT * FROM ({self.compiled_sql()}) {get_order_by_sql(self.sort_by)}
+                """).fetchone()[0]
+                log(f"  {self.relation}: {rows:,} rows")
+        return rows
+
+    def log_layout(self, con: duckdb.DuckDBPyConnection):
+        """With PRUNING_STATS, log how well filters on the sort columns skip row groups (scans the table)."""
+        if self.sort_by and PRUNING_STATS and self.materialized not in ("view", "ephemeral"):
+            log_pruning_stats(con, self.relation, self.sort_by)
+
+    def ephemeral_upstream(self, models=None) -> List["Model"]:
+        """Ephemeral models this model reads, directly or through other ephemeral models, upstream first."""
+        models = registered_models() if models is None else models
+        found = []
+
+        def visit(model):
+            for dep in model.depends_on:
+                upstream = models.get(dep)
+                if upstream is not None and upstream.materialized == "ephemeral" and upstream not in found:
+                    visit(upstream)
+                    found.append(upstream)
+
+        visit(self)
+        return found
+
+    def compiled_sql(self, models=None) -> str:
+        """``sql`` with every ephemeral upstream model inlined as a CTE named after it."""
+        ephemerals = self.ephemeral_upstream(models)
+        if not ephemerals:
+            return self.sql
+
+        def inline(sql):
+            for model in ephemerals:
+                sql = re.sub(rf"\b{re.escape(model.relation)}\b", model.name, sql)
+            return sql
+
+        ctes = ",\n".join(f"{model.name} AS ({inline(model.sql)})" for model in ephemerals)
+        return f"WITH {ctes}\nSELECT * FROM ({inline(self.sql)})"
+
+    def input_tables(self, models=None) -> List[str]:
+        """Stored tables this model reads, looking through views and ephemeral models."""
+        models = registered_models() if models is None else models
+        tables = []
+        for dep in self.depends_on:
+            upstream = models.get(dep)
+            if upstream is not None and upstream.materialized in ("view", "ephemeral"):
+                tables.extend(upstream.input_tables(models))
+            else:
+                tables.append(dep)
+        return list(dict.fromkeys(tables))
+
+    def chunk_count(self, con: duckdb.DuckDBPyConnection) -> int:
+        if not (OUT_OF_CORE and self.chunk_by and self.depends_on):
+            return 1
+        # Size the chunks from the largest input's row count estimate, which
+        # DuckDB keeps in its catalog, rather than scanning anything
+        tables = self.input_tables()
+        placeholders = ", ".join("?" for _ in tables)
+        sizes = dict(con.execute(f"""
+            SELECT schema_name || '.' || table_name, estimated_size
+            FROM duckdb_tables()
+            WHERE schema_name || '.' || table_name IN ({placeholders})
+        """, tables).fetchall())
+        # With the raw cache on, raw tables are views over Parquet files, and
+        # counting their rows only reads the files' metadata
+        views = con.execute(f"""
+            SELECT schema_name || '.' || view_name
+            FROM duckdb_views()
+            WHERE schema_name || '.' || view_name IN ({placeholders})
+        """, tables).fetchall()
+        for (view,) in views:
+            sizes[view] = con.execute(f"SELECT COUNT(*) FROM {view}").fetchone()[0]
+        return max(1, -(-max(sizes.values(), default=0) // CHUNK_ROWS))
+
+    def chunk_sql(self, con: duckdb.DuckDBPyConnection, chunks: int) -> str:
+        """SQL expression numbering the chunk (0 to chunks - 1) each output row goes into."""
+        if not self.sort_by:
+            return f"hash({self.chunk_by}) % {chunks}"
+
+        # Ranges of the first sort column, so the chunks are appended in order
+        column = self.sort_by[0]
+        fractions = ", ".join(str(chunk / chunks) for chunk in range(1, chunks))
+        bounds = con.execute(f"""
+            SELECT approx_quantile({column}, [{fractions}]) FROM ({self.compiled_sql()})
+        """).fetchone()[0] or []
+        # String literals, cast to the column's type when compared
+        bounds = ["'" + str(bound).replace("'", "''") + "'" for bound in bounds if bound is not None]
+        cases = " ".join(f"WHEN {column} < {bound} THEN {chunk}" for chunk, bound in enumerate(bounds))
+        # NULLs sort last
+        return f"CASE {cases} ELSE {len(bounds)} END" if bounds else "0"
+
+    def build_chunked(self, con: duckdb.DuckDBPyConnection, chunks: int) -> int:
+        # One scan of the input splits it into a Parquet file per chunk, so
+        # each chunk then reads only its own rows
+        directory = os.path.join(TEMP_DIRECTORY, "chunks", self.relation)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(os.path.dirname(directory), exist_ok=True)
+        try:
+            con.execute(f"""
+                COPY (SELECT *, {self.chunk_sql(con, chunks)} AS _chunk FROM ({self.compiled_sql()}))
+                TO '{directory}' (FORMAT parquet, PARTITION_BY (_chunk))
+            """)
+            # Empty chunks write no files
+            chunk_files = [
+                files for files in (
+                    os.path.join(directory, f"_chunk={chunk}", "*.parquet") for chunk in range(chunks)
+                )
+                if glob.glob(files)
+            ]
+            with transaction(con):
+                # LIMIT 0 only plans the SELECT, for the column types
+                con.execute(f"CREATE OR REPLACE TABLE {self.relation} AS SELECT * FROM ({self.compiled_sql()}) LIMIT 0")
+                rows = 0
+                for files in chunk_files:
+                    rows += con.execute(f"""
+                        INSERT INTO {self.relation}
+                        SELECT * FROM read_parquet('{files}', hive_partitioning = false)
+                        {get_order_by_sql(self.sort_by)}
+                    """).fetchone()[0]
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        log(f"  {self.relation}: {rows:,} rows ({len(chunk_files)} chunks)")
+        return rows
+
+
+def load_models() -> List[Model]:
+    """All registered models, keyed by layer order then declaration order."""
+    models = []
+    for module_path in PIPELINE_MODULES:
+        models.extend(importlib.import_module(module_path).MODELS)
+
+    by_relation = {model.relation: model for model in models}
+    for model in models:
+        missing = [dep for dep in model.depends_on if dep not in by_relation]
+        if missing:
+            raise ValueError(f"{model.relation} depends on unknown models: {missing}")
+        if model.run is not None:
+            ephemeral = [dep for dep in model.depends_on if by_relation[dep].materialized == "ephemeral"]
+            if ephemeral:
+                raise ValueError(f"{model.relation} is a run() model and can't read ephemeral models: {ephemeral}")
+    return models
+
+
+@lru_cache(maxsize=None)
+def registered_models() -> Dict[str, Model]:
+    """load_models() keyed by relation, loaded once per process."""
+    return {model.relation: model for model in load_models()}
+
+
+def _find_model(models, name):
+    for model in models:
+        if name in (model.name, model.relation):
+            return model
+    raise ValueError(f"Unknown model in selector: {name}")
+
+
+def _walk(start, edges):
+    seen = set()
+    stack = [start]
+    while stack:
+        relation = stack.pop()
+        for nxt in edges.get(relation, ()):
+            if nxt not in seen:
+                seen.add(nxt)
+                stack.append(nxt)
+    return seen
+
+
+def select_models(models: List[Model], select: Optional[str]) -> List[Model]:
+    """
+    Filter models with dbt-style selectors, separated by commas or spaces:
+
+        stg_flavours      just that model
+        int_flavours+     the model and everything downstream of it
+        +dim_flavours     the model and everything upstream of it
+        +dim_flavours+    both
+    """
+    if not select:
+        return list(models)
+
+    upstream = {model.relation: set(model.depends_on) for model in models}
+    downstream = {}
+    for model in models:
+        for dep in model.depends_on:
+            downstream.setdefault(dep, set()).add(model.relation)
+
+    selected = set()
+    for selector in select.replace(",", " ").split():
+        name = selector.strip("+")
+        relation = _find_model(models, name).relation
+        selected.add(relation)
+        if selector.endswith("+"):
+            selected |= _walk(relation, downstream)
+        if selector.startswith("+"):
+            selected |= _walk(relation, upstream)
+
+    return [model for model in models if model.relation in selected]
+
+
+def topological_order(models: List[Model]) -> List[Model]:
+    """Models sorted so every model comes after the models it depends on."""
+    by_relation = {model.relation: model for model in models}
+    ordered = []
+    state = {}
+
+    def visit(relation):
+        if state.get(relation) == "done":
+            return
+        if state.get(relation) == "visiting":
+            raise ValueError(f"Dependency cycle between models through {relation}")
+        state[relation] = "visiting"
+        for dep in by_relation[relation].depends_on:
+            if dep in by_relation:
+                visit(dep)
+        state[relation] = "done"
+        ordered.append(by_relation[relation])
+
+    for model in models:
+        visit(model.relation)
+    return ordered
+
+
+def _build_on_cursor(con, model):
+    cursor = con.cursor()
+    try:
+        return build_with_metrics(cursor, model)
+    finally:
+        cursor.close()
+
+
+def _finish_build(con, future, model, fingerprint, run_id):
+    """
+    Record a build that finished on the pool: its manifest entry, metrics
+    and "done" checkpoint, or its "failed" checkpoint. Returns the error if
+    it failed.
+    """
+    try:
+        metrics = future.result()
+    except Exception as e:
+        log(f"\nERROR building {model.relation}")
+        save_checkpoint(con, run_id, model.relation, "failed", fingerprint, error=str(e))
+        return e
+    record_build(con, model, fingerprint)
+    record_metrics(con, run_id, model.relation, metrics)
+    save_checkpoint(con, run_id, model.relation, "done", fingerprint, output_row_count(con, model, metrics))
+    return None
+
+
+def _run_parallel(con, models, fingerprints, workers, run_id):
+    """Build models on a thread pool, starting each one as soon as its upstream models are done."""
+    relations = {model.relation for model in models}
+    pending = {
+        model.relation: {dep for dep in model.depends_on if dep in relations}
+        for model in models
+    }
+    by_relation = {model.relation: model for model in models}
+    built = []
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        running = {}
+        while pending or running:
+            for relation in [relation for relation, deps in pending.items() if not deps]:
+                del pending[relation]
+                save_checkpoint(con, run_id, relation, "running", fingerprints[relation])
+                running[pool.submit(_build_on_cursor, con, by_relation[relation])] = relation
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                relation = running.pop(future)
+                error = _finish_build(con, future, by_relation[relation], fingerprints[relation], run_id)
+                if error is not None:
+                    # Let models already in flight finish and checkpoint them,
+                    # so a resume doesn't build them again; start nothing new
+                    wait(running)
+                    for other, other_relation in running.items():
+                        model = by_relation[other_relation]
+                        if _finish_build(con, other, model, fingerprints[other_relation], run_id) is None:
+                            built.append(other_relation)
+                    raise error
+                built.append(relation)
+                for deps in pending.values():
+                    deps.discard(relation)
+    return built
+
+
+def _run_transactional(con, models, fingerprints, run_id):
+    """
+    Build models one layer (schema) at a time on the shared connection,
+    each layer in a single transaction. Other readers see the old version
+    of a layer until all of its models have built, and a failure rolls the
+    whole layer back. Models are checkpointed as done once their layer has
+    committed.
+    """
+    layers = {}
+    for model in models:
+        layers.setdefault(model.schema, []).append(model)
+
+    built = []
+    for schema, layer_models in layers.items():
+        log(f"  -- {schema} layer (single transaction)")
+        layer_metrics = []
+        try:
+            with transaction(con):
+                for model in layer_models:
+                    failed = model
+                    metrics = build_with_metrics(con, model)
+                    record_build(con, model, fingerprints[model.relation])
+                    record_metrics(con, run_id, model.relation, metrics)
+                    layer_metrics.append((model, metrics))
+        except Exception as e:
+            log(f"\nERROR building {failed.relation}, rolling back the {schema} layer")
+            save_checkpoint(con, run_id, failed.relation, "failed", fingerprints[failed.relation], error=str(e))
+            raise
+        # Row count estimates only see the layer's rows once it has committed
+        for model, metrics in layer_metrics:
+            save_checkpoint(con, run_id, model.relation, "done", fingerprints[model.relation],
+                            output_row_count(con, model, metrics))
+        built.extend(model.relation for model in layer_models)
+    return built
+
+
+def run_models(select: Optional[str] = None, workers: int = MODEL_WORKERS,
+               full_refresh: bool = False, transactional: bool = False,
+               resume: bool = False) -> List[str]:
+    """
+    Build the selected models in dependency order. Upstream models outside
+    the selection are assumed to be up to date.
+
+    By default models whose upstream models are done run concurrently, each
+    on its own cursor. With ``transactional`` the whole run shares one
+    connection and every layer is built inside its own transaction.
+
+    A model whose fingerprint matches the one recorded at its last build is
+    skipped unless ``full_refresh`` is set. Timings, row counts and query
+    profiles of built models go to meta.run_metrics under a fresh run id.
+
+    Every run and how far each of its models got is checkpointed in
+    meta.pipeline_runs and meta.model_checkpoints. With ``resume`` the last
+    run, if it failed or never finished, is continued under its own run id,
+    selection, ``full_refresh`` and ``transactional``: models it finished
+    are skipped as long as their output and every upstream model in the
+    run are still intact, and the rest are built. Returns the relations
+    built.
+    """
+    all_models = load_models()
+    con = get_connection()
+    try:
+        create_checkpoint_tables(con)
+        if resume:
+            run = last_unfinished_run(con)
+            if run is None:
+                print("The last run finished, nothing to resume.\n")
+                return []
+            run_id, select = run["run_id"], run["select"]
+            full_refresh, transactional = run["full_refresh"], run["transactional"]
+            print(f"Resuming run id: {run_id}")
+        else:
+            run_id = new_run_id()
+            print(f"Run id: {run_id}")
+        models = topological_order(select_models(all_models, select))
+        if transactional:
+            print(f"Running {len(models)} models on one connection, one transaction per layer")
+        else:
+            print(f"Running {len(models)} models with {workers} workers")
+
+        for schema in dict.fromkeys(model.schema for model in models):
+            create_schema_if_not_exists(con, schema)
+        create_manifest_tables(con)
+        create_run_metrics_table(con)
+        create_incremental_state_table(con)
+        fingerprints = compute_fingerprints(con, all_models)
+        start_run(con, run_id, select, full_refresh, transactional)
+        completed = completed_models(con, run_id, models, fingerprints) if resume else set()
+
+        to_build = []
+        for model in models:
+            if model.relation in completed:
+                log(f"  {model.relation}: finished before the failure, skipping")
+            elif not full_refresh and is_up_to_date(con, model, fingerprints[model.relation]):
+                log(f"  {model.relation}: up to date, skipping")
+                save_checkpoint(con, run_id, model.relation, "skipped", fingerprints[model.relation])
+            else:
+                to_build.append(model)
+
+        for model in to_build:
+            if full_refresh:
+                model.reset_progress(con)
+            elif model.incremental and code_changed(con, model):
+                log(f"  {model.relation}: code changed, rebuilding from scratch")
+                reset_incremental(con, model.relation)
+
+        try:
+            if transactional:
+                built = _run_transactional(con, to_build, fingerprints, run_id)
+            else:
+                built = _run_parallel(con, to_build, fingerprints, workers, run_id)
+        except Exception:
+            finish_run(con, run_id, "failed")
+            raise
+        finish_run(con, run_id, "succeeded")
+    finally:
+        con.close()
+
+    print(f"\nModels complete ({len(built)} built, {len(models) - len(built)} up to date).\n")
+    return built
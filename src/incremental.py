@@ -0,0 +1,221 @@
+import hashlib
+
+from src.config import SCHEMA_META
+from src.utils import create_schema_if_not_exists, log, table_exists
+
+
+INCREMENTAL_STATE_TABLE = f"{SCHEMA_META}.incremental_state"
+
+# (rows, content hash) of every batch merged into a relation. The content
+# hash sums the md5 of each row's text, so it survives DuckDB upgrades.
+BATCH_FINGERPRINTS_TYPE = "STRUCT(batch_number INTEGER, row_count BIGINT, content_hash HUGEINT)[]"
+
+
+def create_incremental_state_table(con):
+    create_schema_if_not_exists(con, SCHEMA_META)
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {INCREMENTAL_STATE_TABLE} (
+            relation VARCHAR PRIMARY KEY,
+            max_batch_number INTEGER,
+            source_rows BIGINT,
+            updated_at TIMESTAMP
+        )
+    """)
+    con.execute(f"""
+        ALTER TABLE {INCREMENTAL_STATE_TABLE}
+        ADD COLUMN IF NOT EXISTS batch_fingerprints {BATCH_FINGERPRINTS_TYPE}
+    """)
+    # history_id: see start_history(). source_history: source_history() of
+    # what the relation merged from, as of its last merge.
+    con.execute(f"ALTER TABLE {INCREMENTAL_STATE_TABLE} ADD COLUMN IF NOT EXISTS history_id VARCHAR")
+    con.execute(f"ALTER TABLE {INCREMENTAL_STATE_TABLE} ADD COLUMN IF NOT EXISTS source_history VARCHAR")
+
+
+def get_incremental_state(con, relation):
+    """
+    The last batch merged into relation, how many source rows it had read,
+    the (rows, content hash) of every batch it merged and the history of
+    its source at the time, or None.
+    """
+    create_incremental_state_table(con)
+    row = con.execute(f"""
+        SELECT max_batch_number, source_rows, batch_fingerprints, source_history
+        FROM {INCREMENTAL_STATE_TABLE}
+        WHERE relation = ?
+    """, [relation]).fetchone()
+    # Rows written only by start_history() or _set_source_history() merged nothing
+    if row is None or row[0] is None:
+        return None
+    # State saved before fingerprints were kept has none
+    fingerprints = None
+    if row[2] is not None:
+        fingerprints = {f["batch_number"]: (f["row_count"], f["content_hash"]) for f in row[2]}
+    return {
+        "max_batch_number": row[0],
+        "source_rows": row[1],
+        "batch_fingerprints": fingerprints,
+        "source_history": row[3],
+    }
+
+
+def save_incremental_state(con, relation, max_batch_number, source_rows, batch_fingerprints, source_history=None):
+    # Upsert so the relation's own history_id is kept
+    con.execute(f"""
+        INSERT INTO {INCREMENTAL_STATE_TABLE}
+            (relation, max_batch_number, source_rows, updated_at, batch_fingerprints, source_history)
+        VALUES (?, ?, ?, CURRENT_TIMESTAMP, ?, ?)
+        ON CONFLICT (relation) DO UPDATE SET
+            max_batch_number = EXCLUDED.max_batch_number,
+            source_rows = EXCLUDED.source_rows,
+            updated_at = EXCLUDED.updated_at,
+            batch_fingerprints = EXCLUDED.batch_fingerprints,
+            source_history = EXCLUDED.source_history
+    """, [relation, max_batch_number, source_rows, batch_fingerprints, source_history])
+
+
+def start_history(con, relation):
+    """
+    Record that rows relation already had may have changed: it was
+    reloaded, rebuilt or edited in place. Relations that call this (the raw
+    tables, fct_sales_transactions) otherwise only get new batches
+    appended, which lets plan_batches() skip rereading the batches of them
+    that were already merged.
+    """
+    create_incremental_state_table(con)
+    con.execute(f"""
+        INSERT INTO {INCREMENTAL_STATE_TABLE} (relation, updated_at, history_id)
+        VALUES (?, CURRENT_TIMESTAMP, uuid()::VARCHAR)
+        ON CONFLICT (relation) DO UPDATE SET
+            updated_at = EXCLUDED.updated_at,
+            history_id = EXCLUDED.history_id
+    """, [relation])
+
+
+def source_history(con, source):
+    """
+    A token that stays the same while the batches source already has can't
+    change: it covers the code and params of source and of every model
+    upstream of it, stopping at models that keep a history_id (see
+    start_history()) and at incremental models, which count with the time
+    of their last merge. Views and SQL tables in between are taken to
+    derive each row from upstream rows of the same batch, as staging does,
+    so rebuilding them for a new batch leaves the old ones alone. None if
+    source isn't a model.
+    """
+    # src.dag imports this module
+    from src.build_cache import code_hash
+    from src.dag import registered_models
+
+    models = registered_models()
+    if source not in models:
+        return None
+
+    create_incremental_state_table(con)
+    digest = hashlib.sha256()
+    seen = set()
+    pending = [source]
+    while pending:
+        relation = pending.pop()
+        if relation in seen:
+            continue
+        seen.add(relation)
+        model = models[relation]
+        digest.update(relation.encode())
+        digest.update(code_hash(model).encode())
+        digest.update(repr(sorted(model.params.items())).encode())
+        row = con.execute(f"""
+            SELECT history_id, updated_at
+            FROM {INCREMENTAL_STATE_TABLE}
+            WHERE relation = ?
+        """, [relation]).fetchone()
+        if row is not None and row[0] is not None:
+            digest.update(row[0].encode())
+        elif model.incremental:
+            digest.update(repr(row).encode())
+        else:
+            pending.extend(model.depends_on)
+    return digest.hexdigest()
+
+
+def fingerprint_batches(con, source, batch_column="batch_number", columns=None, where_clause="TRUE"):
+    """(batch, rows, content hash) of every batch in source matching where_clause, in order."""
+    row_text = f"CAST(ROW({', '.join(columns)}) AS VARCHAR)" if columns else "CAST(source_row AS VARCHAR)"
+    return con.execute(f"""
+        SELECT {batch_column}, COUNT(*), SUM(md5_number_lower({row_text}))
+        FROM {source} AS source_row
+        WHERE {where_clause}
+        GROUP BY {batch_column}
+        ORDER BY {batch_column}
+    """).fetchall()
+
+
+def reset_incremental(con, relation):
+    """Forget relation's merge history and drop it, so its next build starts from scratch."""
+    create_incremental_state_table(con)
+    con.execute(f"DELETE FROM {INCREMENTAL_STATE_TABLE} WHERE relation = ?", [relation])
+    con.execute(f"DROP TABLE IF EXISTS {relation}")
+
+
+def plan_batches(con, relation, source, batch_column="batch_number", columns=None):
+    """
+    Work out which batches of source still have to be merged into relation.
+
+    Returns (new_batches, batches). ``batches`` lists every (batch, rows,
+    content hash) in source, ``new_batches`` the batch numbers to merge, in
+    order. The content hash is the sum of the md5 of a batch's rows, or of
+    just ``columns`` when relation only reads those.
+
+    While source_history() is what it was at the last merge, the batches
+    already merged can't have changed, so only newer ones are read and the
+    rest come from the stored fingerprints. Otherwise every batch is read
+    and compared with them. When relation has no merge history yet, or a
+    batch it already merged changed in source (rows added, removed or
+    edited in place), it has to be rebuilt: new_batches is then None and
+    the caller recreates relation and merges every batch.
+    """
+    state = get_incremental_state(con, relation)
+    schema, table = relation.split(".")
+    exists = table_exists(con, schema, table)
+    history = source_history(con, source)
+    # Kept for save_batches_merged(), in the caller's transaction
+    _set_source_history(con, relation, history)
+
+    if state is not None and exists and history is not None and state["source_history"] == history:
+        merged_through = state["max_batch_number"]
+        merged = [(batch, *fingerprint) for batch, fingerprint in sorted(state["batch_fingerprints"].items())]
+        newer = fingerprint_batches(con, source, batch_column, columns, f"{batch_column} > {merged_through}")
+        return [batch for batch, _, _ in newer], merged + newer
+
+    batches = fingerprint_batches(con, source, batch_column, columns)
+    if state is None or not exists:
+        return None, batches
+
+    merged_through = state["max_batch_number"]
+    merged = {batch: (count, content_hash) for batch, count, content_hash in batches if batch <= merged_through}
+    if merged != state["batch_fingerprints"]:
+        log(f"  {relation}: merged batches changed in {source}, rebuilding")
+        return None, batches
+    return [batch for batch, _, _ in batches if batch > merged_through], batches
+
+
+def _set_source_history(con, relation, history):
+    create_incremental_state_table(con)
+    con.execute(f"""
+        INSERT INTO {INCREMENTAL_STATE_TABLE} (relation, source_history)
+        VALUES (?, ?)
+        ON CONFLICT (relation) DO UPDATE SET source_history = EXCLUDED.source_history
+    """, [relation, history])
+
+
+def save_batches_merged(con, relation, batches):
+    """Record that every (batch, rows, content hash) from plan_batches() is now merged into relation."""
+    if batches:
+        fingerprints = [
+            {"batch_number": batch, "row_count": count, "content_hash": content_hash}
+            for batch, count, content_hash in batches
+        ]
+        source_rows = sum(count for _, count, _ in batches)
+        history = con.execute(f"""
+            SELECT source_history FROM {INCREMENTAL_STATE_TABLE} WHERE relation = ?
+        """, [relation]).fetchone()[0]
+        save_incremental_state(con, relation, batches[-1][0], source_rows, fingerprints, history)
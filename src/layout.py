@@ -0,0 +1,122 @@
+from typing import List
+
+from src.utils import log
+
+
+# DuckDB stores tables in row groups of this many rows, each with min/max
+# statistics per column. A filter skips every row group whose range can't
+# match, so how well a column prunes depends on how the rows are ordered.
+ROW_GROUP_SIZE = 122_880
+
+# Values of a column sampled when measuring how many row groups a filter reads
+PRUNING_SAMPLE_VALUES = 1000
+
+# A table appended to in batches, each sorted on its own, is re-sorted once a
+# filter on its first sort column reads more row groups than a sorted table
+# would by this fraction of all its row groups
+RECLUSTER_EXTRA_FRACTION = 0.1
+
+
+def get_order_by_sql(columns: List[str]) -> str:
+    return f"ORDER BY {', '.join(columns)}" if columns else ""
+
+
+def pruning_stats(con, relation, column):
+    """
+    How well equality filters on column can skip row groups of relation.
+
+    Returns the number of row groups and the average number an equality
+    filter on one value of the column has to read, i.e. those whose min/max
+    range contains the value. Averaged over up to PRUNING_SAMPLE_VALUES
+    distinct values.
+    """
+    row = con.execute(f"""
+        WITH row_groups AS (
+            SELECT
+                rowid // {ROW_GROUP_SIZE} AS row_group,
+                MIN({column}) AS min_value,
+                MAX({column}) AS max_value
+            FROM {relation}
+            GROUP BY row_group
+        ),
+        sampled AS (
+            SELECT value
+            FROM (SELECT DISTINCT {column} AS value FROM {relation} WHERE {column} IS NOT NULL)
+            USING SAMPLE {PRUNING_SAMPLE_VALUES} ROWS
+        ),
+        reads AS (
+            SELECT s.value, COUNT(g.row_group) AS row_groups_read
+            FROM sampled s
+            LEFT JOIN row_groups g ON s.value BETWEEN g.min_value AND g.max_value
+            GROUP BY s.value
+        )
+        SELECT
+            (SELECT COUNT(*) FROM row_groups),
+            (SELECT AVG(row_groups_read) FROM reads)
+    """).fetchone()
+    row_groups, avg_read = row[0], row[1] or 0
+    return {
+        "row_groups": row_groups,
+        "avg_row_groups_read": avg_read,
+        "fraction_read": avg_read / row_groups if row_groups else 0,
+    }
+
+
+def estimated_row_groups_read(con, relation, column):
+    """
+    Like pruning_stats, but estimated from the min/max statistics DuckDB
+    keeps for every row group instead of by scanning the table: the summed
+    width of the row groups' ranges over the width of the table's. About 1
+    for a table sorted by column, the number of row groups when each spans
+    the whole range. column must be an integer or DATE column, and only
+    committed rows count.
+
+    Returns the number of row groups and the estimated number read.
+    """
+    schema, table = relation.split(".")
+    column_type = con.execute("""
+        SELECT data_type
+        FROM information_schema.columns
+        WHERE table_schema = ? AND table_name = ? AND column_name = ?
+    """, [schema, table, column]).fetchone()[0]
+    row = con.execute(f"""
+        WITH segments AS (
+            SELECT
+                row_group_id,
+                TRY_CAST(regexp_extract(stats, 'Min: ([^,\\]]+)', 1) AS {column_type}) AS min_value,
+                TRY_CAST(regexp_extract(stats, 'Max: ([^,\\]]+)', 1) AS {column_type}) AS max_value
+            FROM pragma_storage_info('{relation}')
+            WHERE column_name = ? AND segment_type != 'VALIDITY'
+        ),
+        row_groups AS (
+            SELECT row_group_id, MIN(min_value) AS min_value, MAX(max_value) AS max_value
+            FROM segments
+            GROUP BY row_group_id
+        )
+        SELECT
+            COUNT(*),
+            SUM(max_value - min_value + 1) / (MAX(max_value) - MIN(min_value) + 1)
+        FROM row_groups
+    """, [column]).fetchone()
+    return row[0], row[1] or 0
+
+
+def needs_reclustering(con, relation, column):
+    """
+    True if a filter on column reads more of relation's row groups than a
+    sorted table would, by over RECLUSTER_EXTRA_FRACTION of them.
+    """
+    row_groups, read = estimated_row_groups_read(con, relation, column)
+    return read - 1 > RECLUSTER_EXTRA_FRACTION * row_groups
+
+
+def recluster(con, relation, columns):
+    """Rewrite relation in columns order."""
+    con.execute(f"CREATE OR REPLACE TABLE {relation} AS SELECT * FROM {relation} {get_order_by_sql(columns)}")
+
+
+def log_pruning_stats(con, relation, columns):
+    for column in columns:
+        stats = pruning_stats(con, relation, column)
+        log(f"  -> {column}: a filter on one value reads {stats['avg_row_groups_read']:.1f} "
+            f"of {stats['row_groups']} row groups ({stats['fraction_read']:.0%})")
@@ -0,0 +1,89 @@
+import json
+import time
+import uuid
+from datetime import datetime
+
+from src.config import SCHEMA_META
+from src.utils import create_schema_if_not_exists
+
+
+RUN_METRICS_TABLE = f"{SCHEMA_META}.run_metrics"
+
+
+def new_run_id() -> str:
+    return f"{datetime.now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+
+
+def create_run_metrics_table(con):
+    create_schema_if_not_exists(con, SCHEMA_META)
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {RUN_METRICS_TABLE} (
+            run_id VARCHAR,
+            relation VARCHAR,
+            started_at TIMESTAMP,
+            wall_seconds DOUBLE,
+            rows_written BIGINT,
+            bytes_written BIGINT,
+            peak_memory_bytes BIGINT,
+            query_profile JSON,
+            PRIMARY KEY (run_id, relation)
+        )
+    """)
+
+
+def _last_query_profile(con):
+    # get_profiling_information() only exists on newer duckdb releases
+    if not hasattr(con, "get_profiling_information"):
+        return None
+    try:
+        return json.loads(con.get_profiling_information(format="json"))
+    except Exception:
+        return None
+
+
+def build_with_metrics(con, model):
+    """
+    Build a model with DuckDB profiling switched on for its connection.
+
+    Row counts come from what the build reports (the CREATE TABLE result),
+    not from a second scan. Bytes written and peak buffer memory come from
+    the profile of the model's last statement, which for SQL models is the
+    CREATE TABLE itself: the profile is taken before the model's post-build
+    logging (Model.log_layout()) runs any queries. Small tables stay in
+    memory until the next checkpoint, so they report 0 bytes written.
+    """
+    con.execute("PRAGMA enable_profiling = 'no_output'")
+    try:
+        started_at = datetime.now()
+        start = time.perf_counter()
+        rows = model.materialize(con)
+        wall_seconds = time.perf_counter() - start
+        profile = _last_query_profile(con)
+    finally:
+        con.execute("PRAGMA disable_profiling")
+    model.log_layout(con)
+
+    profile = profile or {}
+    return {
+        "started_at": started_at,
+        "wall_seconds": wall_seconds,
+        "rows_written": rows,
+        "bytes_written": profile.get("total_bytes_written"),
+        "peak_memory_bytes": profile.get("system_peak_buffer_memory"),
+        "query_profile": json.dumps(profile) if profile else None,
+    }
+
+
+def record_metrics(con, run_id, relation, metrics):
+    con.execute(f"""
+        INSERT OR REPLACE INTO {RUN_METRICS_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, [
+        run_id,
+        relation,
+        metrics["started_at"],
+        metrics["wall_seconds"],
+        metrics["rows_written"],
+        metrics["bytes_written"],
+        metrics["peak_memory_bytes"],
+        metrics["query_profile"],
+    ])
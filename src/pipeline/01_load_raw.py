@@ -1,30 +1,486 @@
+import csv
+import hashlib
 import os
-from src.config import RAW_DATA_DIR, SCHEMA_RAW, CSV_FILES
-from src.utils import get_connection, create_schema_if_not_exists, print_table_info
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+import duckdb
+from src.config import (
+    RAW_DATA_DIR, SCHEMA_RAW, SCHEMA_META, CSV_FILES, RAW_LOAD_MODE, RAW_WATERMARK_COLUMN,
+    RAW_LOAD_WORKERS, SOURCE_SCHEMAS, RAW_CACHE_ENABLED, RAW_CACHE_DIR, RAW_CACHE_COMPRESSION,
+)
+from src.build_cache import create_manifest_tables, hash_file
+from src.dag import Model
+from src.incremental import start_history
+from src.utils import (
+    get_connection, create_schema_if_not_exists, drop_relation, table_exists, get_parse_date_sql,
+    log, transaction,
+)
 
 
-def load_raw_data():
+WATERMARK_TABLE = f"{SCHEMA_META}.raw_watermarks"
+
+# Parsing runs on many cursors at once; writes to raw tables go through one
+# writer at a time.
+_writer_lock = threading.Lock()
+
+
+def create_watermark_table(con):
+    create_schema_if_not_exists(con, SCHEMA_META)
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} (
+            table_name VARCHAR PRIMARY KEY,
+            max_batch_number INTEGER,
+            max_generation_date VARCHAR,
+            file_size BIGINT,
+            file_mtime DOUBLE,
+            row_count BIGINT,
+            loaded_at TIMESTAMP
+        )
+    """)
+    con.execute(f"ALTER TABLE {WATERMARK_TABLE} ADD COLUMN IF NOT EXISTS cache_files VARCHAR[]")
+    con.execute(f"ALTER TABLE {WATERMARK_TABLE} ADD COLUMN IF NOT EXISTS contract_hash VARCHAR")
+
+
+def reset_watermark(con, table_name):
+    """Forget what was loaded into raw.<table_name>, so its next load is a full one."""
+    create_watermark_table(con)
+    con.execute(f"DELETE FROM {WATERMARK_TABLE} WHERE table_name = ?", [table_name])
+
+
+def get_contract_hash(table_name):
+    """Hash of table_name's source contract: its columns, types, nullability and date formats."""
+    return hashlib.sha256(repr(SOURCE_SCHEMAS[table_name]).encode()).hexdigest()
+
+
+def get_watermark(con, table_name):
+    row = con.execute(f"""
+        SELECT max_batch_number, file_size, file_mtime, cache_files, contract_hash
+        FROM {WATERMARK_TABLE}
+        WHERE table_name = ?
+    """, [table_name]).fetchone()
+    if row is None:
+        return None
+    return {
+        "max_batch_number": row[0],
+        "file_size": row[1],
+        "file_mtime": row[2],
+        "cache_files": row[3],
+        "contract_hash": row[4],
+    }
+
+
+def save_watermark(con, table_name, csv_path, cache_files=None):
+    stat = os.stat(csv_path)
+    con.execute(f"""
+        INSERT OR REPLACE INTO {WATERMARK_TABLE} BY NAME
+        SELECT
+            ? AS table_name,
+            MAX({RAW_WATERMARK_COLUMN})::INTEGER AS max_batch_number,
+            MAX(generation_date) FILTER (
+                WHERE {RAW_WATERMARK_COLUMN} = (SELECT MAX({RAW_WATERMARK_COLUMN}) FROM {SCHEMA_RAW}.{table_name})
+            )::VARCHAR AS max_generation_date,
+            ? AS file_size,
+            ? AS file_mtime,
+            COUNT(*) AS row_count,
+            CURRENT_TIMESTAMP AS loaded_at,
+            ? AS cache_files,
+            ? AS contract_hash
+        FROM {SCHEMA_RAW}.{table_name}
+    """, [table_name, stat.st_size, stat.st_mtime, cache_files, get_contract_hash(table_name)])
+
+
+def plan_load(con, table_name, csv_path, mode=RAW_LOAD_MODE):
+    """
+    Decide how to bring raw.<table_name> up to date with its CSV.
+
+    Returns "full", "append" or "skip". Anything we can't prove is a pure
+    append of new bytes (file shrank, rewritten in place, no watermark yet)
+    falls back to a full reload, and so does a change to the table's source
+    contract, which the rows already loaded were read under.
+    """
+    if mode != "incremental":
+        return "full"
+
+    watermark = get_watermark(con, table_name)
+    if watermark is None or not table_exists(con, SCHEMA_RAW, table_name):
+        return "full"
+    if watermark["contract_hash"] != get_contract_hash(table_name):
+        log(f"  {SCHEMA_RAW}.{table_name}: source contract changed, reloading")
+        return "full"
+    # The raw table is a view over Parquet copies and one has since been
+    # deleted, or the cache was turned on or off since the last load
+    cache_files = watermark["cache_files"] or []
+    if RAW_CACHE_ENABLED != bool(cache_files) or not all(os.path.exists(path) for path in cache_files):
+        return "full"
+
+    stat = os.stat(csv_path)
+    if stat.st_size == watermark["file_size"] and stat.st_mtime == watermark["file_mtime"]:
+        return "skip"
+    if stat.st_size <= watermark["file_size"]:
+        return "full"
+
+    # The previous end of file must still fall on a row boundary. Our CSVs
+    # usually have no trailing newline, so the new rows start with one.
+    with open(csv_path, "rb") as f:
+        f.seek(watermark["file_size"] - 1)
+        boundary = f.read(2)
+    if boundary[:1] != b"\n" and boundary[1:] not in (b"\n", b"\r"):
+        return "full"
+    return "append"
+
+
+def ingest_table_name(table_name):
+    return f"{SCHEMA_RAW}._ingest_{table_name}"
+
+
+def get_read_csv_sql(table_name, csv_path):
+    """read_csv call with the column names and types fixed by the source contract (no sniffing)."""
+    columns = ", ".join(
+        f"'{column_name}': '{spec['type']}'" for column_name, spec in SOURCE_SCHEMAS[table_name].items()
+    )
+    return f"""read_csv(
+        '{csv_path}',
+        header = true,
+        auto_detect = false,
+        delim = ',',
+        quote = '"',
+        escape = '"',
+        columns = {{{columns}}}
+    )"""
+
+
+def check_header(table_name, csv_path):
+    with open(csv_path, newline="") as f:
+        header = next(csv.reader(f), [])
+
+    expected = list(SOURCE_SCHEMAS[table_name])
+    if [column_name.strip() for column_name in header] != expected:
+        raise ValueError(
+            f"{csv_path} violates the {table_name} source contract: "
+            f"expected columns {expected}, got {header}"
+        )
+
+
+def check_contract(con, table_name, csv_path):
+    """
+    Check nullability and date formats of the parsed rows in one query.
+    Dates are only parsed once per distinct value.
+    """
+    checks = []
+    for column_name, spec in SOURCE_SCHEMAS[table_name].items():
+        if not spec.get("nullable", True):
+            checks.append((
+                f"rows where {column_name} is NULL",
+                f"COUNT(*) FILTER (WHERE {column_name} IS NULL)",
+            ))
+        if "date_formats" in spec:
+            parsed = get_parse_date_sql("raw_value", spec["date_formats"])
+            checks.append((
+                f"{column_name} values that do not match {spec['date_formats']}",
+                f"""(
+                    SELECT COUNT(*)
+                    FROM (SELECT DISTINCT {column_name} AS raw_value FROM {ingest_table_name(table_name)})
+                    WHERE raw_value IS NOT NULL AND {parsed} IS NULL
+                )""",
+            ))
+    if not checks:
+        return
+
+    counts = con.execute(f"""
+        SELECT {", ".join(expression for _, expression in checks)}
+        FROM {ingest_table_name(table_name)}
+    """).fetchone()
+
+    violations = [f"{count:,} {label}" for (label, _), count in zip(checks, counts) if count]
+    if violations:
+        raise ValueError(
+            f"{csv_path} violates the {table_name} source contract: " + "; ".join(violations)
+        )
+
+
+def parse_csv(con, table_name, csv_path, source_path=None):
+    """
+    Parse a CSV into the scratch table, failing fast if it breaks its
+    contract. Returns the number of rows parsed.
+    """
+    source_path = source_path or csv_path
+    check_header(table_name, csv_path)
+    try:
+        rows = con.execute(f"""
+            CREATE OR REPLACE TABLE {ingest_table_name(table_name)} AS
+            SELECT * FROM {get_read_csv_sql(table_name, csv_path)}
+        """).fetchone()[0]
+    except (duckdb.ConversionException, duckdb.InvalidInputException) as e:
+        raise ValueError(f"{source_path} violates the {table_name} source contract: {e}") from e
+    check_contract(con, table_name, source_path)
+    return rows
+
+
+def raw_cache_path(con, table_name, csv_path):
+    """
+    Path of the Parquet copy of csv_path parsed as table_name. Its name
+    carries a hash of the file's contents and of the source contract, so a
+    changed file or contract never reads an old copy. hash_file() only
+    rehashes the file when its size or mtime changed.
+    """
+    key = hashlib.sha256(f"{hash_file(con, csv_path)}:{get_contract_hash(table_name)}".encode()).hexdigest()
+    return os.path.join(RAW_CACHE_DIR, f"{table_name}-{key[:16]}.parquet")
+
+
+def appended_cache_path(table_name, csv_path, start, previous_path):
+    """
+    Path of the Parquet copy of the rows appended to csv_path from byte
+    start on. Its name carries a hash of the copy they follow and of the
+    appended bytes only, so an append never rereads the rest of the file.
+    """
+    digest = hashlib.sha256(os.path.basename(previous_path).encode())
+    with open(csv_path, "rb") as f:
+        f.seek(start)
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return os.path.join(RAW_CACHE_DIR, f"{table_name}-{digest.hexdigest()[:16]}.parquet")
+
+
+def write_raw_cache(con, cache_path, select_sql):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    partial_path = f"{cache_path}.partial"
+    con.execute(f"""
+        COPY ({select_sql}) TO '{partial_path}'
+        (FORMAT parquet, COMPRESSION {RAW_CACHE_COMPRESSION})
+    """)
+    os.replace(partial_path, cache_path)
+
+
+def remove_old_cache_files(previous_files, cache_files):
+    """
+    Remove the Parquet copies a raw view read before this load and no
+    longer reads. Other databases can share RAW_CACHE_DIR, so files this
+    database never referenced are left alone.
+    """
+    for path in previous_files:
+        if path not in cache_files and os.path.exists(path):
+            os.remove(path)
+
+
+def ingest_cached(con, table_name, csv_path):
+    """
+    Make sure the Parquet copy of the CSV exists, parsing the CSV only if
+    it doesn't. Copies are written once the rows passed the contract, so an
+    existing copy skips the checks along with the parsing. Returns the
+    number of rows.
+    """
+    # hash_file() records hashes in the database
+    with _writer_lock:
+        cache_path = raw_cache_path(con, table_name, csv_path)
+
+    if os.path.exists(cache_path):
+        log(f"  {SCHEMA_RAW}.{table_name}: CSV unchanged, reading {os.path.basename(cache_path)}")
+    else:
+        parse_csv(con, table_name, csv_path)
+        write_raw_cache(con, cache_path, f"SELECT * FROM {ingest_table_name(table_name)}")
+        con.execute(f"DROP TABLE {ingest_table_name(table_name)}")
+    return con.execute(f"SELECT COUNT(*) FROM read_parquet('{cache_path}')").fetchone()[0]
+
+
+def ingest_full(con, table_name, csv_path):
+    return parse_csv(con, table_name, csv_path)
+
+
+def ingest_append(con, table_name, csv_path):
+    """
+    Parse only the bytes written since the last load. Returns the number of
+    new rows, or None if they don't all belong to batches above the watermark.
+    """
+    watermark = get_watermark(con, table_name)
+
+    with open(csv_path, "rb") as f:
+        header = f.readline()
+        f.seek(watermark["file_size"])
+        tail = f.read().lstrip(b"\r\n")
+
+    fd, tail_path = tempfile.mkstemp(suffix=".csv")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(header)
+            f.write(tail)
+
+        rows = parse_csv(con, table_name, tail_path, source_path=csv_path)
+    finally:
+        os.remove(tail_path)
+
+    stale = con.execute(f"""
+        SELECT COUNT(*)
+        FROM {ingest_table_name(table_name)}
+        WHERE {RAW_WATERMARK_COLUMN} <= ?
+    """, [watermark["max_batch_number"]]).fetchone()[0]
+    return rows if stale == 0 else None
+
+
+def ingest_table(con, table_name, csv_path, plan):
+    """
+    Parse a CSV into its raw._ingest_<table_name> scratch table, or with
+    RAW_CACHE_ENABLED, a full load into its Parquet copy ("cached"). Safe to
+    run from worker threads on separate cursors. Returns the plan to commit
+    with and the number of rows parsed.
+    """
+    rows = None
+    if plan == "append":
+        rows = ingest_append(con, table_name, csv_path)
+        if rows is None:
+            log(f"  {SCHEMA_RAW}.{table_name}: new rows are not new batches, reloading")
+            plan = "full"
+
+    if plan == "full" and RAW_CACHE_ENABLED:
+        plan = "cached"
+        rows = ingest_cached(con, table_name, csv_path)
+    elif plan == "full":
+        rows = ingest_full(con, table_name, csv_path)
+
+    return plan, rows
+
+
+def commit_table(con, table_name, csv_path, plan, rows):
+    """
+    Move parsed rows into raw.<table_name>. With RAW_CACHE_ENABLED the raw
+    table is a view over Parquet copies of the CSV, so nothing is copied
+    into the database: the copy of a full load, followed by one copy per
+    appended range of bytes. Returns rows written.
+    """
+    relation = f"{SCHEMA_RAW}.{table_name}"
+    scratch = ingest_table_name(table_name)
+
+    with _writer_lock, transaction(con):
+        watermark = get_watermark(con, table_name)
+        previous_files = (watermark and watermark["cache_files"]) or []
+        cache_files = None
+        if plan == "cached":
+            cache_files = [raw_cache_path(con, table_name, csv_path)]
+        elif plan == "append" and RAW_CACHE_ENABLED:
+            cache_path = appended_cache_path(
+                table_name, csv_path, watermark["file_size"], watermark["cache_files"][-1],
+            )
+            write_raw_cache(con, cache_path, f"SELECT * FROM {scratch}")
+            cache_files = [*watermark["cache_files"], cache_path]
+            con.execute(f"DROP TABLE {scratch}")
+        elif plan == "append":
+            con.execute(f"""
+                INSERT INTO {relation} BY NAME
+                SELECT * FROM {scratch}
+            """)
+            con.execute(f"DROP TABLE {scratch}")
+        elif plan == "full":
+            drop_relation(con, relation)
+            con.execute(f"ALTER TABLE {scratch} RENAME TO {table_name}")
+
+        # Appends only add batches, anything else may change loaded rows
+        if plan != "append":
+            start_history(con, relation)
+
+        if cache_files:
+            paths = ", ".join(f"'{path}'" for path in cache_files)
+            drop_relation(con, relation, keep="view")
+            con.execute(f"CREATE OR REPLACE VIEW {relation} AS SELECT * FROM read_parquet([{paths}])")
+        save_watermark(con, table_name, csv_path, cache_files)
+
+    remove_old_cache_files(previous_files, cache_files or [])
+
+    if plan == "append":
+        log(f"  {relation}: appended {rows:,} rows")
+    else:
+        log(f"  {relation}: {rows:,} rows")
+    return rows
+
+
+def load_raw_table(con, table_name, csv_path, mode=RAW_LOAD_MODE):
+    plan = plan_load(con, table_name, csv_path, mode)
+
+    if plan == "skip":
+        log(f"  {SCHEMA_RAW}.{table_name}: unchanged since last load, skipping")
+        return 0
+
+    plan, rows = ingest_table(con, table_name, csv_path, plan)
+    return commit_table(con, table_name, csv_path, plan, rows)
+
+
+def build_raw_model(table_name):
+    """run() for the raw.<table_name> model in the DAG runner."""
+    def run(con):
+        csv_path = os.path.join(RAW_DATA_DIR, CSV_FILES[table_name])
+        if not os.path.exists(csv_path):
+            log(f"  WARNING: {csv_path} not found, skipping.")
+            return 0
+
+        with _writer_lock:
+            create_watermark_table(con)
+        return load_raw_table(con, table_name, csv_path)
+    return run
+
+
+MODELS = [
+    Model(
+        name=table_name,
+        schema=SCHEMA_RAW,
+        run=build_raw_model(table_name),
+        reset=partial(reset_watermark, table_name=table_name),
+        source_files=[os.path.join(RAW_DATA_DIR, csv_filename)],
+        params={"contract": SOURCE_SCHEMAS[table_name]},
+    )
+    for table_name, csv_filename in CSV_FILES.items()
+]
+
+
+def _ingest_worker(con, table_name, csv_path, plan):
+    cursor = con.cursor()
+    try:
+        return ingest_table(cursor, table_name, csv_path, plan)
+    finally:
+        cursor.close()
+
+
+def load_raw_data(mode=RAW_LOAD_MODE, workers=RAW_LOAD_WORKERS, con=None):
 
     print("STEP 1: Loading raw CSV data into DuckDB")
 
-    con = get_connection()
+    owns_connection = con is None
+    if owns_connection:
+        con = get_connection()
     create_schema_if_not_exists(con, SCHEMA_RAW)
+    create_watermark_table(con)
+    create_manifest_tables(con)
 
+    sources = {}
     for table_name, csv_filename in CSV_FILES.items():
         csv_path = os.path.join(RAW_DATA_DIR, csv_filename)
 
         if not os.path.exists(csv_path):
-            print(f"  WARNING: {csv_path} not found, skipping.")
+            log(f"  WARNING: {csv_path} not found, skipping.")
+            continue
+
+        plan = plan_load(con, table_name, csv_path, mode)
+        if plan == "skip":
+            log(f"  {SCHEMA_RAW}.{table_name}: unchanged since last load, skipping")
             continue
-        
-        con.execute(f"""
-            CREATE OR REPLACE TABLE {SCHEMA_RAW}.{table_name} AS
-            SELECT * FROM read_csv_auto('{csv_path}')
-        """)
+        sources[table_name] = (csv_path, plan)
 
-        print_table_info(con, SCHEMA_RAW, table_name)
+    if workers > 1:
+        # Parse every file at once on worker cursors; this thread is the
+        # only writer to the raw tables and commits files as they finish.
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(_ingest_worker, con, table_name, csv_path, plan): table_name
+                for table_name, (csv_path, plan) in sources.items()
+            }
+            for future in as_completed(futures):
+                table_name = futures[future]
+                commit_table(con, table_name, sources[table_name][0], *future.result())
+    else:
+        for table_name, (csv_path, plan) in sources.items():
+            commit_table(con, table_name, csv_path, *ingest_table(con, table_name, csv_path, plan))
 
-    con.close()
+    if owns_connection:
+        con.close()
     print("\nRaw layer complete.\n")
 
 
@@ -1,61 +1,119 @@
-from src.config import SCHEMA_RAW, SCHEMA_STAGING
-from src.utils import get_connection, create_schema_if_not_exists, print_table_info, get_parse_date_sql
+from src.config import SCHEMA_RAW, SCHEMA_STAGING, SOURCE_SCHEMAS
+from src.dag import Model
+from src.utils import (
+    get_connection, create_schema_if_not_exists, get_parse_date_sql, get_hashdiff_sql,
+)
+
+
+def date_lookup_relation(source):
+    return f"{SCHEMA_STAGING}.stg_{source}_dates"
+
+
+def build_date_lookup_model(source):
+    """
+    Lookup of every distinct raw value of the source's date columns to its
+    parsed date and the format it matched. Each value is parsed once here,
+    and staging models join the lookup instead of parsing every row.
+    """
+    selects = []
+    for column_name, spec in SOURCE_SCHEMAS[source].items():
+        if "date_formats" not in spec:
+            continue
+        detected_format = " ".join(
+            f"WHEN TRY_STRPTIME(raw_value, '{date_format}') IS NOT NULL THEN '{date_format}'"
+            for date_format in spec["date_formats"]
+        )
+        selects.append(f"""
+        SELECT
+            '{column_name}' AS column_name,
+            raw_value,
+            {get_parse_date_sql("raw_value", spec["date_formats"])} AS parsed_date,
+            CASE {detected_format} END AS date_format
+        FROM (SELECT DISTINCT {column_name}::VARCHAR AS raw_value FROM {SCHEMA_RAW}.{source})""")
 
+    return Model(
+        name=f"stg_{source}_dates",
+        schema=SCHEMA_STAGING,
+        depends_on=[f"{SCHEMA_RAW}.{source}"],
+        sql="\n        UNION ALL".join(selects),
+    )
 
-def create_staging_tables():
 
-    print("STEP 2: Creating staging tables (clean & standardize)")
+def get_date_lookup_join_sql(source, column_name):
+    alias = f"{column_name}_lookup"
+    return f"""LEFT JOIN {date_lookup_relation(source)} {alias}
+            ON {alias}.column_name = '{column_name}' AND {alias}.raw_value = {column_name}::VARCHAR"""
+
+
+def get_lookup_date_sql(column_name):
+    return f"{column_name}_lookup.parsed_date"
 
-    con = get_connection()
-    create_schema_if_not_exists(con, SCHEMA_STAGING)
+
+MODELS = [
+    # Date lookups, one per source
+    *[build_date_lookup_model(source) for source in SOURCE_SCHEMAS],
 
     #stg_customers
 
-    con.execute(f"""
-        CREATE OR REPLACE TABLE {SCHEMA_STAGING}.stg_customers AS
+    Model(
+        name="stg_customers",
+        schema=SCHEMA_STAGING,
+        depends_on=[f"{SCHEMA_RAW}.customers", date_lookup_relation("customers")],
+        sql=f"""
         SELECT
             customer_id::INTEGER AS customer_id,
             TRIM(name) AS customer_name,
             TRIM(location_city) AS customer_city,
             TRIM(location_country) AS customer_country,
-            generation_date,
-            batch_number::INTEGER AS batch_number
+            {get_lookup_date_sql("generation_date")} AS generation_date,
+            batch_number::INTEGER AS batch_number,
+            {get_hashdiff_sql(["customer_name", "customer_city", "customer_country"])} AS hashdiff
         FROM {SCHEMA_RAW}.customers
-    """)
-    print_table_info(con, SCHEMA_STAGING, "stg_customers")
+        {get_date_lookup_join_sql("customers", "generation_date")}
+    """),
 
     #stg_providers
-    
-    con.execute(f"""
-        CREATE OR REPLACE TABLE {SCHEMA_STAGING}.stg_providers AS
+
+    Model(
+        name="stg_providers",
+        schema=SCHEMA_STAGING,
+        depends_on=[f"{SCHEMA_RAW}.providers", date_lookup_relation("providers")],
+        sql=f"""
         SELECT
             provider_id::INTEGER AS provider_id,
             TRIM(name) AS provider_name,
             TRIM(location_city) AS provider_city,
             TRIM(location_country) AS provider_country,
-            generation_date,
-            batch_number::INTEGER AS batch_number
+            {get_lookup_date_sql("generation_date")} AS generation_date,
+            batch_number::INTEGER AS batch_number,
+            {get_hashdiff_sql(["provider_name", "provider_city", "provider_country"])} AS hashdiff
         FROM {SCHEMA_RAW}.providers
-    """)
-    print_table_info(con, SCHEMA_STAGING, "stg_providers")
+        {get_date_lookup_join_sql("providers", "generation_date")}
+    """),
 
     #stg_raw_materials
 
-    con.execute(f"""
-        CREATE OR REPLACE TABLE {SCHEMA_STAGING}.stg_raw_materials AS
+    Model(
+        name="stg_raw_materials",
+        schema=SCHEMA_STAGING,
+        depends_on=[f"{SCHEMA_RAW}.raw_materials", date_lookup_relation("raw_materials")],
+        sql=f"""
         SELECT
             raw_material_id::INTEGER AS raw_material_id,
             TRIM(name) AS raw_material_name,
-            generation_date,
+            {get_lookup_date_sql("generation_date")} AS generation_date,
             batch_number::INTEGER AS batch_number
         FROM {SCHEMA_RAW}.raw_materials
-    """)
-    print_table_info(con, SCHEMA_STAGING, "stg_raw_materials")
+        {get_date_lookup_join_sql("raw_materials", "generation_date")}
+    """),
 
     #stg_ingredients
-    parse_date = get_parse_date_sql("generation_date")
-    con.execute(f"""
-        CREATE OR REPLACE TABLE {SCHEMA_STAGING}.stg_ingredients AS
+
+    Model(
+        name="stg_ingredients",
+        schema=SCHEMA_STAGING,
+        depends_on=[f"{SCHEMA_RAW}.ingredients", date_lookup_relation("ingredients")],
+        sql=f"""
         SELECT
             ingredient_id::INTEGER AS ingredient_id,
             TRIM(name) AS ingredient_name,
@@ -63,30 +121,37 @@ def create_staging_tables():
             weight_in_grams,
             cost_per_gram,
             provider_id::INTEGER AS provider_id,
-            {parse_date} AS generation_date,
+            {get_lookup_date_sql("generation_date")} AS generation_date,
             batch_number::INTEGER AS batch_number
         FROM {SCHEMA_RAW}.ingredients
-    """)
-    print_table_info(con, SCHEMA_STAGING, "stg_ingredients")
+        {get_date_lookup_join_sql("ingredients", "generation_date")}
+    """),
 
     #stg_flavours
 
-    con.execute(f"""
-        CREATE OR REPLACE TABLE {SCHEMA_STAGING}.stg_flavours AS
+    Model(
+        name="stg_flavours",
+        schema=SCHEMA_STAGING,
+        depends_on=[f"{SCHEMA_RAW}.flavours", date_lookup_relation("flavours")],
+        sql=f"""
         SELECT
             flavour_id::INTEGER AS flavour_id,
             TRIM(name) AS flavour_name,
             TRIM(description) AS flavour_description,
-            generation_date,
+            {get_lookup_date_sql("generation_date")} AS generation_date,
             batch_number::INTEGER AS batch_number
         FROM {SCHEMA_RAW}.flavours
-    """)
-    print_table_info(con, SCHEMA_STAGING, "stg_flavours")
+        {get_date_lookup_join_sql("flavours", "generation_date")}
+    """),
 
     #stg_recipes
-    
-    con.execute(f"""
-        CREATE OR REPLACE TABLE {SCHEMA_STAGING}.stg_recipes AS
+
+    Model(
+        name="stg_recipes",
+        schema=SCHEMA_STAGING,
+        depends_on=[f"{SCHEMA_RAW}.recipes", date_lookup_relation("recipes")],
+        materialized="view",
+        sql=f"""
         SELECT
             recipe_id,
             raw_material_id::INTEGER AS raw_material_id,
@@ -97,33 +162,54 @@ def create_staging_tables():
             ingredient_ratio,
             NULLIF(TRIM(heat_process), '') AS heat_process,
             yield AS yield_percentage,
-            generation_date,
+            {get_lookup_date_sql("generation_date")} AS generation_date,
             batch_number::INTEGER AS batch_number
         FROM {SCHEMA_RAW}.recipes
-    """)
-    print_table_info(con, SCHEMA_STAGING, "stg_recipes")
+        {get_date_lookup_join_sql("recipes", "generation_date")}
+    """),
 
     #stg_sales_transactions
-    
-    con.execute(f"""
-        CREATE OR REPLACE TABLE {SCHEMA_STAGING}.stg_sales_transactions AS
+
+    Model(
+        name="stg_sales_transactions",
+        schema=SCHEMA_STAGING,
+        depends_on=[f"{SCHEMA_RAW}.sales_transactions", date_lookup_relation("sales_transactions")],
+        materialized="view",
+        sql=f"""
         SELECT
             transaction_id::INTEGER AS transaction_id,
             customer_id::INTEGER AS customer_id,
             flavour_id::INTEGER AS flavour_id,
             quantity_liters::INTEGER AS quantity_liters,
-            transaction_date,
+            {get_lookup_date_sql("transaction_date")} AS transaction_date,
             UPPER(TRIM(transaction_country)) AS transaction_country,
             TRIM(transaction_town) AS transaction_town,
             TRIM(postal_code) AS postal_code,
             amount_dollar::DOUBLE AS amount_dollars,
-            generation_date,
+            {get_lookup_date_sql("generation_date")} AS generation_date,
             batch_number::INTEGER AS batch_number
         FROM {SCHEMA_RAW}.sales_transactions
-    """)
-    print_table_info(con, SCHEMA_STAGING, "stg_sales_transactions")
+        {get_date_lookup_join_sql("sales_transactions", "transaction_date")}
+        {get_date_lookup_join_sql("sales_transactions", "generation_date")}
+    """),
+]
+
+
+def create_staging_tables(con=None):
+
+    print("STEP 2: Creating staging tables (clean & standardize)")
+
+    # Callers running several layers can pass one shared connection
+    owns_connection = con is None
+    if owns_connection:
+        con = get_connection()
+    create_schema_if_not_exists(con, SCHEMA_STAGING)
+
+    for model in MODELS:
+        model.build(con)
 
-    con.close()
+    if owns_connection:
+        con.close()
     print("\nStaging layer complete.\n")
 
 
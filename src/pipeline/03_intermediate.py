@@ -1,169 +1,209 @@
 from src.config import SCHEMA_STAGING, SCHEMA_INTERMEDIATE
-from src.utils import get_connection, create_schema_if_not_exists, print_table_info
-
-
-def create_intermediate_tables():
-    
-    print("STEP 3: Creating intermediate tables (business logic)")
-
-    con = get_connection()
-    create_schema_if_not_exists(con, SCHEMA_INTERMEDIATE)
-
+from src.dag import Model
+from src.incremental import plan_batches, save_batches_merged
+from src.utils import get_connection, create_schema_if_not_exists, get_surrogate_key_sql, log, transaction
+
+
+def build_latest_record_model(name, staging_name, key, attributes):
+    """
+    run() for a table holding the latest version of every key in a staging
+    table. The first build takes the latest row per key over all batches.
+    After that only batches newer than the last merged one are read: keys
+    whose hashdiff changed are updated in place and unseen keys inserted,
+    so the cost follows the size of the new batches, not the history.
+    """
+    relation = f"{SCHEMA_INTERMEDIATE}.{name}"
+    source = f"{SCHEMA_STAGING}.{staging_name}"
+
+    def latest_sql(from_batch):
+        return f"""
+            SELECT {key}, {", ".join(attributes)}, hashdiff
+            FROM {source}
+            WHERE batch_number >= {from_batch}
+            QUALIFY ROW_NUMBER() OVER (
+                PARTITION BY {key}
+                ORDER BY batch_number DESC, generation_date DESC
+            ) = 1
+        """
+
+    def run(con):
+        with transaction(con):
+            new_batches, batches = plan_batches(con, relation, source)
+            if new_batches is None:
+                from_batch = batches[0][0] if batches else 0
+                rows = con.execute(f"CREATE OR REPLACE TABLE {relation} AS {latest_sql(from_batch)}").fetchone()[0]
+                save_batches_merged(con, relation, batches)
+                log(f"  {relation}: {rows:,} rows")
+                return rows
+
+            updated = inserted = 0
+            if new_batches:
+                updated = con.execute(f"""
+                    UPDATE {relation} AS t
+                    SET {", ".join(f"{column} = n.{column}" for column in attributes)},
+                        hashdiff = n.hashdiff
+                    FROM ({latest_sql(new_batches[0])}) AS n
+                    WHERE t.{key} = n.{key}
+                      AND t.hashdiff != n.hashdiff
+                """).fetchone()[0]
+                inserted = con.execute(f"""
+                    INSERT INTO {relation}
+                    SELECT n.*
+                    FROM ({latest_sql(new_batches[0])}) AS n
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM {relation} t WHERE t.{key} = n.{key}
+                    )
+                """).fetchone()[0]
+            save_batches_merged(con, relation, batches)
+
+        log(f"  {relation}: {updated:,} changed, {inserted:,} new ({len(new_batches)} new batches merged)")
+        return updated + inserted
+
+    return run
+
+
+FLAVOURS_SCD2 = f"{SCHEMA_INTERMEDIATE}.int_flavours_scd2"
+
+
+def create_flavours_scd2_table(con):
     con.execute(f"""
-        CREATE OR REPLACE TABLE {SCHEMA_INTERMEDIATE}.int_customers AS
-        WITH ranked AS (
-            SELECT
-                *,
-                ROW_NUMBER() OVER (
-                    PARTITION BY customer_id
-                    ORDER BY batch_number DESC, generation_date DESC
-                ) AS rn
-            FROM {SCHEMA_STAGING}.stg_customers
+        CREATE OR REPLACE TABLE {FLAVOURS_SCD2} (
+            flavour_scd_key BIGINT,
+            flavour_id INTEGER,
+            flavour_name VARCHAR,
+            flavour_description VARCHAR,
+            valid_from DATE,
+            valid_to DATE,
+            is_current BOOLEAN,
+            source_batch_number INTEGER
         )
-        SELECT
-            customer_id,
-            customer_name,
-            customer_city,
-            customer_country
-        FROM ranked
-        WHERE rn = 1
     """)
-    print_table_info(con, SCHEMA_INTERMEDIATE, "int_customers")
 
-    con.execute(f"""
-        CREATE OR REPLACE TABLE {SCHEMA_INTERMEDIATE}.int_providers AS
-        WITH ranked AS (
-            SELECT
-                *,
-                ROW_NUMBER() OVER (
-                    PARTITION BY provider_id
-                    ORDER BY batch_number DESC, generation_date DESC
-                ) AS rn
-            FROM {SCHEMA_STAGING}.stg_providers
-        )
+
+def merge_flavours_batch(con, batch_number):
+    """
+    Merge one stg_flavours batch into the SCD2 history. Current records
+    whose description changed are closed at the batch's generation date,
+    and a new current record is inserted for every flavour in the batch
+    that no longer has one (changed or never seen before). Flavours missing
+    from the batch keep their current record. Only the batch's rows and the
+    matching current records are touched.
+    """
+    batch_sql = f"""
+        SELECT flavour_id, flavour_name, flavour_description, generation_date
+        FROM {SCHEMA_STAGING}.stg_flavours
+        WHERE batch_number = {batch_number}
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY flavour_id ORDER BY generation_date DESC) = 1
+    """
+
+    # Close current records whose description changed
+    closed = con.execute(f"""
+        UPDATE {FLAVOURS_SCD2} AS h
+        SET valid_to = b.generation_date,
+            is_current = FALSE
+        FROM ({batch_sql}) AS b
+        WHERE h.flavour_id = b.flavour_id
+          AND h.is_current = TRUE
+          AND h.flavour_description IS DISTINCT FROM b.flavour_description
+    """).fetchone()[0]
+
+    # Open a current record for new and changed flavours
+    inserted = con.execute(f"""
+        INSERT INTO {FLAVOURS_SCD2}
         SELECT
-            provider_id,
-            provider_name,
-            provider_city,
-            provider_country
-        FROM ranked
-        WHERE rn = 1
-    """)
-    print_table_info(con, SCHEMA_INTERMEDIATE, "int_providers")
+            {get_surrogate_key_sql("b.flavour_id", "b.generation_date", batch_number)} AS flavour_scd_key,
+            b.flavour_id,
+            b.flavour_name,
+            b.flavour_description,
+            b.generation_date AS valid_from,
+            NULL::DATE AS valid_to,
+            TRUE AS is_current,
+            {batch_number} AS source_batch_number
+        FROM ({batch_sql}) AS b
+        WHERE NOT EXISTS (
+            SELECT 1 FROM {FLAVOURS_SCD2} h
+            WHERE h.flavour_id = b.flavour_id AND h.is_current = TRUE
+        )
+    """).fetchone()[0]
 
-    con.execute(f"""
-        CREATE OR REPLACE TABLE {SCHEMA_INTERMEDIATE}.int_flavours_scd2 AS
-        WITH batch_1 AS (
-            SELECT
-                flavour_id,
-                flavour_name,
-                flavour_description,
-                generation_date,
-                batch_number
-            FROM {SCHEMA_STAGING}.stg_flavours
-            WHERE batch_number = 1
-        ),
-        batch_2 AS (
-            SELECT
-                flavour_id,
-                flavour_name,
-                flavour_description,
-                generation_date,
-                batch_number
-            FROM {SCHEMA_STAGING}.stg_flavours
-            WHERE batch_number = 2
-        ),
+    log(f"  -> batch {batch_number}: {closed} closed, {inserted} opened")
+    return closed + inserted
 
-        -- Compare descriptions between batches
-        compared AS (
-            SELECT
-                b1.flavour_id,
-                b1.flavour_name,
-                b1.flavour_description AS desc_batch_1,
-                b2.flavour_description AS desc_batch_2,
-                b1.generation_date AS gen_date_batch_1,
-                b2.generation_date AS gen_date_batch_2,
-                CASE
-                    WHEN b1.flavour_description != b2.flavour_description THEN TRUE
-                    ELSE FALSE
-                END AS description_changed
-            FROM batch_1 b1
-            INNER JOIN batch_2 b2 ON b1.flavour_id = b2.flavour_id
-        ),
 
-        -- Build SCD2 records
-        scd2_records AS (
-            -- Old (closed) record for flavours WHERE description CHANGED
-            SELECT
-                flavour_id,
-                flavour_name,
-                desc_batch_1 AS flavour_description,
-                gen_date_batch_1 AS valid_from,
-                gen_date_batch_2 AS valid_to,
-                FALSE AS is_current,
-                1 AS source_batch_number
-            FROM compared
-            WHERE description_changed = TRUE
-
-            UNION ALL
-
-            -- New (current) record for flavours WHERE description CHANGED
-            SELECT
-                flavour_id,
-                flavour_name,
-                desc_batch_2 AS flavour_description,
-                gen_date_batch_2 AS valid_from,
-                NULL::DATE AS valid_to,
-                TRUE AS is_current,
-                2 AS source_batch_number
-            FROM compared
-            WHERE description_changed = TRUE
-
-            UNION ALL
-
-            -- Single (current) record for flavours WHERE description DID NOT change
-            SELECT
-                flavour_id,
-                flavour_name,
-                desc_batch_1 AS flavour_description,
-                gen_date_batch_1 AS valid_from,
-                NULL::DATE AS valid_to,
-                TRUE AS is_current,
-                1 AS source_batch_number
-            FROM compared
-            WHERE description_changed = FALSE
-        )
+def build_int_flavours_scd2(con):
+    """
+    Bring the SCD2 history up to date with stg_flavours by merging every
+    batch newer than the last one merged, in batch order. History is only
+    rebuilt from the first batch when there is none yet, or when the
+    batches already merged no longer match staging (rows added to, removed
+    from or edited in an old batch).
+    """
+    with transaction(con):
+        new_batches, batches = plan_batches(con, FLAVOURS_SCD2, f"{SCHEMA_STAGING}.stg_flavours")
+        if new_batches is None:
+            create_flavours_scd2_table(con)
+            new_batches = [batch for batch, _, _ in batches]
 
-        SELECT
-            MD5(flavour_id::VARCHAR || '|' || valid_from::VARCHAR || '|' || source_batch_number::VARCHAR)
-                AS flavour_scd_key,
-            flavour_id,
-            flavour_name,
-            flavour_description,
-            valid_from,
-            valid_to,
-            is_current,
-            source_batch_number
-        FROM scd2_records
-    """)
-    print_table_info(con, SCHEMA_INTERMEDIATE, "int_flavours_scd2")
+        rows = 0
+        for batch_number in new_batches:
+            rows += merge_flavours_batch(con, batch_number)
+        save_batches_merged(con, FLAVOURS_SCD2, batches)
+
+    log(f"  {FLAVOURS_SCD2}: {rows:,} rows written ({len(new_batches)} new batches merged)")
 
     # Print SCD2 stats
     changed = con.execute(f"""
         SELECT COUNT(DISTINCT flavour_id)
-        FROM {SCHEMA_INTERMEDIATE}.int_flavours_scd2
+        FROM {FLAVOURS_SCD2}
         WHERE is_current = FALSE
     """).fetchone()[0]
     total = con.execute(f"""
         SELECT COUNT(DISTINCT flavour_id)
-        FROM {SCHEMA_INTERMEDIATE}.int_flavours_scd2
+        FROM {FLAVOURS_SCD2}
     """).fetchone()[0]
-    print(f"  -> {changed} out of {total} flavours had description changes")
-
-    con.execute(f"""
-        CREATE OR REPLACE TABLE {SCHEMA_INTERMEDIATE}.int_recipes AS
+    log(f"  -> {changed} out of {total} flavours had description changes")
+    return rows
+
+
+MODELS = [
+    Model(
+        name="int_customers",
+        schema=SCHEMA_INTERMEDIATE,
+        depends_on=[f"{SCHEMA_STAGING}.stg_customers"],
+        run=build_latest_record_model(
+            "int_customers", "stg_customers", "customer_id",
+            ["customer_name", "customer_city", "customer_country"],
+        ),
+        materialized="incremental",
+    ),
+
+    Model(
+        name="int_providers",
+        schema=SCHEMA_INTERMEDIATE,
+        depends_on=[f"{SCHEMA_STAGING}.stg_providers"],
+        run=build_latest_record_model(
+            "int_providers", "stg_providers", "provider_id",
+            ["provider_name", "provider_city", "provider_country"],
+        ),
+        materialized="incremental",
+    ),
+
+    Model(
+        name="int_flavours_scd2",
+        schema=SCHEMA_INTERMEDIATE,
+        depends_on=[f"{SCHEMA_STAGING}.stg_flavours"],
+        run=build_int_flavours_scd2,
+        materialized="incremental",
+    ),
+
+    Model(
+        name="int_recipes",
+        schema=SCHEMA_INTERMEDIATE,
+        depends_on=[f"{SCHEMA_STAGING}.stg_recipes"],
+        materialized="ephemeral",
+        sql=f"""
         SELECT
-            MD5(recipe_id || '|' || batch_number::VARCHAR) AS recipe_key,
+            {get_surrogate_key_sql("recipe_id", "batch_number")} AS recipe_key,
             recipe_id,
             raw_material_id,
             raw_material_ratio,
@@ -177,10 +217,25 @@ def create_intermediate_tables():
             generation_date,
             batch_number
         FROM {SCHEMA_STAGING}.stg_recipes
-    """)
-    print_table_info(con, SCHEMA_INTERMEDIATE, "int_recipes")
+    """),
+]
+
+
+def create_intermediate_tables(con=None):
+    
+    print("STEP 3: Creating intermediate tables (business logic)")
+
+    # Callers running several layers can pass one shared connection
+    owns_connection = con is None
+    if owns_connection:
+        con = get_connection()
+    create_schema_if_not_exists(con, SCHEMA_INTERMEDIATE)
+
+    for model in MODELS:
+        model.build(con)
 
-    con.close()
+    if owns_connection:
+        con.close()
     print("\nIntermediate layer complete.\n")
 
 
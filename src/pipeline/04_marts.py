@@ -1,55 +1,198 @@
 from src.config import SCHEMA_STAGING, SCHEMA_INTERMEDIATE, SCHEMA_MARTS
-from src.utils import get_connection, create_schema_if_not_exists, print_table_info
+from src.dag import Model
+from src.incremental import plan_batches, save_batches_merged, start_history
+from src.layout import get_order_by_sql, needs_reclustering, recluster
+from src.recipe_cost import RECIPE_COMPOSITION, INGREDIENTS, RECIPE_COST_SORT_BY, build_fct_recipe_cost
+from src.rollups import ROLLUPS, SALES_FACT, build_rollup_model
+from src.utils import get_connection, create_schema_if_not_exists, get_date_key_sql, log, transaction
 
 
-def create_mart_tables():
-    
-    print("STEP 4: Creating mart tables (dimensional model)")
+FLAVOURS_SCD2 = f"{SCHEMA_INTERMEDIATE}.int_flavours_scd2"
 
-    con = get_connection()
-    create_schema_if_not_exists(con, SCHEMA_MARTS)
+# Physical row order of the sales fact, for row group pruning on date and customer filters
+SALES_SORT_BY = ["transaction_date", "customer_id"]
+
+
+def get_sales_sql(where_clause):
+    return f"""
+        SELECT
+            transaction_id,
+            customer_id,
+            flavour_id,
+            quantity_liters,
+            {get_date_key_sql("transaction_date")} AS date_key,
+            transaction_date,
+            transaction_country,
+            transaction_town,
+            postal_code,
+            amount_dollars,
+            EXTRACT(YEAR FROM transaction_date)::INTEGER AS transaction_year,
+            EXTRACT(QUARTER FROM transaction_date)::INTEGER AS transaction_quarter,
+            EXTRACT(YEAR FROM transaction_date)::VARCHAR || '-Q' ||
+                EXTRACT(QUARTER FROM transaction_date)::VARCHAR AS transaction_year_quarter,
+            batch_number
+        FROM {SCHEMA_STAGING}.stg_sales_transactions
+        WHERE {where_clause}
+    """
+
+
+def get_flavour_scd_key_sql(sales_sql):
+    """
+    sales_sql with the flavour_scd_key of the flavour version in force on
+    each transaction_date added. An ASOF join picks the latest version that
+    started on or before the sale; versions closed on the day they opened
+    never match. Sales older than a flavour's first version get that first
+    version.
+    """
+    return f"""
+        SELECT s.*, COALESCE(v.flavour_scd_key, f.flavour_scd_key) AS flavour_scd_key
+        FROM ({sales_sql}) AS s
+        ASOF LEFT JOIN (
+            SELECT flavour_id, valid_from, flavour_scd_key
+            FROM {FLAVOURS_SCD2}
+            WHERE valid_to IS NULL OR valid_to > valid_from
+        ) AS v
+            ON s.flavour_id = v.flavour_id AND s.transaction_date >= v.valid_from
+        LEFT JOIN (
+            SELECT flavour_id, arg_min(flavour_scd_key, source_batch_number) AS flavour_scd_key
+            FROM {FLAVOURS_SCD2}
+            GROUP BY flavour_id
+        ) AS f
+            ON s.flavour_id = f.flavour_id
+    """
+
+
+def rekey_sales_flavours(con):
+    """
+    Re-resolve flavour_scd_key for the sales whose flavour version no longer
+    covers their transaction_date, e.g. because a new flavours batch closed
+    it. Finding them is an equality join on the key; only those rows go
+    through the ASOF join again.
+    """
+    stale_sql = f"""
+        SELECT t.transaction_id, t.flavour_id, t.transaction_date
+        FROM {SALES_FACT} t
+        LEFT JOIN (
+            SELECT
+                flavour_scd_key,
+                valid_from,
+                valid_to,
+                source_batch_number = MIN(source_batch_number) OVER (PARTITION BY flavour_id) AS is_first
+            FROM {FLAVOURS_SCD2}
+        ) AS v
+            ON t.flavour_scd_key = v.flavour_scd_key
+        WHERE v.flavour_scd_key IS NULL
+           OR (t.transaction_date < v.valid_from AND NOT v.is_first)
+           OR t.transaction_date >= v.valid_to
+    """
+    return con.execute(f"""
+        UPDATE {SALES_FACT} AS t
+        SET flavour_scd_key = r.flavour_scd_key
+        FROM ({get_flavour_scd_key_sql(stale_sql)}) AS r
+        WHERE t.transaction_id = r.transaction_id
+          AND t.flavour_scd_key IS DISTINCT FROM r.flavour_scd_key
+    """).fetchone()[0]
+
+
+def build_fct_sales_transactions(con):
+    """
+    Append the sales batches newer than the last one merged, each sale with
+    the flavour_scd_key in force on its date, then re-key older sales whose
+    flavour version changed. A rebuild recreates the table and appends every
+    batch one at a time, which also bounds the size of each statement.
+
+    Each batch is sorted by SALES_SORT_BY as it is appended, but spans the
+    whole date range, so appends spread every date over more row groups. A
+    rebuild sorts the whole table once its batches are in. Otherwise the
+    table is only re-sorted when its row group statistics show date filters
+    reading too many row groups (see needs_reclustering()), so appending a
+    batch doesn't cost a rewrite of the history.
+
+    Rebuilding and re-keying change sales already merged, so both start a
+    new history (start_history()) for the rollups to check them against.
+    """
+    with transaction(con):
+        new_batches, batches = plan_batches(con, SALES_FACT, f"{SCHEMA_STAGING}.stg_sales_transactions")
+        rekeyed = 0
+        rebuild = new_batches is None
+        if rebuild:
+            con.execute(f"CREATE OR REPLACE TABLE {SALES_FACT} AS {get_flavour_scd_key_sql(get_sales_sql('FALSE'))}")
+            new_batches = [batch for batch, _, _ in batches]
+        else:
+            rekeyed = rekey_sales_flavours(con)
+
+        inserted = 0
+        for batch_number in new_batches:
+            inserted += con.execute(f"""
+                INSERT INTO {SALES_FACT}
+                {get_flavour_scd_key_sql(get_sales_sql(f"batch_number = {batch_number}"))}
+                {get_order_by_sql(SALES_SORT_BY)}
+            """).fetchone()[0]
+        if rebuild:
+            recluster(con, SALES_FACT, SALES_SORT_BY)
+        if rebuild or rekeyed:
+            start_history(con, SALES_FACT)
+        save_batches_merged(con, SALES_FACT, batches)
+
+    log(f"  {SALES_FACT}: {inserted:,} new, {rekeyed:,} re-keyed ({len(new_batches)} new batches merged)")
+    # Row group statistics only cover committed rows
+    if not rebuild and needs_reclustering(con, SALES_FACT, SALES_SORT_BY[0]):
+        with transaction(con):
+            recluster(con, SALES_FACT, SALES_SORT_BY)
+        log(f"  {SALES_FACT}: re-sorted, appended batches had spread dates over too many row groups")
+    return inserted + rekeyed
 
-    #dim_customers
 
-    con.execute(f"""
-        CREATE OR REPLACE TABLE {SCHEMA_MARTS}.dim_customers AS
+MODELS = [
+    #dim_customers
+    Model(
+        name="dim_customers",
+        schema=SCHEMA_MARTS,
+        depends_on=[f"{SCHEMA_INTERMEDIATE}.int_customers"],
+        sql=f"""
         SELECT
             customer_id,
             customer_name,
             customer_city,
             customer_country
         FROM {SCHEMA_INTERMEDIATE}.int_customers
-    """)
-    print_table_info(con, SCHEMA_MARTS, "dim_customers")
+    """),
 
     #dim_providers
-    con.execute(f"""
-        CREATE OR REPLACE TABLE {SCHEMA_MARTS}.dim_providers AS
+    Model(
+        name="dim_providers",
+        schema=SCHEMA_MARTS,
+        depends_on=[f"{SCHEMA_INTERMEDIATE}.int_providers"],
+        sql=f"""
         SELECT
             provider_id,
             provider_name,
             provider_city,
             provider_country
         FROM {SCHEMA_INTERMEDIATE}.int_providers
-    """)
-    print_table_info(con, SCHEMA_MARTS, "dim_providers")
+    """),
 
     #dim_raw_materials
     # Only batch 1 exists, no dedup needed. Source from staging directly.
-    con.execute(f"""
-        CREATE OR REPLACE TABLE {SCHEMA_MARTS}.dim_raw_materials AS
+    Model(
+        name="dim_raw_materials",
+        schema=SCHEMA_MARTS,
+        depends_on=[f"{SCHEMA_STAGING}.stg_raw_materials"],
+        sql=f"""
         SELECT
             raw_material_id,
             raw_material_name
         FROM {SCHEMA_STAGING}.stg_raw_materials
-    """)
-    print_table_info(con, SCHEMA_MARTS, "dim_raw_materials")
+    """),
 
     #dim_ingredients
     #Includes a computed total_ingredient_value (weight * cost_per_gram).
     #Retains provider_id as a foreign key to dim_providers.
-    con.execute(f"""
-        CREATE OR REPLACE TABLE {SCHEMA_MARTS}.dim_ingredients AS
+    Model(
+        name="dim_ingredients",
+        schema=SCHEMA_MARTS,
+        depends_on=[f"{SCHEMA_STAGING}.stg_ingredients"],
+        sql=f"""
         SELECT
             ingredient_id,
             ingredient_name,
@@ -59,14 +202,16 @@ def create_mart_tables():
             ROUND(weight_in_grams * cost_per_gram, 2) AS total_ingredient_value,
             provider_id
         FROM {SCHEMA_STAGING}.stg_ingredients
-    """)
-    print_table_info(con, SCHEMA_MARTS, "dim_ingredients")
+    """),
 
     #dim_flavours (SCD Type 2)
     #This is the only dimension with historical tracking.
     #WHERE is_current = TRUE -> to get the latest description
-    con.execute(f"""
-        CREATE OR REPLACE TABLE {SCHEMA_MARTS}.dim_flavours AS
+    Model(
+        name="dim_flavours",
+        schema=SCHEMA_MARTS,
+        depends_on=[f"{SCHEMA_INTERMEDIATE}.int_flavours_scd2"],
+        sql=f"""
         SELECT
             flavour_scd_key,
             flavour_id,
@@ -76,13 +221,15 @@ def create_mart_tables():
             valid_to,
             is_current
         FROM {SCHEMA_INTERMEDIATE}.int_flavours_scd2
-    """)
-    print_table_info(con, SCHEMA_MARTS, "dim_flavours")
+    """),
 
     #dim_recipes
-
-    con.execute(f"""
-        CREATE OR REPLACE TABLE {SCHEMA_MARTS}.dim_recipes AS
+    Model(
+        name="dim_recipes",
+        schema=SCHEMA_MARTS,
+        depends_on=[f"{SCHEMA_INTERMEDIATE}.int_recipes"],
+        chunk_by="recipe_key",
+        sql=f"""
         SELECT
             recipe_key,
             recipe_id,
@@ -90,60 +237,54 @@ def create_mart_tables():
             yield_percentage,
             batch_number
         FROM {SCHEMA_INTERMEDIATE}.int_recipes
-    """)
-    print_table_info(con, SCHEMA_MARTS, "dim_recipes")
+    """),
 
     #dim_date
-
-    con.execute(f"""
-        CREATE OR REPLACE TABLE {SCHEMA_MARTS}.dim_date AS
+    Model(
+        name="dim_date",
+        schema=SCHEMA_MARTS,
+        depends_on=[f"{SCHEMA_STAGING}.stg_sales_transactions"],
+        sql=f"""
         WITH date_series AS (
             SELECT UNNEST(
-                generate_series(DATE '2023-01-01', DATE '2025-12-31', INTERVAL 1 DAY)
-            ) AS date_key
+                generate_series(MIN(transaction_date), MAX(transaction_date), INTERVAL 1 DAY)
+            )::DATE AS full_date
+            FROM {SCHEMA_STAGING}.stg_sales_transactions
         )
         SELECT
-            date_key::DATE AS date_key,
-            EXTRACT(YEAR FROM date_key)::INTEGER AS year,
-            EXTRACT(QUARTER FROM date_key)::INTEGER AS quarter,
-            EXTRACT(MONTH FROM date_key)::INTEGER AS month,
-            EXTRACT(DAY FROM date_key)::INTEGER AS day_of_month,
-            EXTRACT(DOW FROM date_key)::INTEGER AS day_of_week,
-            STRFTIME(date_key, '%B') AS month_name,
-            STRFTIME(date_key, '%A') AS day_name,
-            EXTRACT(YEAR FROM date_key)::VARCHAR || '-Q' ||
-                EXTRACT(QUARTER FROM date_key)::VARCHAR AS year_quarter
+            {get_date_key_sql("full_date")} AS date_key,
+            full_date,
+            EXTRACT(YEAR FROM full_date)::INTEGER AS year,
+            EXTRACT(QUARTER FROM full_date)::INTEGER AS quarter,
+            EXTRACT(MONTH FROM full_date)::INTEGER AS month,
+            EXTRACT(DAY FROM full_date)::INTEGER AS day_of_month,
+            EXTRACT(DOW FROM full_date)::INTEGER AS day_of_week,
+            STRFTIME(full_date, '%B') AS month_name,
+            STRFTIME(full_date, '%A') AS day_name,
+            EXTRACT(YEAR FROM full_date)::VARCHAR || '-Q' ||
+                EXTRACT(QUARTER FROM full_date)::VARCHAR AS year_quarter
         FROM date_series
-    """)
-    print_table_info(con, SCHEMA_MARTS, "dim_date")
+    """),
 
     #FACT TABLES
-    # Foreign keys: customer_id -> dim_customers, flavour_id -> dim_flavours, transaction_date -> dim_date
-
-    con.execute(f"""
-        CREATE OR REPLACE TABLE {SCHEMA_MARTS}.fct_sales_transactions AS
-        SELECT
-            transaction_id,
-            customer_id,
-            flavour_id,
-            quantity_liters,
-            transaction_date,
-            transaction_country,
-            transaction_town,
-            postal_code,
-            amount_dollars,
-            EXTRACT(YEAR FROM transaction_date)::INTEGER AS transaction_year,
-            EXTRACT(QUARTER FROM transaction_date)::INTEGER AS transaction_quarter,
-            EXTRACT(YEAR FROM transaction_date)::VARCHAR || '-Q' ||
-                EXTRACT(QUARTER FROM transaction_date)::VARCHAR AS transaction_year_quarter
-        FROM {SCHEMA_STAGING}.stg_sales_transactions
-    """)
-    print_table_info(con, SCHEMA_MARTS, "fct_sales_transactions")
+    # Foreign keys: customer_id -> dim_customers, flavour_id -> dim_flavours,
+    # flavour_scd_key -> dim_flavours (version in force at the sale), date_key -> dim_date
+    Model(
+        name="fct_sales_transactions",
+        schema=SCHEMA_MARTS,
+        depends_on=[f"{SCHEMA_STAGING}.stg_sales_transactions", FLAVOURS_SCD2],
+        run=build_fct_sales_transactions,
+        materialized="incremental",
+        sort_by=SALES_SORT_BY,
+    ),
 
     #fact_provider_inventory
-    
-    con.execute(f"""
-        CREATE OR REPLACE TABLE {SCHEMA_MARTS}.fct_provider_inventory AS
+
+    Model(
+        name="fct_provider_inventory",
+        schema=SCHEMA_MARTS,
+        depends_on=[f"{SCHEMA_STAGING}.stg_ingredients", f"{SCHEMA_INTERMEDIATE}.int_providers"],
+        sql=f"""
         SELECT
             i.ingredient_id,
             i.ingredient_name,
@@ -158,13 +299,16 @@ def create_mart_tables():
         FROM {SCHEMA_STAGING}.stg_ingredients i
         LEFT JOIN {SCHEMA_INTERMEDIATE}.int_providers p
             ON i.provider_id = p.provider_id
-    """)
-    print_table_info(con, SCHEMA_MARTS, "fct_provider_inventory")
+    """),
 
     #fact_recipe_composition
-
-    con.execute(f"""
-        CREATE OR REPLACE TABLE {SCHEMA_MARTS}.fct_recipe_composition AS
+    Model(
+        name="fct_recipe_composition",
+        schema=SCHEMA_MARTS,
+        depends_on=[f"{SCHEMA_INTERMEDIATE}.int_recipes"],
+        chunk_by="recipe_key",
+        sort_by=["flavour_id"],
+        sql=f"""
         SELECT
             recipe_key,
             recipe_id,
@@ -182,10 +326,50 @@ def create_mart_tables():
             yield_percentage,
             batch_number
         FROM {SCHEMA_INTERMEDIATE}.int_recipes
-    """)
-    print_table_info(con, SCHEMA_MARTS, "fct_recipe_composition")
+    """),
+
+    #fact_recipe_cost
+    # Cost of each recipe from its ingredient's cost_per_gram, repriced
+    # incrementally when ingredient costs change, see src/recipe_cost.py
+    Model(
+        name="fct_recipe_cost",
+        schema=SCHEMA_MARTS,
+        depends_on=[RECIPE_COMPOSITION, INGREDIENTS],
+        run=build_fct_recipe_cost,
+        materialized="incremental",
+        sort_by=RECIPE_COST_SORT_BY,
+    ),
+
+    #AGGREGATE ROLLUPS
+    # Incrementally maintained totals of fct_sales_transactions, see src/rollups.py
+    *[
+        Model(
+            name=name,
+            schema=SCHEMA_MARTS,
+            depends_on=[SALES_FACT],
+            run=build_rollup_model(name, dimensions),
+            materialized="incremental",
+        )
+        for name, dimensions in ROLLUPS.items()
+    ],
+]
+
+
+def create_mart_tables(con=None):
+    
+    print("STEP 4: Creating mart tables (dimensional model)")
+
+    # Callers running several layers can pass one shared connection
+    owns_connection = con is None
+    if owns_connection:
+        con = get_connection()
+    create_schema_if_not_exists(con, SCHEMA_MARTS)
+
+    for model in MODELS:
+        model.build(con)
 
-    con.close()
+    if owns_connection:
+        con.close()
     print("\nMarts layer complete.\n")
 
 
@@ -0,0 +1,194 @@
+import os
+import shutil
+from src.build_cache import MANIFEST_TABLE, create_manifest_tables
+from src.config import SCHEMA_MARTS, SCHEMA_META, EXPORT_DIR, EXPORT_PARTITION_BY, EXPORT_SORT_BY
+from src.utils import get_connection, create_schema_if_not_exists, log
+
+
+EXPORT_MANIFEST_TABLE = f"{SCHEMA_META}.export_manifest"
+
+# Directory value Hive readers (DuckDB, Spark, Hive) read back as NULL
+HIVE_NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+
+def create_export_manifest_table(con):
+    create_schema_if_not_exists(con, SCHEMA_META)
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {EXPORT_MANIFEST_TABLE} (
+            path VARCHAR PRIMARY KEY,
+            table_name VARCHAR,
+            content_hash VARCHAR,
+            row_count BIGINT,
+            exported_at TIMESTAMP
+        )
+    """)
+    # meta.build_manifest fingerprint of the table when its files were last checked
+    con.execute(f"ALTER TABLE {EXPORT_MANIFEST_TABLE} ADD COLUMN IF NOT EXISTS build_fingerprint VARCHAR")
+
+
+def exported_hashes(con, table_name):
+    return dict(con.execute(f"""
+        SELECT path, content_hash
+        FROM {EXPORT_MANIFEST_TABLE}
+        WHERE table_name = ?
+    """, [table_name]).fetchall())
+
+
+def build_fingerprints(con):
+    """meta.build_manifest fingerprint of every marts table built by the DAG runner."""
+    create_manifest_tables(con)
+    return {relation.split(".", 1)[1]: fingerprint for relation, fingerprint in con.execute(f"""
+        SELECT relation, fingerprint
+        FROM {MANIFEST_TABLE}
+        WHERE relation LIKE '{SCHEMA_MARTS}.%'
+    """).fetchall()}
+
+
+def is_exported(con, table_name, fingerprint):
+    """True if every file of the table was written or checked at this build fingerprint and still exists."""
+    files = con.execute(f"""
+        SELECT path, build_fingerprint
+        FROM {EXPORT_MANIFEST_TABLE}
+        WHERE table_name = ?
+    """, [table_name]).fetchall()
+    return bool(files) and all(exported == fingerprint and os.path.exists(path) for path, exported in files)
+
+
+def list_mart_tables(con):
+    return [row[0] for row in con.execute("""
+        SELECT table_name
+        FROM information_schema.tables
+        WHERE table_schema = ?
+        ORDER BY table_name
+    """, [SCHEMA_MARTS]).fetchall()]
+
+
+def partition_contents(con, table_name):
+    """
+    One (path, where clause, content hash, rows) entry per output file of a
+    table. The hash is an order-independent sum of row hashes, so a file is
+    only rewritten when the rows that belong in it change.
+    """
+    partition_by = EXPORT_PARTITION_BY.get(table_name, [])
+    if not partition_by:
+        rows, content_hash = con.execute(f"""
+            SELECT COUNT(*), SUM(hash(t))::VARCHAR
+            FROM {SCHEMA_MARTS}.{table_name} t
+        """).fetchone()
+        return [(os.path.join(EXPORT_DIR, f"{table_name}.parquet"), "TRUE", content_hash, rows)]
+
+    columns = ", ".join(partition_by)
+    partitions = []
+    for row in con.execute(f"""
+        SELECT {columns}, COUNT(*), SUM(hash(t))::VARCHAR
+        FROM {SCHEMA_MARTS}.{table_name} t
+        GROUP BY {columns}
+        ORDER BY {columns}
+    """).fetchall():
+        values = row[:len(partition_by)]
+        directory = os.path.join(EXPORT_DIR, table_name, *[
+            f"{column}={HIVE_NULL_PARTITION if value is None else value}"
+            for column, value in zip(partition_by, values)
+        ])
+        where_clause = " AND ".join(
+            f"{column} IS NULL" if value is None else f"{column} = '{value}'"
+            for column, value in zip(partition_by, values)
+        )
+        partitions.append((os.path.join(directory, "data_0.parquet"), where_clause, row[-1], row[-2]))
+    return partitions
+
+
+def write_parquet(con, table_name, path, where_clause):
+    # Partition columns are encoded in the directory names, as Hive readers expect
+    partition_by = EXPORT_PARTITION_BY.get(table_name, [])
+    exclude = f" EXCLUDE ({', '.join(partition_by)})" if partition_by else ""
+    sort_by = EXPORT_SORT_BY.get(table_name, [])
+    order_by = f"ORDER BY {', '.join(sort_by)}" if sort_by else ""
+
+    # Write next to the target and rename, so readers never see a half-written file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    con.execute(f"""
+        COPY (
+            SELECT *{exclude}
+            FROM {SCHEMA_MARTS}.{table_name}
+            WHERE {where_clause}
+            {order_by}
+        ) TO '{tmp_path}' (FORMAT PARQUET)
+    """)
+    os.replace(tmp_path, path)
+
+
+def remove_export(path):
+    os.remove(path)
+    # Drop partition directories left empty
+    directory = os.path.dirname(path)
+    while directory != EXPORT_DIR and os.path.isdir(directory) and not os.listdir(directory):
+        os.rmdir(directory)
+        directory = os.path.dirname(directory)
+
+
+def export_table(con, table_name, fingerprint=None):
+    """
+    Write the table's changed files, remove files of partitions that no
+    longer exist. With its build fingerprint, a table whose files were
+    last checked at that same fingerprint is skipped without reading it.
+    """
+    if fingerprint is not None and is_exported(con, table_name, fingerprint):
+        log(f"  {table_name}: not rebuilt since the last export, skipping")
+        return 0
+
+    previous = exported_hashes(con, table_name)
+    written = 0
+    current_paths = set()
+
+    for path, where_clause, content_hash, rows in partition_contents(con, table_name):
+        current_paths.add(path)
+        if previous.get(path) == content_hash and os.path.exists(path):
+            continue
+        write_parquet(con, table_name, path, where_clause)
+        con.execute(f"""
+            INSERT OR REPLACE INTO {EXPORT_MANIFEST_TABLE} VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP, ?)
+        """, [path, table_name, content_hash, rows, fingerprint])
+        written += 1
+
+    removed = 0
+    for path in previous:
+        if path not in current_paths:
+            if os.path.exists(path):
+                remove_export(path)
+            con.execute(f"DELETE FROM {EXPORT_MANIFEST_TABLE} WHERE path = ?", [path])
+            removed += 1
+
+    # Files left as they were are up to date at this fingerprint too
+    con.execute(f"""
+        UPDATE {EXPORT_MANIFEST_TABLE} SET build_fingerprint = ? WHERE table_name = ?
+    """, [fingerprint, table_name])
+    log(f"  {table_name}: {written} of {len(current_paths)} files written, {removed} removed")
+    return written
+
+
+def export_marts(full_refresh=False):
+    """
+    Export every marts table to Parquet under EXPORT_DIR. Only files whose
+    rows changed since the last export are rewritten, unless full_refresh.
+    Tables the DAG runner hasn't rebuilt since then aren't read at all.
+    """
+    print("STEP 6: Exporting marts to Parquet")
+
+    con = get_connection()
+    try:
+        create_export_manifest_table(con)
+        if full_refresh:
+            con.execute(f"DELETE FROM {EXPORT_MANIFEST_TABLE}")
+            shutil.rmtree(EXPORT_DIR, ignore_errors=True)
+        fingerprints = build_fingerprints(con)
+        for table_name in list_mart_tables(con):
+            export_table(con, table_name, fingerprints.get(table_name))
+    finally:
+        con.close()
+    print(f"\nExport complete: {EXPORT_DIR}\n")
+
+
+if __name__ == "__main__":
+    export_marts()
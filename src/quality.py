@@ -0,0 +1,322 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional
+
+from src.config import SCHEMA_MARTS, SCHEMA_META, DQ_WORKERS
+from src.metrics import new_run_id
+from src.utils import get_connection, create_schema_if_not_exists, log
+
+
+DQ_RESULTS_TABLE = f"{SCHEMA_META}.dq_results"
+
+
+@dataclass
+class Check:
+    """
+    One data quality assertion that produces a single number.
+
+    Checks with an ``expression`` are aggregates over ``table``; all of a
+    table's aggregate checks run together in one scan. Checks with a
+    ``query`` (anti-joins, window checks) run on their own, in parallel.
+    The check passes when the number lies within [min_value, max_value];
+    None means unbounded.
+    """
+    name: str
+    table: str
+    expression: Optional[str] = None
+    query: Optional[str] = None
+    min_value: Optional[float] = 0
+    max_value: Optional[float] = 0
+
+    def passed(self, observed) -> bool:
+        if observed is None:
+            return False
+        if self.min_value is not None and observed < self.min_value:
+            return False
+        if self.max_value is not None and observed > self.max_value:
+            return False
+        return True
+
+
+def primary_key(table, column) -> List[Check]:
+    return [
+        Check(f"{table}.{column} not empty", table, "COUNT(*)", min_value=1, max_value=None),
+        Check(f"{table}.{column} not null", table, f"COUNT(*) - COUNT({column})"),
+        Check(f"{table}.{column} unique", table, f"COUNT({column}) - COUNT(DISTINCT {column})"),
+    ]
+
+
+def violations(name, table, condition, expected=0) -> Check:
+    return Check(name, table, f"COUNT(*) FILTER (WHERE {condition})", min_value=expected, max_value=expected)
+
+
+def row_count(table, expected) -> Check:
+    return Check(f"{table} row count", table, "COUNT(*)", min_value=expected, max_value=expected)
+
+
+def foreign_key(table, column, parent, parent_column, extra_filter="",
+                min_value=0, max_value=0) -> Check:
+    where_clause = f"AND {extra_filter}" if extra_filter else ""
+    return Check(
+        f"{table}.{column} -> {parent}.{parent_column}",
+        table,
+        query=f"""
+            SELECT COUNT(*)
+            FROM {table} c
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {parent} p
+                WHERE c.{column} = p.{parent_column} {where_clause}
+            )
+        """,
+        min_value=min_value,
+        max_value=max_value,
+    )
+
+
+M = SCHEMA_MARTS
+
+CHECKS = [
+    # 1. Primary keys
+    *primary_key(f"{M}.dim_customers", "customer_id"),
+    *primary_key(f"{M}.dim_providers", "provider_id"),
+    *primary_key(f"{M}.dim_raw_materials", "raw_material_id"),
+    *primary_key(f"{M}.dim_ingredients", "ingredient_id"),
+    *primary_key(f"{M}.dim_flavours", "flavour_scd_key"),
+    *primary_key(f"{M}.dim_date", "date_key"),
+    *primary_key(f"{M}.dim_recipes", "recipe_key"),
+    *primary_key(f"{M}.fct_sales_transactions", "transaction_id"),
+    *primary_key(f"{M}.fct_provider_inventory", "ingredient_id"),
+    *primary_key(f"{M}.fct_recipe_composition", "recipe_key"),
+    *primary_key(f"{M}.fct_recipe_cost", "recipe_key"),
+
+    # 2. Referential integrity
+    foreign_key(f"{M}.fct_sales_transactions", "customer_id", f"{M}.dim_customers", "customer_id"),
+    foreign_key(f"{M}.fct_sales_transactions", "flavour_id", f"{M}.dim_flavours", "flavour_id",
+                extra_filter="p.is_current = TRUE"),
+    foreign_key(f"{M}.fct_sales_transactions", "flavour_scd_key", f"{M}.dim_flavours", "flavour_scd_key"),
+    foreign_key(f"{M}.fct_sales_transactions", "date_key", f"{M}.dim_date", "date_key"),
+    # Known source data issue: ingredients 249 and 270 reference provider 110
+    foreign_key(f"{M}.dim_ingredients", "provider_id", f"{M}.dim_providers", "provider_id",
+                min_value=2, max_value=2),
+    foreign_key(f"{M}.fct_recipe_composition", "raw_material_id", f"{M}.dim_raw_materials", "raw_material_id"),
+    foreign_key(f"{M}.fct_recipe_composition", "flavour_id", f"{M}.dim_flavours", "flavour_id",
+                extra_filter="p.is_current = TRUE"),
+    # Known source data issue: recipes use ingredient_ids 1-299, ingredients are 101-400
+    foreign_key(f"{M}.fct_recipe_composition", "ingredient_id", f"{M}.dim_ingredients", "ingredient_id",
+                min_value=1, max_value=59999),
+
+    # 3. SCD Type 2
+    Check(
+        "every flavour has exactly one current record",
+        f"{M}.dim_flavours",
+        query=f"""
+            SELECT COUNT(*) FROM (
+                SELECT flavour_id
+                FROM {M}.dim_flavours
+                WHERE is_current = TRUE
+                GROUP BY flavour_id
+                HAVING COUNT(*) != 1
+            )
+        """,
+    ),
+    violations("closed records have valid_to", f"{M}.dim_flavours",
+               "is_current = FALSE AND valid_to IS NULL"),
+    violations("current records have null valid_to", f"{M}.dim_flavours",
+               "is_current = TRUE AND valid_to IS NOT NULL"),
+    Check(
+        "scd2 no timeline gaps",
+        f"{M}.dim_flavours",
+        query=f"""
+            WITH versioned AS (
+                SELECT
+                    valid_to,
+                    is_current,
+                    LEAD(valid_from) OVER (
+                        PARTITION BY flavour_id ORDER BY valid_from
+                    ) AS next_valid_from
+                FROM {M}.dim_flavours
+            )
+            SELECT COUNT(*)
+            FROM versioned
+            WHERE is_current = FALSE
+              AND valid_to != next_valid_from
+        """,
+    ),
+    Check(
+        "sales reference the flavour version in force",
+        f"{M}.fct_sales_transactions",
+        query=f"""
+            SELECT COUNT(*)
+            FROM {M}.fct_sales_transactions s
+            JOIN (
+                SELECT
+                    *,
+                    MIN(valid_from) OVER (PARTITION BY flavour_id) AS first_valid_from
+                FROM {M}.dim_flavours
+            ) AS f
+                ON s.flavour_scd_key = f.flavour_scd_key
+            WHERE f.flavour_id != s.flavour_id
+               OR s.transaction_date >= f.valid_to
+               OR (s.transaction_date < f.valid_from AND f.valid_from != f.first_valid_from)
+        """,
+    ),
+    Check("all 500 flavours present", f"{M}.dim_flavours", "COUNT(DISTINCT flavour_id)",
+          min_value=500, max_value=500),
+
+    # 4. Business logic
+    violations("recipe ratios sum to one", f"{M}.fct_recipe_composition",
+               "total_ratio < 0.99 OR total_ratio > 1.01"),
+    violations("recipe ratios between 0 and 1", f"{M}.fct_recipe_composition",
+               "raw_material_ratio < 0 OR raw_material_ratio > 1 "
+               "OR flavour_ratio < 0 OR flavour_ratio > 1 "
+               "OR ingredient_ratio < 0 OR ingredient_ratio > 1"),
+    violations("yield percentage in [0, 100]", f"{M}.fct_recipe_composition",
+               "yield_percentage < 0 OR yield_percentage > 100"),
+    Check(
+        "recipes priced at current ingredient costs",
+        f"{M}.fct_recipe_cost",
+        query=f"""
+            SELECT COUNT(*)
+            FROM {M}.fct_recipe_cost c
+            LEFT JOIN {M}.dim_ingredients i
+                ON c.ingredient_id = i.ingredient_id
+            WHERE c.ingredient_cost_per_gram IS DISTINCT FROM i.cost_per_gram
+        """,
+    ),
+
+    # 5. Validity
+    violations("sales amounts non-negative", f"{M}.fct_sales_transactions", "amount_dollars < 0"),
+    # Known source data issue: promotional/sample transactions
+    violations("zero-amount transactions (known)", f"{M}.fct_sales_transactions",
+               "amount_dollars = 0", expected=22),
+    violations("sales quantities non-negative", f"{M}.fct_sales_transactions", "quantity_liters < 0"),
+    # Known source data issue: cancelled orders or data entry issues
+    violations("zero-quantity transactions (known)", f"{M}.fct_sales_transactions",
+               "quantity_liters = 0", expected=475),
+    violations("ingredient values positive", f"{M}.fct_provider_inventory", "total_ingredient_value <= 0"),
+    violations("ingredient weights positive", f"{M}.dim_ingredients", "weight_in_grams <= 0"),
+    violations("transaction dates in expected range", f"{M}.fct_sales_transactions",
+               "transaction_date < DATE '2023-01-01' OR transaction_date > DATE '2025-12-31'"),
+    Check(
+        "dim_date covers transaction dates",
+        f"{M}.fct_sales_transactions",
+        query=f"""
+            SELECT COUNT(*)
+            FROM {M}.fct_sales_transactions f
+            CROSS JOIN (SELECT MIN(full_date) AS first_day, MAX(full_date) AS last_day FROM {M}.dim_date) d
+            WHERE f.transaction_date NOT BETWEEN d.first_day AND d.last_day
+        """,
+    ),
+    Check(
+        "dim_date.date_key is an integer",
+        f"{M}.dim_date",
+        query=f"""
+            SELECT COUNT(*)
+            FROM information_schema.columns
+            WHERE table_schema = '{M}' AND table_name = 'dim_date' AND column_name = 'date_key'
+              AND data_type = 'INTEGER'
+        """,
+        min_value=1,
+        max_value=1,
+    ),
+    violations("dim_date keys are yyyymmdd", f"{M}.dim_date",
+               "date_key != CAST(STRFTIME(full_date, '%Y%m%d') AS INTEGER)"),
+
+    # 6. Row counts
+    row_count(f"{M}.dim_customers", 75),
+    row_count(f"{M}.dim_providers", 108),
+    row_count(f"{M}.dim_raw_materials", 200),
+    row_count(f"{M}.dim_ingredients", 300),
+    row_count(f"{M}.fct_sales_transactions", 50000),
+    row_count(f"{M}.fct_provider_inventory", 300),
+]
+
+
+def create_dq_results_table(con):
+    create_schema_if_not_exists(con, SCHEMA_META)
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {DQ_RESULTS_TABLE} (
+            run_id VARCHAR,
+            check_name VARCHAR,
+            table_name VARCHAR,
+            observed DOUBLE,
+            min_expected DOUBLE,
+            max_expected DOUBLE,
+            passed BOOLEAN,
+            checked_at TIMESTAMP
+        )
+    """)
+
+
+def _run_table_scan(con, table, checks):
+    """Evaluate all aggregate checks on one table with a single scan."""
+    cursor = con.cursor()
+    try:
+        row = cursor.execute(f"""
+            SELECT {", ".join(check.expression for check in checks)}
+            FROM {table}
+        """).fetchone()
+    finally:
+        cursor.close()
+    return list(zip(checks, row))
+
+
+def _run_query(con, check):
+    cursor = con.cursor()
+    try:
+        return [(check, cursor.execute(check.query).fetchone()[0])]
+    finally:
+        cursor.close()
+
+
+def run_quality_checks(checks=None, workers=DQ_WORKERS, run_id=None, con=None) -> bool:
+    """
+    Run the data quality checks in-process and store every result in
+    meta.dq_results. Returns True if all checks passed.
+    """
+    checks = CHECKS if checks is None else checks
+    run_id = run_id or new_run_id()
+
+    print("STEP 5: Running data quality checks")
+
+    by_table = {}
+    for check in checks:
+        if check.expression is not None:
+            by_table.setdefault(check.table, []).append(check)
+    queries = [check for check in checks if check.query is not None]
+
+    owns_connection = con is None
+    if owns_connection:
+        con = get_connection()
+    try:
+        create_dq_results_table(con)
+
+        results = []
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_run_table_scan, con, table, table_checks)
+                       for table, table_checks in by_table.items()]
+            futures += [pool.submit(_run_query, con, check) for check in queries]
+            for future in futures:
+                results.extend(future.result())
+
+        checked_at = datetime.now()
+        con.executemany(f"""
+            INSERT INTO {DQ_RESULTS_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, [
+            [run_id, check.name, check.table, observed, check.min_value, check.max_value,
+             check.passed(observed), checked_at]
+            for check, observed in results
+        ])
+    finally:
+        if owns_connection:
+            con.close()
+
+    failures = [(check, observed) for check, observed in results if not check.passed(observed)]
+    for check, observed in failures:
+        log(f"  FAILED {check.name}: got {observed}, expected "
+            f"[{check.min_value}, {check.max_value}]")
+
+    print(f"  {len(results) - len(failures)} of {len(results)} checks passed "
+          f"({len(by_table)} table scans, {len(queries)} queries)\n")
+    return not failures
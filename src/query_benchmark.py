@@ -0,0 +1,242 @@
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+
+import duckdb
+from src.benchmark import git_commit
+from src.config import (
+    DB_PATH, SCHEMA_MARTS, BENCHMARK_DIR, BENCHMARK_RESULTS_DB,
+    BENCHMARK_REGRESSION_THRESHOLD, BENCHMARK_NOISE_SECONDS,
+)
+from src.metrics import new_run_id
+from src.serving.service import LatencyStats
+from src.utils import log
+
+
+# Bump when a query below changes. Runs are only compared with a baseline
+# of the same version.
+QUERY_SUITE_VERSION = 1
+
+M = SCHEMA_MARTS
+
+# Representative dashboard queries over the marts
+QUERY_SUITE = {
+    "revenue_by_quarter": f"""
+        SELECT d.year_quarter, COUNT(*) AS transactions, SUM(s.amount_dollars) AS revenue
+        FROM {M}.fct_sales_transactions s
+        JOIN {M}.dim_date d ON s.date_key = d.date_key
+        GROUP BY d.year_quarter
+        ORDER BY d.year_quarter
+    """,
+    "top_flavours_per_country": f"""
+        SELECT s.transaction_country, f.flavour_name, SUM(s.amount_dollars) AS revenue
+        FROM {M}.fct_sales_transactions s
+        JOIN {M}.dim_flavours f ON s.flavour_id = f.flavour_id AND f.is_current = TRUE
+        GROUP BY s.transaction_country, f.flavour_name
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY s.transaction_country ORDER BY revenue DESC, f.flavour_name) <= 5
+        ORDER BY s.transaction_country, revenue DESC, f.flavour_name
+    """,
+    "recipe_composition_by_heat_process": f"""
+        SELECT
+            heat_process,
+            COUNT(*) AS recipes,
+            AVG(raw_material_pct) AS raw_material_pct,
+            AVG(flavour_pct) AS flavour_pct,
+            AVG(ingredient_pct) AS ingredient_pct,
+            AVG(yield_percentage) AS yield_percentage
+        FROM {M}.fct_recipe_composition
+        GROUP BY heat_process
+        ORDER BY heat_process NULLS FIRST
+    """,
+    "provider_inventory_value": f"""
+        SELECT provider_country, COUNT(*) AS ingredients, SUM(total_ingredient_value) AS total_value
+        FROM {M}.fct_provider_inventory
+        GROUP BY provider_country
+        ORDER BY total_value DESC, provider_country NULLS FIRST
+    """,
+    "flavours_as_of_date": f"""
+        SELECT flavour_id, flavour_description
+        FROM {M}.dim_flavours
+        WHERE valid_from <= DATE '2024-05-05'
+          AND (valid_to IS NULL OR valid_to > DATE '2024-05-05')
+        ORDER BY flavour_id
+    """,
+    "sales_by_flavour_version_one_week": f"""
+        SELECT f.flavour_id, f.flavour_description, COUNT(*) AS transactions, SUM(s.amount_dollars) AS revenue
+        FROM {M}.fct_sales_transactions s
+        JOIN {M}.dim_flavours f ON s.flavour_scd_key = f.flavour_scd_key
+        WHERE s.transaction_date BETWEEN DATE '2024-06-03' AND DATE '2024-06-09'
+        GROUP BY f.flavour_id, f.flavour_description
+        ORDER BY f.flavour_id, f.flavour_description
+    """,
+    "customer_revenue_by_month": f"""
+        SELECT d.year, d.month, SUM(s.amount_dollars) AS revenue
+        FROM {M}.fct_sales_transactions s
+        JOIN {M}.dim_date d ON s.date_key = d.date_key
+        WHERE s.customer_id = 30
+        GROUP BY d.year, d.month
+        ORDER BY d.year, d.month
+    """,
+}
+
+QUERY_RESULTS_TABLE = "query_benchmark_results"
+QUERY_BASELINES_TABLE = "query_benchmark_baselines"
+
+
+def result_hash(rows):
+    """Hash of a query result, with floats rounded so summation order doesn't matter."""
+    def normalize(value):
+        return f"{value:.9g}" if isinstance(value, float) else repr(value)
+    text = "\n".join("|".join(normalize(value) for value in row) for row in rows)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _profiled(con, sql):
+    """Run sql and return (rows, seconds, rows scanned, bytes read) from DuckDB's profile."""
+    start = time.perf_counter()
+    rows = con.execute(sql).fetchall()
+    seconds = time.perf_counter() - start
+    profile = json.loads(con.get_profiling_information(format="json"))
+    return rows, seconds, profile.get("cumulative_rows_scanned"), profile.get("total_bytes_read")
+
+
+def run_cold(db_path, name):
+    """One run of a query on a freshly opened database, so nothing is in DuckDB's buffer pool yet."""
+    con = duckdb.connect(db_path, read_only=True)
+    try:
+        con.execute("PRAGMA enable_profiling = 'no_output'")
+        return _profiled(con, QUERY_SUITE[name])
+    finally:
+        con.close()
+
+
+def create_query_results_tables(con):
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {QUERY_RESULTS_TABLE} (
+            run_id VARCHAR,
+            suite_version INTEGER,
+            git_commit VARCHAR,
+            database VARCHAR,
+            query_name VARCHAR,
+            cold_ms DOUBLE,
+            p50_ms DOUBLE,
+            p95_ms DOUBLE,
+            p99_ms DOUBLE,
+            rows_scanned BIGINT,
+            bytes_read BIGINT,
+            result_rows BIGINT,
+            result_hash VARCHAR,
+            recorded_at TIMESTAMP
+        )
+    """)
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {QUERY_BASELINES_TABLE} (
+            suite_version INTEGER,
+            database VARCHAR,
+            run_id VARCHAR,
+            PRIMARY KEY (suite_version, database)
+        )
+    """)
+
+
+def compare_to_baseline(con, run_id, threshold=BENCHMARK_REGRESSION_THRESHOLD):
+    """
+    Compare every query of run_id with the baseline run for the same suite
+    version and database. Returns one dict per query with the baseline
+    and current p50 latency and rows scanned, whether the result changed,
+    and whether the query regressed: its result changed, or it got more
+    than threshold times slower by more than BENCHMARK_NOISE_SECONDS.
+    Empty when there is no baseline.
+    """
+    cursor = con.execute(f"""
+        SELECT
+            c.query_name,
+            b.p50_ms AS baseline_p50_ms,
+            c.p50_ms,
+            b.rows_scanned AS baseline_rows_scanned,
+            c.rows_scanned,
+            c.result_hash != b.result_hash AS result_changed,
+            c.result_hash != b.result_hash
+                OR (c.p50_ms > b.p50_ms * ? AND c.p50_ms - b.p50_ms > ? * 1000) AS regressed
+        FROM {QUERY_RESULTS_TABLE} c
+        JOIN {QUERY_BASELINES_TABLE} bl
+            ON bl.suite_version = c.suite_version AND bl.database = c.database
+        JOIN {QUERY_RESULTS_TABLE} b
+            ON b.run_id = bl.run_id AND b.query_name = c.query_name
+        WHERE c.run_id = ?
+        ORDER BY c.query_name
+    """, [threshold, BENCHMARK_NOISE_SECONDS, run_id])
+    names = [column[0] for column in cursor.description]
+    return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+
+def run_query_benchmark(db_path=DB_PATH, warm_runs=20, save_baseline=False):
+    """
+    Run QUERY_SUITE against the database at db_path. Each query runs once
+    cold, on a freshly opened database, then warm_runs times on one open
+    connection. Stores cold latency, warm p50/p95/p99, rows scanned and
+    bytes read (from DuckDB's profile) and a hash of the result in
+    BENCHMARK_RESULTS_DB, and compares them with the stored baseline for
+    this suite version and database. With save_baseline this run becomes
+    the new baseline. Returns (run id, comparison).
+    """
+    run_id = new_run_id()
+    database = os.path.abspath(db_path)
+    print(f"Query benchmark run id: {run_id} (suite v{QUERY_SUITE_VERSION}, {database})")
+
+    cold = {name: run_cold(db_path, name) for name in QUERY_SUITE}
+
+    latency = LatencyStats(window=warm_runs)
+    con = duckdb.connect(db_path, read_only=True)
+    try:
+        for name, sql in QUERY_SUITE.items():
+            con.execute(sql).fetchall()
+            for _ in range(warm_runs):
+                start = time.perf_counter()
+                con.execute(sql).fetchall()
+                latency.record(name, time.perf_counter() - start)
+    finally:
+        con.close()
+    warm = latency.snapshot()
+
+    commit = git_commit()
+    recorded_at = datetime.now()
+    os.makedirs(BENCHMARK_DIR, exist_ok=True)
+    results = duckdb.connect(BENCHMARK_RESULTS_DB)
+    try:
+        create_query_results_tables(results)
+        results.executemany(f"""
+            INSERT INTO {QUERY_RESULTS_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [
+            [run_id, QUERY_SUITE_VERSION, commit, database, name, seconds * 1000,
+             warm[name]["p50_ms"], warm[name]["p95_ms"], warm[name]["p99_ms"],
+             rows_scanned, bytes_read, len(rows), result_hash(rows), recorded_at]
+            for name, (rows, seconds, rows_scanned, bytes_read) in cold.items()
+        ])
+        comparison = compare_to_baseline(results, run_id)
+        if save_baseline:
+            results.execute(f"""
+                INSERT OR REPLACE INTO {QUERY_BASELINES_TABLE} VALUES (?, ?, ?)
+            """, [QUERY_SUITE_VERSION, database, run_id])
+    finally:
+        results.close()
+
+    for name, (rows, seconds, rows_scanned, _) in cold.items():
+        log(f"  {name}: cold {seconds * 1000:.1f}ms, warm p50 {warm[name]['p50_ms']:.1f}ms "
+            f"p95 {warm[name]['p95_ms']:.1f}ms p99 {warm[name]['p99_ms']:.1f}ms, "
+            f"{rows_scanned or 0:,} rows scanned")
+
+    if comparison:
+        print("\nAgainst the baseline:")
+        for row in comparison:
+            status = "RESULT CHANGED" if row["result_changed"] else ("SLOWER" if row["regressed"] else "ok")
+            log(f"  {row['query_name']}: p50 {row['baseline_p50_ms']:.1f}ms -> {row['p50_ms']:.1f}ms, "
+                f"rows scanned {row['baseline_rows_scanned'] or 0:,} -> {row['rows_scanned'] or 0:,} ({status})")
+    else:
+        print("\nNo baseline for this suite version and database yet.")
+    if save_baseline:
+        print("Saved this run as the baseline.")
+    print()
+    return run_id, comparison
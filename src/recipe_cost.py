@@ -0,0 +1,170 @@
+from src.config import SCHEMA_MARTS, SCHEMA_META
+from src.incremental import plan_batches, save_batches_merged
+from src.layout import get_order_by_sql
+from src.utils import log, transaction
+
+
+RECIPE_COST_FACT = f"{SCHEMA_MARTS}.fct_recipe_cost"
+RECIPE_COMPOSITION = f"{SCHEMA_MARTS}.fct_recipe_composition"
+INGREDIENTS = f"{SCHEMA_MARTS}.dim_ingredients"
+
+# Reverse index of fct_recipe_cost: one row per ingredient with the keys of
+# every recipe using it and the cost_per_gram those recipes were priced at
+INGREDIENT_RECIPES_INDEX = f"{SCHEMA_META}.ingredient_recipes"
+
+# Rows of one ingredient sit together, so repricing it touches few row groups
+RECIPE_COST_SORT_BY = ["ingredient_id"]
+
+
+def get_recipe_cost_columns_sql(share, cost, yield_percentage):
+    """
+    Cost columns of a recipe given SQL expressions for its ingredient share
+    (ingredient ratio over total ratio), the ingredient's cost_per_gram and
+    its yield. Only ingredients have a cost in the sources, so that is the
+    whole cost of a recipe; raw materials and flavours add nothing.
+    """
+    return {
+        "ingredient_cost_per_gram": cost,
+        "recipe_cost_per_gram": f"ROUND({share} * {cost}, 4)",
+        "cost_per_gram_of_yield": f"ROUND({share} * {cost} / NULLIF({yield_percentage} / 100, 0), 4)",
+    }
+
+
+def get_recipe_cost_sql(where_clause):
+    columns = get_recipe_cost_columns_sql("ingredient_share", "cost_per_gram", "yield_percentage")
+    cost_columns = ",\n            ".join(f"{sql} AS {name}" for name, sql in columns.items())
+    return f"""
+        SELECT
+            recipe_key,
+            recipe_id,
+            ingredient_id,
+            ingredient_share,
+            yield_percentage,
+            {cost_columns},
+            batch_number
+        FROM (
+            SELECT
+                r.recipe_key,
+                r.recipe_id,
+                r.ingredient_id,
+                r.ingredient_ratio / NULLIF(r.total_ratio, 0) AS ingredient_share,
+                r.yield_percentage,
+                i.cost_per_gram,
+                r.batch_number
+            FROM {RECIPE_COMPOSITION} r
+            LEFT JOIN {INGREDIENTS} i
+                ON r.ingredient_id = i.ingredient_id
+            WHERE {where_clause}
+        )
+    """
+
+
+def get_index_entries_sql(where_clause):
+    return f"""
+        SELECT
+            ingredient_id,
+            ANY_VALUE(ingredient_cost_per_gram) AS cost_per_gram,
+            LIST(recipe_key ORDER BY recipe_key) AS recipe_keys
+        FROM {RECIPE_COST_FACT}
+        WHERE ingredient_id IS NOT NULL AND {where_clause}
+        GROUP BY ingredient_id
+    """
+
+
+def changed_ingredients(con):
+    """Ingredients in the index whose cost_per_gram in dim_ingredients differs from the one their recipes were priced at."""
+    return [row[0] for row in con.execute(f"""
+        SELECT x.ingredient_id
+        FROM {INGREDIENT_RECIPES_INDEX} x
+        LEFT JOIN {INGREDIENTS} i
+            ON x.ingredient_id = i.ingredient_id
+        WHERE x.cost_per_gram IS DISTINCT FROM i.cost_per_gram
+        ORDER BY x.ingredient_id
+    """).fetchall()]
+
+
+def reprice_recipes(con, ingredient_ids):
+    """
+    Reprice the recipes using ingredient_ids at their current cost_per_gram.
+    The recipes come from the reverse index, so no other recipe is read or
+    written. Returns the number of recipes repriced.
+    """
+    if not ingredient_ids:
+        return 0
+    ids = ", ".join(str(ingredient_id) for ingredient_id in ingredient_ids)
+    columns = get_recipe_cost_columns_sql("t.ingredient_share", "p.cost_per_gram", "t.yield_percentage")
+    repriced = con.execute(f"""
+        UPDATE {RECIPE_COST_FACT} AS t
+        SET {", ".join(f"{name} = {sql}" for name, sql in columns.items())}
+        FROM (
+            SELECT x.ingredient_id, UNNEST(x.recipe_keys) AS recipe_key, i.cost_per_gram
+            FROM {INGREDIENT_RECIPES_INDEX} x
+            LEFT JOIN {INGREDIENTS} i
+                ON x.ingredient_id = i.ingredient_id
+            WHERE x.ingredient_id IN ({ids})
+        ) AS p
+        WHERE t.ingredient_id IN ({ids})
+          AND t.ingredient_id = p.ingredient_id
+          AND t.recipe_key = p.recipe_key
+    """).fetchone()[0]
+    con.execute(f"""
+        UPDATE {INGREDIENT_RECIPES_INDEX} AS x
+        SET cost_per_gram = (SELECT i.cost_per_gram FROM {INGREDIENTS} i WHERE i.ingredient_id = x.ingredient_id)
+        WHERE x.ingredient_id IN ({ids})
+    """)
+    return repriced
+
+
+def index_new_recipes(con, first_batch):
+    """Add the recipes of batches from first_batch on to the reverse index."""
+    entries = get_index_entries_sql(f"batch_number >= {first_batch}")
+    con.execute(f"""
+        UPDATE {INGREDIENT_RECIPES_INDEX} AS x
+        SET recipe_keys = list_concat(x.recipe_keys, n.recipe_keys)
+        FROM ({entries}) AS n
+        WHERE x.ingredient_id = n.ingredient_id
+    """)
+    con.execute(f"""
+        INSERT INTO {INGREDIENT_RECIPES_INDEX}
+        SELECT n.*
+        FROM ({entries}) AS n
+        WHERE NOT EXISTS (SELECT 1 FROM {INGREDIENT_RECIPES_INDEX} x WHERE x.ingredient_id = n.ingredient_id)
+    """)
+
+
+def build_fct_recipe_cost(con):
+    """
+    Price the recipe batches newer than the last one merged, each batch
+    sorted by RECIPE_COST_SORT_BY, and reprice only the recipes whose
+    ingredient changed cost since they were priced, found through
+    INGREDIENT_RECIPES_INDEX. A rebuild recreates the table and the index.
+    """
+    with transaction(con):
+        new_batches, batches = plan_batches(con, RECIPE_COST_FACT, RECIPE_COMPOSITION)
+        rebuild = new_batches is None
+        repriced = 0
+        if rebuild:
+            con.execute(f"CREATE OR REPLACE TABLE {RECIPE_COST_FACT} AS {get_recipe_cost_sql('FALSE')}")
+            new_batches = [batch for batch, _, _ in batches]
+        else:
+            changed = changed_ingredients(con)
+            repriced = reprice_recipes(con, changed)
+            if changed:
+                log(f"  {RECIPE_COST_FACT}: {len(changed)} ingredients changed cost")
+
+        inserted = 0
+        for batch_number in new_batches:
+            inserted += con.execute(f"""
+                INSERT INTO {RECIPE_COST_FACT}
+                {get_recipe_cost_sql(f"r.batch_number = {batch_number}")}
+                {get_order_by_sql(RECIPE_COST_SORT_BY)}
+            """).fetchone()[0]
+
+        if rebuild:
+            con.execute(f"CREATE OR REPLACE TABLE {INGREDIENT_RECIPES_INDEX} AS {get_index_entries_sql('TRUE')}")
+        elif new_batches:
+            index_new_recipes(con, new_batches[0])
+        save_batches_merged(con, RECIPE_COST_FACT, batches)
+
+    log(f"  {RECIPE_COST_FACT}: {inserted:,} new, {repriced:,} repriced ({len(new_batches)} new batches merged)")
+    return inserted + repriced
@@ -0,0 +1,145 @@
+from src.config import SCHEMA_MARTS
+from src.incremental import plan_batches, save_batches_merged
+from src.utils import log, transaction
+
+
+SALES_FACT = f"{SCHEMA_MARTS}.fct_sales_transactions"
+
+# Rollup measures and how they're computed from the fact table. All of them
+# are additive, so a rollup can be summed again to a coarser grain.
+MEASURES = {
+    "transactions": "COUNT(*)",
+    "quantity_liters": "SUM(quantity_liters)",
+    "amount_dollars": "SUM(amount_dollars)",
+}
+
+# Fact columns the measures read. A rollup's batch fingerprints only cover
+# these and its dimensions, so re-keying a sale's flavour doesn't rebuild it.
+MEASURE_COLUMNS = ["quantity_liters", "amount_dollars"]
+
+# Rollup tables of fct_sales_transactions and the columns they group by
+ROLLUPS = {
+    "agg_sales_by_quarter": [
+        "transaction_year", "transaction_quarter", "transaction_year_quarter",
+    ],
+    "agg_sales_by_flavour_quarter": [
+        "flavour_id", "transaction_year", "transaction_quarter", "transaction_year_quarter",
+    ],
+    "agg_sales_by_customer_country_quarter": [
+        "customer_id", "transaction_country",
+        "transaction_year", "transaction_quarter", "transaction_year_quarter",
+    ],
+}
+
+
+def get_aggregate_sql(dimensions, where_clause="TRUE"):
+    measures = ",\n                ".join(f"{sql} AS {name}" for name, sql in MEASURES.items())
+    return f"""
+            SELECT
+                {", ".join(dimensions)},
+                {measures}
+            FROM {SALES_FACT}
+            WHERE {where_clause}
+            GROUP BY {", ".join(dimensions)}
+        """
+
+
+def build_rollup_model(name, dimensions):
+    """
+    run() for a rollup of fct_sales_transactions. After the first build,
+    only batches newer than the last merged one are aggregated and their
+    totals added to the matching rollup rows (or inserted as new rows).
+    """
+    relation = f"{SCHEMA_MARTS}.{name}"
+    matches = " AND ".join(f"r.{column} IS NOT DISTINCT FROM d.{column}" for column in dimensions)
+
+    def run(con):
+        with transaction(con):
+            new_batches, batches = plan_batches(con, relation, SALES_FACT, columns=[*dimensions, *MEASURE_COLUMNS])
+            if new_batches is None:
+                rows = con.execute(f"CREATE OR REPLACE TABLE {relation} AS {get_aggregate_sql(dimensions)}").fetchone()[0]
+                save_batches_merged(con, relation, batches)
+                log(f"  {relation}: {rows:,} rows")
+                return rows
+
+            updated = inserted = 0
+            if new_batches:
+                delta = get_aggregate_sql(dimensions, f"batch_number >= {new_batches[0]}")
+                updated = con.execute(f"""
+                    UPDATE {relation} AS r
+                    SET {", ".join(f"{m} = COALESCE(r.{m}, 0) + COALESCE(d.{m}, 0)" for m in MEASURES)}
+                    FROM ({delta}) AS d
+                    WHERE {matches}
+                """).fetchone()[0]
+                inserted = con.execute(f"""
+                    INSERT INTO {relation}
+                    SELECT d.*
+                    FROM ({delta}) AS d
+                    WHERE NOT EXISTS (SELECT 1 FROM {relation} r WHERE {matches})
+                """).fetchone()[0]
+            save_batches_merged(con, relation, batches)
+
+        log(f"  {relation}: {updated:,} updated, {inserted:,} new ({len(new_batches)} new batches merged)")
+        return updated + inserted
+
+    return run
+
+
+def route(con, columns):
+    """
+    The smallest relation that can answer a sales query grouping or
+    filtering on columns: a rollup with all of them, else the fact table.
+    Sizes come from DuckDB's catalog estimates.
+    """
+    candidates = [name for name, dimensions in ROLLUPS.items() if set(columns) <= set(dimensions)]
+    if not candidates:
+        return SALES_FACT
+
+    placeholders = ", ".join("?" for _ in candidates)
+    sizes = dict(con.execute(f"""
+        SELECT table_name, estimated_size
+        FROM duckdb_tables()
+        WHERE schema_name = ? AND table_name IN ({placeholders})
+    """, [SCHEMA_MARTS, *candidates]).fetchall())
+    built = [name for name in candidates if name in sizes]
+    if not built:
+        return SALES_FACT
+    return f"{SCHEMA_MARTS}.{min(built, key=lambda name: sizes[name])}"
+
+
+def get_sales_query_sql(con, group_by, filter_columns):
+    """
+    SQL for sales totals (MEASURES) grouped by group_by, with an equality
+    filter on each of filter_columns as $1, $2, ... placeholders. It reads
+    the smallest rollup that has every column involved. Returns
+    (relation used, sql).
+    """
+    columns = [*group_by, *filter_columns]
+    for column in columns:
+        if not column.isidentifier():
+            raise ValueError(f"Not a column name: {column!r}")
+
+    relation = route(con, columns)
+    if relation == SALES_FACT:
+        measures = [f"{sql} AS {name}" for name, sql in MEASURES.items()]
+    else:
+        measures = [f"SUM({name}) AS {name}" for name in MEASURES]
+
+    where_clause = " AND ".join(
+        f"{column} = ${position}" for position, column in enumerate(filter_columns, start=1)
+    ) or "TRUE"
+    group_clause = f"GROUP BY {', '.join(group_by)} ORDER BY {', '.join(group_by)}" if group_by else ""
+    return relation, f"""
+        SELECT {", ".join([*group_by, *measures])}
+        FROM {relation}
+        WHERE {where_clause}
+        {group_clause}
+    """
+
+
+def query_sales(con, group_by=(), **filters):
+    """Run get_sales_query_sql() once. Returns (relation used, rows as dicts)."""
+    relation, sql = get_sales_query_sql(con, group_by, list(filters))
+    cursor = con.execute(sql, list(filters.values()))
+    names = [column[0] for column in cursor.description]
+    return relation, [dict(zip(names, row)) for row in cursor.fetchall()]
@@ -0,0 +1,125 @@
+import math
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+from src.config import SCHEMA_MARTS
+
+
+@dataclass
+class Query:
+    """
+    A dashboard query, prepared once on every pooled connection. ``params``
+    lists the (name, type) of each $n placeholder in order; only int, float
+    and str are supported.
+    """
+    name: str
+    sql: str
+    params: List[Tuple[str, type]] = field(default_factory=list)
+
+
+QUERIES = {query.name: query for query in [
+    Query(
+        name="sales_by_quarter",
+        sql=f"""
+            SELECT
+                transaction_year,
+                transaction_quarter,
+                COUNT(*) AS transactions,
+                SUM(quantity_liters) AS quantity_liters,
+                SUM(amount_dollars) AS amount_dollars
+            FROM {SCHEMA_MARTS}.fct_sales_transactions
+            GROUP BY transaction_year, transaction_quarter
+            ORDER BY transaction_year, transaction_quarter
+        """,
+    ),
+    Query(
+        name="sales_by_flavour",
+        sql=f"""
+            SELECT
+                s.flavour_id,
+                f.flavour_name,
+                COUNT(*) AS transactions,
+                SUM(s.quantity_liters) AS quantity_liters,
+                SUM(s.amount_dollars) AS amount_dollars
+            FROM {SCHEMA_MARTS}.fct_sales_transactions s
+            LEFT JOIN {SCHEMA_MARTS}.dim_flavours f
+                ON s.flavour_id = f.flavour_id AND f.is_current = TRUE
+            WHERE s.transaction_year = $1 AND s.transaction_quarter = $2
+            GROUP BY s.flavour_id, f.flavour_name
+            ORDER BY amount_dollars DESC
+        """,
+        params=[("year", int), ("quarter", int)],
+    ),
+    Query(
+        name="sales_by_customer",
+        sql=f"""
+            SELECT
+                s.customer_id,
+                c.customer_name,
+                c.customer_country,
+                COUNT(*) AS transactions,
+                SUM(s.quantity_liters) AS quantity_liters,
+                SUM(s.amount_dollars) AS amount_dollars
+            FROM {SCHEMA_MARTS}.fct_sales_transactions s
+            LEFT JOIN {SCHEMA_MARTS}.dim_customers c ON s.customer_id = c.customer_id
+            WHERE s.transaction_year = $1 AND s.transaction_quarter = $2
+            GROUP BY s.customer_id, c.customer_name, c.customer_country
+            ORDER BY amount_dollars DESC
+        """,
+        params=[("year", int), ("quarter", int)],
+    ),
+    Query(
+        name="flavour_sales_by_quarter",
+        sql=f"""
+            SELECT
+                transaction_year,
+                transaction_quarter,
+                COUNT(*) AS transactions,
+                SUM(quantity_liters) AS quantity_liters,
+                SUM(amount_dollars) AS amount_dollars
+            FROM {SCHEMA_MARTS}.fct_sales_transactions
+            WHERE flavour_id = $1
+            GROUP BY transaction_year, transaction_quarter
+            ORDER BY transaction_year, transaction_quarter
+        """,
+        params=[("flavour_id", int)],
+    ),
+    Query(
+        name="current_flavour",
+        sql=f"""
+            SELECT
+                flavour_id,
+                flavour_name,
+                flavour_description,
+                valid_from
+            FROM {SCHEMA_MARTS}.dim_flavours
+            WHERE flavour_id = $1 AND is_current = TRUE
+        """,
+        params=[("flavour_id", int)],
+    ),
+]}
+
+
+def render_params(query, params):
+    """
+    SQL literals for an EXECUTE of a prepared query. DuckDB can't bind
+    Python parameters to EXECUTE, so values are checked against the query's
+    declared types and quoted here. NaN and infinite floats have no numeric
+    literal and are cast from their string form.
+    """
+    names = [name for name, _ in query.params]
+    if sorted(params) != sorted(names):
+        raise ValueError(f"{query.name} takes parameters {names}, got {sorted(params)}")
+
+    literals = []
+    for name, kind in query.params:
+        value = params[name]
+        if kind is str:
+            literals.append("'" + str(value).replace("'", "''") + "'")
+        elif kind is float and not math.isfinite(float(value)):
+            literals.append(f"'{float(value)!r}'::DOUBLE")
+        elif kind in (int, float):
+            literals.append(repr(kind(value)))
+        else:
+            raise ValueError(f"Unsupported parameter type for {query.name}.{name}: {kind}")
+    return ", ".join(literals)
@@ -0,0 +1,148 @@
+import hashlib
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, List
+
+import duckdb
+from src.config import DB_PATH, SERVING_POOL_SIZE, SERVING_LATENCY_WINDOW
+from src.rollups import get_sales_query_sql
+from src.serving.queries import QUERIES, Query, render_params
+
+
+class ConnectionPool:
+    """
+    Fixed set of read-only connections to the pipeline database. They all
+    share one DuckDB instance, and every query in QUERIES is prepared on
+    each of them up front, so callers pay neither connection setup nor
+    planning per request.
+    """
+
+    def __init__(self, db_path=DB_PATH, size=SERVING_POOL_SIZE, queries=QUERIES):
+        self.queries = queries
+        self._database = duckdb.connect(db_path, read_only=True)
+        self._idle = queue.Queue()
+        self._prepared = {}
+        for _ in range(size):
+            con = self._database.cursor()
+            for query in queries.values():
+                self.prepare(con, query)
+            self._idle.put(con)
+        self.size = size
+
+    def prepare(self, con, query):
+        """PREPARE query on con unless it already is. Only call with a borrowed connection."""
+        prepared = self._prepared.setdefault(id(con), set())
+        if query.name not in prepared:
+            con.execute(f"PREPARE {query.name} AS {query.sql}")
+            prepared.add(query.name)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Borrow a connection, waiting up to timeout seconds for one to be free."""
+        try:
+            con = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No serving connection free after {timeout}s") from None
+        try:
+            yield con
+        finally:
+            self._idle.put(con)
+
+    def close(self):
+        for _ in range(self.size):
+            self._idle.get().close()
+        self._database.close()
+
+
+class LatencyStats:
+    """Per-query call counts and latency percentiles over the most recent calls."""
+
+    def __init__(self, window=SERVING_LATENCY_WINDOW):
+        self._lock = threading.Lock()
+        self._window = window
+        self._samples = {}
+        self._calls = {}
+
+    def record(self, name, seconds):
+        with self._lock:
+            self._samples.setdefault(name, deque(maxlen=self._window)).append(seconds)
+            self._calls[name] = self._calls.get(name, 0) + 1
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            samples = {name: sorted(values) for name, values in self._samples.items()}
+            calls = dict(self._calls)
+
+        def percentile(values, p):
+            return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+        return {
+            name: {
+                "calls": calls[name],
+                "p50_ms": percentile(values, 50) * 1000,
+                "p95_ms": percentile(values, 95) * 1000,
+                "p99_ms": percentile(values, 99) * 1000,
+                "max_ms": values[-1] * 1000,
+            }
+            for name, values in samples.items()
+        }
+
+
+class QueryService:
+    """
+    Runs named dashboard queries (see src/serving/queries.py) on pooled
+    connections. Safe to call from many threads at once.
+
+        service = QueryService()
+        service.run("sales_by_flavour", year=2024, quarter=1)
+        service.aggregate(["flavour_id"], transaction_year=2024)
+    """
+
+    def __init__(self, pool=None, timeout=30):
+        self.pool = pool or ConnectionPool()
+        self.timeout = timeout
+        self.latency = LatencyStats()
+        self._lock = threading.Lock()
+        self._aggregates = {}
+
+    def _execute(self, con, query, params):
+        arguments = render_params(query, params)
+        cursor = con.execute(f"EXECUTE {query.name}({arguments})" if arguments else f"EXECUTE {query.name}")
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def run(self, name, **params) -> List[Dict[str, Any]]:
+        if name not in self.pool.queries:
+            raise ValueError(f"Unknown query: {name}")
+
+        start = time.perf_counter()
+        with self.pool.connection(self.timeout) as con:
+            rows = self._execute(con, self.pool.queries[name], params)
+        self.latency.record(name, time.perf_counter() - start)
+        return rows
+
+    def aggregate(self, group_by=(), **filters) -> List[Dict[str, Any]]:
+        """
+        Sales totals by any columns, answered from the smallest rollup that
+        can (src/rollups.py). Each combination of columns is routed once and
+        then runs as a prepared statement like the named queries.
+        """
+        shape = (tuple(group_by), tuple((column, type(value)) for column, value in filters.items()))
+        start = time.perf_counter()
+        with self.pool.connection(self.timeout) as con:
+            with self._lock:
+                if shape not in self._aggregates:
+                    relation, sql = get_sales_query_sql(con, group_by, list(filters))
+                    name = "aggregate_" + hashlib.md5(repr(shape).encode()).hexdigest()[:12]
+                    self._aggregates[shape] = (relation, Query(name, sql, params=list(shape[1])))
+                relation, query = self._aggregates[shape]
+            self.pool.prepare(con, query)
+            rows = self._execute(con, query, filters)
+        self.latency.record(f"aggregate:{relation}", time.perf_counter() - start)
+        return rows
+
+    def close(self):
+        self.pool.close()
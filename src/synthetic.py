@@ -0,0 +1,250 @@
+import os
+
+import duckdb
+from src.config import CSV_FILES, SOURCE_SCHEMAS
+
+
+# Rows per source at scale factor 1, the size of the shipped CSVs
+SF1_ROWS = {
+    "customers": 75,
+    "providers": 108,
+    "raw_materials": 200,
+    "ingredients": 300,
+    "flavours": 500,
+    "recipes": 166_722,
+    "sales_transactions": 50_000,
+}
+
+# Flavours whose description changes in the second batch: 99 of every 500
+FLAVOUR_CHANGES = (99, 500)
+
+# Known source data issues, as (rows, out of every) found in the shipped CSVs
+ORPHAN_PROVIDERS = (2, 300)
+ZERO_QUANTITIES = (475, 50_000)
+ZERO_AMOUNTS = (22, 50_000)
+
+SALES_START_DATE = "2023-02-16"
+SALES_DAYS = 700
+
+CUSTOMER_LOCATIONS = [
+    ("New York", "USA"), ("London", "UK"), ("Tokyo", "Japan"), ("Sydney", "Australia"),
+    ("Toronto", "Canada"), ("Berlin", "Germany"), ("Paris", "France"), ("Singapore", "Singapore"),
+    ("Madrid", "Spain"), ("Dubai", "UAE"), ("Milan", "Italy"), ("Seoul", "South Korea"),
+]
+
+# (city, country in the first providers batch, country in the second)
+PROVIDER_LOCATIONS = [
+    ("London", "UK", "United Kingdom"), ("Seattle", "USA", "United States"),
+    ("Berlin", "Germany", "Germany"), ("Lyon", "France", "France"),
+    ("Mumbai", "India", "India"), ("Osaka", "Japan", "Japan"),
+]
+
+SALES_LOCATIONS = [
+    ("CHINA", "Shanghai"), ("ISRAEL", "Ramat Gan"), ("INDIA", "Delhi"), ("FRANCE", "Marseille"),
+    ("JAPAN", "Osaka"), ("CANADA", "Edmonton"), ("GERMANY", "Hamburg"), ("SPAIN", "Barcelona"),
+]
+
+HEAT_PROCESSES = ["Boiling", "", "Roasting", " Steaming "]
+
+# Recipes mix every format in DATE_FORMATS, the other sources use one each
+RECIPE_DATE_STRINGS = ["5/5/24", "05/05/2024", "5-May-24"]
+
+
+def _sql_list(values):
+    return "[" + ", ".join("'" + value.replace("'", "''") + "'" for value in values) + "]"
+
+
+class _Random:
+    """Deterministic pseudo-random SQL expressions, derived from a row's id and the seed."""
+
+    def __init__(self, seed):
+        self.seed = seed
+
+    def uniform(self, salt, id_column="id"):
+        return f"((hash({id_column}, '{salt}', {self.seed}) % 1000000)::DOUBLE / 1000000)"
+
+    def integer(self, salt, low, high, id_column="id"):
+        return f"({low} + (hash({id_column}, '{salt}', {self.seed}) % ({high} - {low} + 1))::BIGINT)"
+
+    def choice(self, salt, values, id_column="id"):
+        return f"{_sql_list(values)}[{self.integer(salt, 1, len(values), id_column)}]"
+
+    def exactly(self, rows_per_period, salt, id_column="id"):
+        """
+        True for exactly rows of every period consecutive ids, scattered by
+        multiplying with a prime, so whole scale factors reproduce the
+        counts of the shipped CSVs.
+        """
+        rows, period = rows_per_period
+        offset = self.integer(salt, 0, period - 1, "0")
+        return f"(({id_column} * 7919 + {offset}) % {period} < {rows})"
+
+
+def source_row_counts(scale_factor):
+    return {source: max(1, round(rows * scale_factor)) for source, rows in SF1_ROWS.items()}
+
+
+def get_source_sql(source, counts, random):
+    """SELECT producing one source at the row counts given, with the columns of its contract."""
+    if source == "customers":
+        cities = _sql_list([city for city, _ in CUSTOMER_LOCATIONS])
+        countries = _sql_list([country for _, country in CUSTOMER_LOCATIONS])
+        location = random.integer("location", 1, len(CUSTOMER_LOCATIONS))
+        return f"""
+            SELECT
+                id AS customer_id,
+                'Customer ' || id AS name,
+                {cities}[{location}] AS location_city,
+                {countries}[{location}] AS location_country,
+                '08/05/2024' AS generation_date,
+                1 AS batch_number
+            FROM range(1, {counts["customers"]} + 1) t(id)
+        """
+
+    if source == "providers":
+        # Every provider in two batches, names and cities padded with a
+        # space, and the second batch spelling countries out in full
+        cities = _sql_list([city for city, _, _ in PROVIDER_LOCATIONS])
+        short_countries = _sql_list([short for _, short, _ in PROVIDER_LOCATIONS])
+        long_countries = _sql_list([full for _, _, full in PROVIDER_LOCATIONS])
+        location = random.integer("location", 1, len(PROVIDER_LOCATIONS))
+        return f"""
+            SELECT
+                id AS provider_id,
+                ' Provider ' || id AS name,
+                ' ' || {cities}[{location}] AS location_city,
+                CASE WHEN batch = 1 THEN {short_countries}[{location}]
+                     ELSE ' ' || {long_countries}[{location}] END AS location_country,
+                '5/5/24' AS generation_date,
+                batch AS batch_number
+            FROM range(1, {counts["providers"]} + 1) t(id), range(1, 3) b(batch)
+            ORDER BY batch DESC, id
+        """
+
+    if source == "raw_materials":
+        return f"""
+            SELECT
+                id AS raw_material_id,
+                'Raw Material ' || id AS name,
+                '5/5/24' AS generation_date,
+                1 AS batch_number
+            FROM range(1, {counts["raw_materials"]} + 1) t(id)
+        """
+
+    if source == "ingredients":
+        # Ids start at 101 as in the source; a few reference a provider that doesn't exist
+        return f"""
+            SELECT
+                100 + id AS ingredient_id,
+                'Ingredient ' || id AS name,
+                'C' || {random.integer("carbon", 1, 20)} || 'H' || {random.integer("hydrogen", 1, 40)} AS chemical_formula,
+                ROUND(50 + 250 * {random.uniform("weight")}, 1) AS weight_in_grams,
+                ROUND(1 + 14 * {random.uniform("cost")}, 1) AS cost_per_gram,
+                CASE WHEN {random.exactly(ORPHAN_PROVIDERS, "orphan")}
+                     THEN {counts["providers"]} + 2
+                     ELSE {random.integer("provider", 1, counts["providers"])} END AS provider_id,
+                '7-May-24' AS generation_date,
+                1 AS batch_number
+            FROM range(1, {counts["ingredients"]} + 1) t(id)
+        """
+
+    if source == "flavours":
+        # Two batches with the same generation date; some descriptions change in the second
+        return f"""
+            SELECT
+                id AS flavour_id,
+                'Flavour ' || id AS name,
+                CASE WHEN batch = 2 AND {random.exactly(FLAVOUR_CHANGES, "changed")}
+                     THEN 'A revised, richer profile for flavour ' || id
+                     ELSE 'A sweet, balanced profile for flavour ' || id END AS description,
+                '5/5/24' AS generation_date,
+                batch AS batch_number
+            FROM range(1, {counts["flavours"]} + 1) t(id), range(1, 3) b(batch)
+            ORDER BY batch, id
+        """
+
+    if source == "recipes":
+        # Ingredient ids 1..n, while ingredients are 101..n+100, as in the source
+        return f"""
+            SELECT
+                'R' || LPAD(id::VARCHAR, 7, '0') AS recipe_id,
+                {random.integer("raw_material", 1, counts["raw_materials"])} AS raw_material_id,
+                raw_material_ratio,
+                {random.integer("flavour", 1, counts["flavours"])} AS flavour_id,
+                flavour_ratio,
+                {random.integer("ingredient", 1, max(1, counts["ingredients"] - 1))} AS ingredient_id,
+                ROUND(1 - raw_material_ratio - flavour_ratio, 2) AS ingredient_ratio,
+                NULLIF({random.choice("heat", HEAT_PROCESSES)}, '') AS heat_process,
+                ROUND(50 + 50 * {random.uniform("yield")}, 1) AS yield,
+                {random.choice("date", RECIPE_DATE_STRINGS)} AS generation_date,
+                1 AS batch_number
+            FROM (
+                SELECT
+                    id,
+                    ROUND(0.1 + 0.3 * {random.uniform("raw_material_ratio")}, 2) AS raw_material_ratio,
+                    ROUND(0.1 + 0.3 * {random.uniform("flavour_ratio")}, 2) AS flavour_ratio
+                FROM range(0, {counts["recipes"]}) t(id)
+            )
+        """
+
+    if source == "sales_transactions":
+        countries = _sql_list([country for country, _ in SALES_LOCATIONS])
+        towns = _sql_list([town for _, town in SALES_LOCATIONS])
+        location = random.integer("location", 1, len(SALES_LOCATIONS))
+        return f"""
+            SELECT
+                id AS transaction_id,
+                {random.integer("customer", 1, counts["customers"])} AS customer_id,
+                {random.integer("flavour", 1, counts["flavours"])} AS flavour_id,
+                quantity_liters,
+                STRFTIME(DATE '{SALES_START_DATE}' + {random.integer("date", 0, SALES_DAYS - 1)}::INTEGER,
+                         '%-m/%-d/%y') AS transaction_date,
+                {countries}[{location}] AS transaction_country,
+                {towns}[{location}] AS transaction_town,
+                UPPER(SUBSTR(MD5(id::VARCHAR), 1, 6)) AS postal_code,
+                CASE WHEN {random.exactly(ZERO_AMOUNTS, "zero_amount")} THEN 0
+                     ELSE GREATEST(quantity_liters, 1000) * {random.integer("price", 5, 25)} END AS amount_dollar,
+                {random.choice("generated", ["5/5/24", "5/6/24"])} AS generation_date,
+                CASE WHEN id < {counts["sales_transactions"]} // 2 THEN 1 ELSE 2 END AS batch_number
+            FROM (
+                SELECT
+                    id,
+                    CASE WHEN {random.exactly(ZERO_QUANTITIES, "zero_quantity")} THEN 0
+                         ELSE 1000 * {random.integer("quantity", 1, 99)} END AS quantity_liters
+                FROM range(0, {counts["sales_transactions"]}) t(id)
+            )
+        """
+
+    raise ValueError(f"No generator for source {source}")
+
+
+def generate_sources(scale_factor, output_dir, seed=42):
+    """
+    Write every source in CSV_FILES to output_dir at scale_factor times the
+    size of the shipped CSVs (SF1 = 50,000 sales). The files follow the
+    source contracts and keep the quirks of the real data: a different date
+    format per source and mixed formats in recipes, space-padded providers
+    listed in two batches, flavour descriptions changing between two
+    batches, orphaned foreign keys and zero-quantity/zero-amount sales.
+    Output is the same for the same scale factor and seed. Returns the row
+    count per source.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    counts = source_row_counts(scale_factor)
+    random = _Random(seed)
+
+    con = duckdb.connect()
+    try:
+        for source, file_name in CSV_FILES.items():
+            columns = ", ".join(SOURCE_SCHEMAS[source])
+            path = os.path.join(output_dir, file_name)
+            con.execute(f"""
+                COPY (SELECT {columns} FROM ({get_source_sql(source, counts, random)}))
+                TO '{path}' (HEADER, DELIMITER ',')
+            """)
+    finally:
+        con.close()
+
+    counts["providers"] *= 2
+    counts["flavours"] *= 2
+    return counts
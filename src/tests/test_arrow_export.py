@@ -0,0 +1,65 @@
+import pytest
+import duckdb
+from src.arrow_export import get_filter_sql, stream_query, stream_table
+
+pyarrow = pytest.importorskip("pyarrow")
+
+
+@pytest.fixture()
+
+def con():
+    connection = duckdb.connect()
+    connection.execute("CREATE SCHEMA marts")
+    connection.execute("""
+        CREATE TABLE marts.sales AS
+        SELECT range AS id, range % 10 AS customer_id, range * 1.5 AS amount
+        FROM range(1000)
+    """)
+    yield connection
+    connection.close()
+
+
+class TestStreamTable:
+    """Verify mart tables stream as Arrow batches with projection and filters."""
+
+    def test_batches_are_bounded(self, con):
+        reader = stream_table("sales", batch_size=300, con=con)
+        assert isinstance(reader, pyarrow.RecordBatchReader)
+        sizes = [batch.num_rows for batch in reader]
+        assert sum(sizes) == 1000
+        assert max(sizes) <= 300
+
+    def test_projection_and_filters(self, con):
+        table = stream_table(
+            "sales", columns=["id", "amount"],
+            filters=[("customer_id", "in", [1, 2]), ("id", "<", 100)], con=con,
+        ).read_all()
+        assert table.column_names == ["id", "amount"]
+        assert table.num_rows == 20
+        assert stream_table("sales", filters={"customer_id": 3}, con=con).read_all().num_rows == 100
+
+    def test_filters_are_parameters(self):
+        assert get_filter_sql([("name", "=", "x' OR 1=1 --")], ["name"]) == ('"name" = ?', ["x' OR 1=1 --"])
+        assert get_filter_sql([("name", "in", [])], ["name"]) == ("FALSE", [])
+        assert get_filter_sql([("name", "is null")], ["name"]) == ('"name" IS NULL', [])
+
+    def test_unknown_names_rejected(self, con):
+        with pytest.raises(ValueError, match="Unknown mart table"):
+            stream_table("nope", con=con)
+        with pytest.raises(ValueError, match="Unknown columns"):
+            stream_table("sales", columns=["id", "amount; DROP TABLE marts.sales"], con=con)
+        with pytest.raises(ValueError, match="Unknown column"):
+            stream_table("sales", filters={"nope": 1}, con=con)
+        with pytest.raises(ValueError, match="Unsupported filter operator"):
+            stream_table("sales", filters=[("id", "like", "1%")], con=con)
+
+    def test_own_connection_closed_when_exhausted(self, tmp_path):
+        db_path = str(tmp_path / "pipeline.duckdb")
+        with duckdb.connect(db_path) as writer:
+            writer.execute("CREATE SCHEMA marts")
+            writer.execute("CREATE TABLE marts.t AS SELECT range AS x FROM range(10)")
+
+        assert stream_table("t", db_path=db_path).read_all().num_rows == 10
+        assert stream_query("SELECT SUM(x) AS total FROM marts.t", db_path=db_path).read_all().to_pylist() == [{"total": 45}]
+        # Nothing holds the database open any more, so it can be opened for writing
+        duckdb.connect(db_path).close()
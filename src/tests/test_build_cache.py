@@ -0,0 +1,123 @@
+import sys
+import pytest
+import duckdb
+from src.build_cache import (
+    create_manifest_tables, compute_fingerprints, code_changed, code_hash, hash_file, is_up_to_date,
+    record_build,
+)
+from src.dag import Model
+
+A_TABLE = "main.a"
+B_TABLE = "main.b"
+
+
+def select_sql(table):
+    return f"SELECT * FROM {table}"
+
+
+def run_a(con):
+    return con.execute(select_sql(A_TABLE)).fetchone()[0]
+
+
+def run_b(con):
+    return con.execute(f"SELECT * FROM {B_TABLE}").fetchone()[0]
+
+
+@pytest.fixture()
+
+def con():
+    connection = duckdb.connect()
+    create_manifest_tables(connection)
+    yield connection
+    connection.close()
+
+
+def make_models(csv_path, b_sql="SELECT * FROM s.a"):
+    return [
+        Model(name="a", schema="s", sql="SELECT 1 AS x", source_files=[csv_path]),
+        Model(name="b", schema="s", sql=b_sql, depends_on=["s.a"]),
+        Model(name="c", schema="s", sql="SELECT 2 AS x"),
+    ]
+
+
+class TestFingerprints:
+    """Verify fingerprints change exactly when a model or its inputs change."""
+
+    def test_stable_when_nothing_changes(self, con, tmp_path):
+        csv_path = tmp_path / "a.csv"
+        csv_path.write_text("x\n1\n")
+        first = compute_fingerprints(con, make_models(str(csv_path)))
+        second = compute_fingerprints(con, make_models(str(csv_path)))
+        assert first == second
+
+    def test_sql_change_propagates_downstream_only(self, con, tmp_path):
+        csv_path = tmp_path / "a.csv"
+        csv_path.write_text("x\n1\n")
+        before = compute_fingerprints(con, make_models(str(csv_path)))
+        after = compute_fingerprints(con, make_models(str(csv_path), b_sql="SELECT x FROM s.a"))
+        assert before["s.a"] == after["s.a"]
+        assert before["s.b"] != after["s.b"]
+        assert before["s.c"] == after["s.c"]
+
+    def test_source_file_change_propagates(self, con, tmp_path):
+        csv_path = tmp_path / "a.csv"
+        csv_path.write_text("x\n1\n")
+        before = compute_fingerprints(con, make_models(str(csv_path)))
+        csv_path.write_text("x\n1\n2\n")
+        after = compute_fingerprints(con, make_models(str(csv_path)))
+        assert before["s.a"] != after["s.a"]
+        assert before["s.b"] != after["s.b"]
+        assert before["s.c"] == after["s.c"]
+
+    def test_missing_source_file(self, con, tmp_path):
+        assert hash_file(con, str(tmp_path / "nope.csv")) == "missing"
+
+
+class TestManifest:
+    """Verify the manifest only reports a model up to date if its table exists."""
+
+    def test_up_to_date_after_build(self, con):
+        model = Model(name="a", schema="main", sql="SELECT 1 AS x")
+        assert not is_up_to_date(con, model, "fp")
+        con.execute("CREATE TABLE main.a AS SELECT 1 AS x")
+        record_build(con, model, "fp")
+        assert is_up_to_date(con, model, "fp")
+        assert not is_up_to_date(con, model, "other")
+
+    def test_dropped_table_is_rebuilt(self, con):
+        model = Model(name="a", schema="main", sql="SELECT 1 AS x")
+        record_build(con, model, "fp")
+        assert not is_up_to_date(con, model, "fp")
+
+    def test_view_over_deleted_files_is_rebuilt(self, con, tmp_path):
+        # A raw table with the raw cache on
+        path = tmp_path / "a.parquet"
+        con.execute(f"COPY (SELECT 1 AS x) TO '{path}' (FORMAT parquet)")
+        con.execute(f"CREATE VIEW main.a AS SELECT * FROM read_parquet('{path}')")
+        model = Model(name="a", schema="main", run=run_a)
+        record_build(con, model, "fp")
+        assert is_up_to_date(con, model, "fp")
+        path.unlink()
+        assert not is_up_to_date(con, model, "fp")
+
+    def test_code_change_detected(self, con):
+        model = Model(name="a", schema="main", sql="SELECT 1 AS x")
+        assert not code_changed(con, model)
+        record_build(con, model, "fp")
+        assert not code_changed(con, model)
+        assert code_changed(con, Model(name="a", schema="main", sql="SELECT 2 AS x"))
+
+    def test_run_model_code_is_its_own_call_graph(self, monkeypatch):
+        module = sys.modules[__name__]
+        model_a = Model(name="a", schema="main", run=run_a)
+        model_b = Model(name="b", schema="main", run=run_b)
+        before_a, before_b = code_hash(model_a), code_hash(model_b)
+
+        # Constants read by run_b only
+        monkeypatch.setattr(module, "B_TABLE", "main.b2")
+        assert code_hash(model_a) == before_a
+        assert code_hash(model_b) != before_b
+
+        # A helper called by run_a
+        monkeypatch.setattr(module, "select_sql", lambda table: f"SELECT 1 FROM {table}")
+        assert code_hash(model_a) != before_a
@@ -0,0 +1,104 @@
+import time
+import pytest
+import duckdb
+from src.dag import Model
+
+
+def make_models():
+    # s2.b fails until main.gate exists
+    return [
+        Model(name="a", schema="s1", sql="SELECT range AS x FROM range(5)"),
+        Model(name="b", schema="s2", sql="SELECT a.x FROM s1.a a JOIN main.gate g ON a.x = g.x",
+              depends_on=["s1.a"]),
+        Model(name="c", schema="s2", sql="SELECT COUNT(*) AS n FROM s2.b", depends_on=["s2.b"]),
+    ]
+
+
+@pytest.fixture()
+
+def db_path(tmp_path, monkeypatch):
+    import src.dag as dag
+    path = str(tmp_path / "pipeline.duckdb")
+    monkeypatch.setattr(dag, "load_models", make_models)
+    monkeypatch.setattr(dag, "get_connection", lambda: duckdb.connect(path))
+    yield path
+    # Forget the models registered while load_models() was patched
+    dag.registered_models.cache_clear()
+
+
+def fail_then_fix(db_path, **kwargs):
+    from src.dag import run_models
+    with pytest.raises(duckdb.CatalogException):
+        run_models(full_refresh=True, **kwargs)
+    con = duckdb.connect(db_path)
+    con.execute("CREATE TABLE main.gate AS SELECT range AS x FROM range(5)")
+    con.close()
+
+
+def query(db_path, sql):
+    con = duckdb.connect(db_path)
+    try:
+        return con.execute(sql).fetchall()
+    finally:
+        con.close()
+
+
+class TestResume:
+    """Verify a failed run resumes from the models it didn't finish."""
+
+    def test_resume_skips_finished_models(self, db_path):
+        from src.dag import run_models
+        fail_then_fix(db_path)
+        assert query(db_path, """
+            SELECT relation, status FROM meta.model_checkpoints ORDER BY relation
+        """) == [("s1.a", "done"), ("s2.b", "failed")]
+
+        # The failed run was a full refresh, so a plain run would rebuild s1.a too
+        assert run_models(resume=True) == ["s2.b", "s2.c"]
+        assert query(db_path, "SELECT n FROM s2.c") == [(5,)]
+        assert query(db_path, "SELECT status FROM meta.pipeline_runs") == [("succeeded",)]
+        assert run_models(resume=True) == []
+
+    def test_changed_upstream_output_is_rebuilt(self, db_path):
+        from src.dag import run_models
+        fail_then_fix(db_path)
+        query(db_path, "DELETE FROM s1.a WHERE x = 0")
+        assert run_models(resume=True) == ["s1.a", "s2.b", "s2.c"]
+        assert query(db_path, "SELECT n FROM s2.c") == [(5,)]
+
+    def test_transactional_resume_keeps_committed_layers(self, db_path):
+        from src.dag import run_models
+        fail_then_fix(db_path, transactional=True)
+        assert query(db_path, "SELECT status FROM meta.model_checkpoints WHERE relation = 's2.b'") == [("failed",)]
+        assert run_models(resume=True) == ["s2.b", "s2.c"]
+
+    def test_models_finishing_after_a_failure_are_checkpointed(self, db_path, monkeypatch):
+        import src.dag as dag
+
+        def build_slow(con):
+            # Still running when s2.b fails
+            for _ in range(100):
+                if con.execute("SELECT COUNT(*) FROM meta.model_checkpoints WHERE status = 'failed'").fetchone()[0]:
+                    break
+                time.sleep(0.05)
+            return con.execute("CREATE OR REPLACE TABLE s1.slow AS SELECT range AS x FROM range(3)").fetchone()[0]
+
+        models = make_models()[:2] + [Model(name="slow", schema="s1", run=build_slow)]
+        monkeypatch.setattr(dag, "load_models", lambda: models)
+        with pytest.raises(duckdb.CatalogException):
+            dag.run_models(full_refresh=True, workers=2)
+        assert query(db_path, """
+            SELECT relation, status, row_count FROM meta.model_checkpoints ORDER BY relation
+        """) == [("s1.a", "done", 5), ("s1.slow", "done", 3), ("s2.b", "failed", None)]
+
+    def test_transactional_run_models_record_committed_row_counts(self, db_path, monkeypatch):
+        import src.dag as dag
+
+        def build_table(con):
+            return con.execute("CREATE OR REPLACE TABLE s1.built AS SELECT range AS x FROM range(3)").fetchone()[0]
+
+        monkeypatch.setattr(dag, "load_models", lambda: [Model(name="built", schema="s1", run=build_table)])
+        dag.run_models(transactional=True)
+        assert query(db_path, "SELECT relation, status, row_count FROM meta.model_checkpoints") == [
+            ("s1.built", "done", 3),
+        ]
@@ -0,0 +1,256 @@
+import pytest
+import duckdb
+from src.dag import Model, load_models, select_models
+from src.layout import ROW_GROUP_SIZE, estimated_row_groups_read, needs_reclustering, pruning_stats
+
+
+def names(models):
+    return [model.name for model in models]
+
+
+# 1. MODEL REGISTRY
+
+class TestModelRegistry:
+    """Verify every table in the pipeline is registered as a model."""
+
+    def test_all_layers_registered(self):
+        relations = {model.relation for model in load_models()}
+        assert "raw.sales_transactions" in relations
+        assert "staging.stg_flavours" in relations
+        assert "intermediate.int_flavours_scd2" in relations
+        assert "marts.fct_recipe_composition" in relations
+
+    def test_model_names_are_unique(self):
+        models = names(load_models())
+        assert len(models) == len(set(models))
+
+    def test_unknown_dependency_rejected(self, monkeypatch):
+        import src.dag as dag
+
+        monkeypatch.setattr(dag, "PIPELINE_MODULES", ["src.pipeline.04_marts"])
+        with pytest.raises(ValueError, match="unknown models"):
+            dag.load_models()
+
+# 2. SELECTORS
+
+class TestSelectors:
+    """Verify --select picks the right models."""
+
+    models = [
+        Model(name="a", schema="s"),
+        Model(name="b", schema="s", depends_on=["s.a"]),
+        Model(name="c", schema="s", depends_on=["s.b"]),
+        Model(name="d", schema="s", depends_on=["s.a"]),
+    ]
+
+    def test_no_selector_selects_everything(self):
+        assert names(select_models(self.models, None)) == ["a", "b", "c", "d"]
+
+    def test_single_model(self):
+        assert names(select_models(self.models, "b")) == ["b"]
+
+    def test_downstream(self):
+        assert names(select_models(self.models, "b+")) == ["b", "c"]
+
+    def test_upstream(self):
+        assert names(select_models(self.models, "+c")) == ["a", "b", "c"]
+
+    def test_multiple_selectors(self):
+        assert names(select_models(self.models, "c, s.d")) == ["c", "d"]
+
+    def test_unknown_model(self):
+        with pytest.raises(ValueError, match="Unknown model"):
+            select_models(self.models, "nope+")
+
+# 3. CHUNKED BUILDS
+
+class TestChunkedBuild:
+    """Verify out-of-core chunked builds produce the same table."""
+
+    @pytest.fixture(autouse=True)
+
+    def temp_directory(self, tmp_path, monkeypatch):
+        import src.dag as dag
+        monkeypatch.setattr(dag, "TEMP_DIRECTORY", str(tmp_path))
+
+    def test_chunked_build_matches_single_statement(self, monkeypatch):
+        import src.dag as dag
+
+        con = duckdb.connect()
+        con.execute("CREATE TABLE main.src AS SELECT range AS id, range * 2 AS x FROM range(1000)")
+        model = Model(name="dst", schema="main", depends_on=["main.src"], chunk_by="id",
+                      sql="SELECT id, x + 1 AS y FROM main.src")
+
+        assert model.chunk_count(con) == 1
+        monkeypatch.setattr(dag, "OUT_OF_CORE", True)
+        monkeypatch.setattr(dag, "CHUNK_ROWS", 300)
+        assert model.chunk_count(con) == 4
+
+        assert model.build(con) == 1000
+        assert con.execute("SELECT COUNT(DISTINCT id), SUM(y) FROM main.dst").fetchone() == (1000, 1000 * 999 + 1000)
+        con.close()
+
+    def test_input_view_over_parquet_is_chunked(self, tmp_path, monkeypatch):
+        import src.dag as dag
+
+        # What a raw table is with the raw cache on
+        con = duckdb.connect()
+        path = tmp_path / "src.parquet"
+        con.execute(f"COPY (SELECT range AS id FROM range(1000)) TO '{path}' (FORMAT parquet)")
+        con.execute(f"CREATE VIEW main.src AS SELECT * FROM read_parquet('{path}')")
+        model = Model(name="dst", schema="main", depends_on=["main.src"], chunk_by="id",
+                      sql="SELECT id FROM main.src")
+        monkeypatch.setattr(dag, "OUT_OF_CORE", True)
+        monkeypatch.setattr(dag, "CHUNK_ROWS", 300)
+
+        assert model.chunk_count(con) == 4
+        assert model.build(con) == 1000
+        con.close()
+
+    def test_input_is_scanned_once(self, monkeypatch):
+        import src.dag as dag
+
+        class RecordingConnection:
+            def __init__(self, con):
+                self.con = con
+                self.statements = []
+
+            def execute(self, sql, *args):
+                self.statements.append(sql)
+                return self.con.execute(sql, *args)
+
+        con = RecordingConnection(duckdb.connect())
+        con.execute("CREATE TABLE main.src AS SELECT range AS id FROM range(1000)")
+        model = Model(name="dst", schema="main", depends_on=["main.src"], chunk_by="id",
+                      sql="SELECT id FROM main.src")
+        monkeypatch.setattr(dag, "OUT_OF_CORE", True)
+        monkeypatch.setattr(dag, "CHUNK_ROWS", 300)
+
+        assert model.build(con) == 1000
+        scans = [sql for sql in con.statements if "FROM main.src" in sql and "LIMIT 0" not in sql]
+        assert len(scans) == 1
+        con.con.close()
+
+    def test_sorted_chunked_build_is_in_order(self, monkeypatch):
+        import src.dag as dag
+
+        con = duckdb.connect()
+        con.execute("CREATE TABLE main.src AS SELECT range AS id, (range * 7919) % 1000 AS x FROM range(1000)")
+        model = Model(name="dst", schema="main", depends_on=["main.src"], chunk_by="id",
+                      sort_by=["x"], sql="SELECT id, x FROM main.src")
+        monkeypatch.setattr(dag, "OUT_OF_CORE", True)
+        monkeypatch.setattr(dag, "CHUNK_ROWS", 300)
+
+        assert model.build(con) == 1000
+        assert [row[0] for row in con.execute("SELECT x FROM main.dst ORDER BY rowid").fetchall()] == list(range(1000))
+        con.close()
+
+
+class TestPruningStats:
+    """Verify sorted tables let filters skip row groups."""
+
+    def test_sorted_table_reads_one_row_group(self):
+        con = duckdb.connect()
+        rows = 4 * ROW_GROUP_SIZE
+        con.execute(f"CREATE TABLE sorted AS SELECT range % 100 AS x FROM range({rows}) ORDER BY x")
+        con.execute(f"CREATE TABLE unsorted AS SELECT range % 100 AS x FROM range({rows})")
+
+        sorted_stats = pruning_stats(con, "sorted", "x")
+        assert sorted_stats["row_groups"] == 4
+        assert sorted_stats["avg_row_groups_read"] < 1.1
+        assert pruning_stats(con, "unsorted", "x")["avg_row_groups_read"] == 4
+        con.close()
+
+    def test_estimate_from_row_group_statistics(self):
+        con = duckdb.connect()
+        rows = 4 * ROW_GROUP_SIZE
+        con.execute(f"CREATE TABLE main.sorted AS SELECT DATE '2024-01-01' + (range % 366)::INTEGER AS d FROM range({rows}) ORDER BY d")
+        con.execute(f"CREATE TABLE main.unsorted AS SELECT DATE '2024-01-01' + (range % 366)::INTEGER AS d FROM range({rows})")
+
+        row_groups, read = estimated_row_groups_read(con, "main.sorted", "d")
+        assert row_groups == 4 and read < 1.1
+        assert estimated_row_groups_read(con, "main.unsorted", "d") == (4, 4)
+        con.close()
+
+    def test_reclustering_waits_for_enough_unsorted_row_groups(self):
+        con = duckdb.connect()
+        con.execute(f"CREATE TABLE main.t AS SELECT range // {ROW_GROUP_SIZE} AS x FROM range({12 * ROW_GROUP_SIZE})")
+        assert not needs_reclustering(con, "main.t", "x")
+
+        # Each appended row group spans every value
+        def append_row_group():
+            con.execute(f"INSERT INTO main.t SELECT range % 12 FROM range({ROW_GROUP_SIZE})")
+
+        append_row_group()
+        assert not needs_reclustering(con, "main.t", "x")
+        append_row_group()
+        append_row_group()
+        assert needs_reclustering(con, "main.t", "x")
+        con.close()
+
+# 4. MATERIALIZATIONS
+
+class TestMaterializations:
+    """Verify views, ephemeral models and switching between them."""
+
+    @pytest.fixture()
+
+    def con(self):
+        con = duckdb.connect()
+        con.execute("CREATE TABLE main.src AS SELECT range AS id FROM range(10)")
+        yield con
+        con.close()
+
+    def kinds(self, con):
+        return con.execute("""
+            SELECT table_name, table_type FROM information_schema.tables ORDER BY table_name
+        """).fetchall()
+
+    def test_view_stores_no_rows(self, con):
+        model = Model(name="v", schema="main", depends_on=["main.src"], materialized="view",
+                      sql="SELECT id * 2 AS x FROM main.src")
+        assert model.build(con) is None
+        assert ("v", "VIEW") in self.kinds(con)
+        con.execute("INSERT INTO main.src VALUES (10)")
+        assert con.execute("SELECT MAX(x) FROM main.v").fetchone()[0] == 20
+
+    def test_ephemeral_upstream_inlined_as_cte(self, con):
+        base = Model(name="base", schema="main", depends_on=["main.src"], materialized="ephemeral",
+                     sql="SELECT id FROM main.src WHERE id % 2 = 0")
+        middle = Model(name="middle", schema="main", depends_on=["main.base"], materialized="ephemeral",
+                       sql="SELECT id + 1 AS id FROM main.base")
+        top = Model(name="top", schema="main", depends_on=["main.middle"],
+                    sql="SELECT SUM(id) AS total FROM main.middle")
+        models = {model.relation: model for model in [base, middle, top]}
+
+        sql = top.compiled_sql(models)
+        assert sql.index("base AS") < sql.index("middle AS")
+        assert con.execute(sql).fetchone()[0] == 1 + 3 + 5 + 7 + 9
+        assert top.input_tables(models) == ["main.src"]
+
+        assert base.build(con) is None
+        assert ("base", "BASE TABLE") not in self.kinds(con)
+
+    def test_switching_materialization_replaces_relation(self, con):
+        sql = "SELECT id FROM main.src"
+        Model(name="m", schema="main", sql=sql).build(con)
+        Model(name="m", schema="main", sql=sql, materialized="view").build(con)
+        assert ("m", "VIEW") in self.kinds(con)
+        Model(name="m", schema="main", sql=sql).build(con)
+        assert ("m", "BASE TABLE") in self.kinds(con)
+        Model(name="m", schema="main", sql=sql, materialized="ephemeral").build(con)
+        assert [name for name, _ in self.kinds(con)] == ["src"]
+
+    def test_invalid_materializations_rejected(self):
+        with pytest.raises(ValueError, match="only SQL models"):
+            Model(name="m", schema="main", run=lambda con: 0, materialized="view")
+        with pytest.raises(ValueError, match="need a run"):
+            Model(name="m", schema="main", sql="SELECT 1", materialized="incremental")
+        with pytest.raises(ValueError, match="must be one of"):
+            Model(name="m", schema="main", sql="SELECT 1", materialized="materialized_view")
+
+    def test_pipeline_inlines_int_recipes(self):
+        models = {model.relation: model for model in load_models()}
+        sql = models["marts.dim_recipes"].compiled_sql(models)
+        assert "int_recipes AS (" in sql
+        assert "intermediate.int_recipes" not in sql
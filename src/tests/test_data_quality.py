@@ -4,7 +4,6 @@ from src.config import DB_PATH
 
 
 @pytest.fixture(scope="module")
-
 def con():
     connection = duckdb.connect(DB_PATH, read_only=True)
     yield connection
@@ -85,6 +84,9 @@ class TestPrimaryKeyUniqueness:
     def test_fct_recipe_composition_pk(self, con):
         assert_pk_unique_and_not_null(con, "marts", "fct_recipe_composition", "recipe_key")
 
+    def test_fct_recipe_cost_pk(self, con):
+        assert_pk_unique_and_not_null(con, "marts", "fct_recipe_cost", "recipe_key")
+
 
 # 2. REFERENTIAL INTEGRITY TESTS (Foreign Keys)
 
@@ -106,10 +108,17 @@ class TestReferentialIntegrity:
             extra_filter="p.is_current = TRUE"
         )
 
+    def test_fct_sales_flavour_version_fk(self, con):
+        """Every sales transaction references a valid flavour version."""
+        assert_referential_integrity(
+            con, "marts", "fct_sales_transactions", "flavour_scd_key",
+            "marts", "dim_flavours", "flavour_scd_key"
+        )
+
     def test_fct_sales_date_fk(self, con):
-        """Every transaction_date exists in the date dimension."""
+        """Every transaction's date_key exists in the date dimension."""
         assert_referential_integrity(
-            con, "marts", "fct_sales_transactions", "transaction_date",
+            con, "marts", "fct_sales_transactions", "date_key",
             "marts", "dim_date", "date_key"
         )
 
@@ -232,6 +241,29 @@ class TestSCD2Integrity:
 
         assert gaps == 0, f"{gaps} SCD2 records have timeline gaps"
 
+    def test_sales_reference_flavour_version_in_force(self, con):
+        """
+        Each sale's flavour_scd_key is the version of its flavour valid on
+        the transaction date. Sales older than a flavour's first version
+        use that first version.
+        """
+        mismatches = con.execute("""
+            SELECT COUNT(*)
+            FROM marts.fct_sales_transactions s
+            JOIN (
+                SELECT
+                    *,
+                    MIN(valid_from) OVER (PARTITION BY flavour_id) AS first_valid_from
+                FROM marts.dim_flavours
+            ) AS f
+                ON s.flavour_scd_key = f.flavour_scd_key
+            WHERE f.flavour_id != s.flavour_id
+               OR s.transaction_date >= f.valid_to
+               OR (s.transaction_date < f.valid_from AND f.valid_from != f.first_valid_from)
+        """).fetchone()[0]
+
+        assert mismatches == 0, f"{mismatches} sales reference a flavour version not in force"
+
     def test_all_500_flavours_present(self, con):
         """All 500 original flavour_ids should be represented."""
         count = con.execute("""
@@ -282,6 +314,18 @@ class TestBusinessLogic:
 
         assert violations == 0, f"{violations} recipes have yield outside [0, 100]"
 
+    def test_recipes_priced_at_current_ingredient_costs(self, con):
+        """Every recipe cost uses its ingredient's current cost_per_gram, however it was repriced."""
+        stale = con.execute("""
+            SELECT COUNT(*)
+            FROM marts.fct_recipe_cost c
+            LEFT JOIN marts.dim_ingredients i
+                ON c.ingredient_id = i.ingredient_id
+            WHERE c.ingredient_cost_per_gram IS DISTINCT FROM i.cost_per_gram
+        """).fetchone()[0]
+
+        assert stale == 0, f"{stale} recipes are priced at an outdated ingredient cost"
+
 # 5. VALIDITY TESTS (Value Ranges)
 
 class TestValidity:
@@ -356,7 +400,8 @@ class TestValidity:
         Transaction dates should fall within a reasonable range.
 
         Actual range discovered: 2023-02-16 to 2025-01-15.
-        We verify all dates fall within the extended dim_date range.
+        dim_date spans exactly the dates that occur, so we check against
+        fixed bounds around that range instead.
         """
         violations = con.execute("""
             SELECT COUNT(*)
@@ -365,7 +410,35 @@ class TestValidity:
                OR transaction_date > DATE '2025-12-31'
         """).fetchone()[0]
 
-        assert violations == 0, f"{violations} transactions outside dim_date range"
+        assert violations == 0, f"{violations} transactions outside 2023-2025"
+
+    def test_dim_date_covers_transaction_dates(self, con):
+        """Every transaction date falls between dim_date's first and last day."""
+        violations = con.execute("""
+            SELECT COUNT(*)
+            FROM marts.fct_sales_transactions f
+            CROSS JOIN (SELECT MIN(full_date) AS first_day, MAX(full_date) AS last_day FROM marts.dim_date) d
+            WHERE f.transaction_date NOT BETWEEN d.first_day AND d.last_day
+        """).fetchone()[0]
+
+        assert violations == 0, f"{violations} transactions outside the range of dim_date"
+
+    def test_dim_date_key_is_integer(self, con):
+        """date_key is an INTEGER holding the date as yyyymmdd."""
+        data_type = con.execute("""
+            SELECT data_type
+            FROM information_schema.columns
+            WHERE table_schema = 'marts' AND table_name = 'dim_date' AND column_name = 'date_key'
+        """).fetchone()[0]
+        assert data_type == "INTEGER"
+
+        violations = con.execute("""
+            SELECT COUNT(*)
+            FROM marts.dim_date
+            WHERE date_key != CAST(STRFTIME(full_date, '%Y%m%d') AS INTEGER)
+        """).fetchone()[0]
+
+        assert violations == 0, f"{violations} date_keys don't match their full_date"
 
 # 6. ROW COUNT TESTS
 
@@ -0,0 +1,76 @@
+import importlib
+import os
+import pytest
+import duckdb
+from src.config import SCHEMA_MARTS
+
+export = importlib.import_module("src.pipeline.05_export")
+
+
+@pytest.fixture()
+
+def con(tmp_path, monkeypatch):
+    monkeypatch.setattr(export, "EXPORT_DIR", str(tmp_path))
+    monkeypatch.setattr(export, "EXPORT_PARTITION_BY", {"fct": ["year"]})
+    monkeypatch.setattr(export, "EXPORT_SORT_BY", {"fct": ["id"]})
+    connection = duckdb.connect()
+    connection.execute(f"CREATE SCHEMA {SCHEMA_MARTS}")
+    connection.execute(f"CREATE TABLE {SCHEMA_MARTS}.fct AS SELECT range AS id, 2023 + range % 2 AS year FROM range(10)")
+    connection.execute(f"CREATE TABLE {SCHEMA_MARTS}.dim AS SELECT 1 AS id")
+    export.create_export_manifest_table(connection)
+    yield connection
+    connection.close()
+
+
+class TestExport:
+    """Verify exports are partitioned and only rewrite changed files."""
+
+    def test_partitioned_layout(self, con, tmp_path):
+        assert export.export_table(con, "fct") == 2
+        rows = con.execute(f"""
+            SELECT year, COUNT(*)
+            FROM read_parquet('{tmp_path}/fct/*/*.parquet', hive_partitioning = true)
+            GROUP BY year ORDER BY year
+        """).fetchall()
+        assert rows == [(2023, 5), (2024, 5)]
+
+    def test_only_changed_partitions_rewritten(self, con):
+        export.export_table(con, "fct")
+        export.export_table(con, "dim")
+        assert export.export_table(con, "fct") == 0
+        assert export.export_table(con, "dim") == 0
+        con.execute(f"UPDATE {SCHEMA_MARTS}.fct SET id = 100 WHERE id = 0")
+        assert export.export_table(con, "fct") == 1
+
+    def test_table_not_rebuilt_since_export_is_not_read(self, con):
+        assert export.export_table(con, "fct", "build 1") == 2
+        con.execute(f"DROP TABLE {SCHEMA_MARTS}.fct")
+        assert export.export_table(con, "fct", "build 1") == 0
+
+    def test_rebuilt_table_rewrites_changed_files(self, con):
+        export.export_table(con, "fct", "build 1")
+        con.execute(f"UPDATE {SCHEMA_MARTS}.fct SET id = 100 WHERE id = 0")
+        assert export.export_table(con, "fct", "build 2") == 1
+        assert export.export_table(con, "fct", "build 2") == 0
+
+    def test_deleted_file_is_written_again(self, con, tmp_path):
+        export.export_table(con, "dim", "build 1")
+        os.remove(tmp_path / "dim.parquet")
+        assert export.export_table(con, "dim", "build 1") == 1
+
+    def test_vanished_partition_removed(self, con, tmp_path):
+        export.export_table(con, "fct")
+        con.execute(f"DELETE FROM {SCHEMA_MARTS}.fct WHERE year = 2024")
+        export.export_table(con, "fct")
+        assert os.listdir(tmp_path / "fct") == ["year=2023"]
+
+    def test_null_partition_reads_back_as_null(self, con, tmp_path):
+        con.execute(f"UPDATE {SCHEMA_MARTS}.fct SET year = NULL WHERE id = 0")
+        export.export_table(con, "fct")
+        assert sorted(os.listdir(tmp_path / "fct")) == ["year=2023", "year=2024", "year=__HIVE_DEFAULT_PARTITION__"]
+        rows = con.execute(f"""
+            SELECT year, COUNT(*)
+            FROM read_parquet('{tmp_path}/fct/*/*.parquet', hive_partitioning = true)
+            GROUP BY year ORDER BY year NULLS FIRST
+        """).fetchall()
+        assert rows == [(None, 1), (2023, 4), (2024, 5)]
@@ -0,0 +1,348 @@
+import importlib
+from datetime import date
+import pytest
+import duckdb
+from src.config import SCHEMA_RAW, SCHEMA_STAGING, SCHEMA_INTERMEDIATE, SCHEMA_MARTS
+from src.incremental import plan_batches, start_history
+from src.layout import ROW_GROUP_SIZE, pruning_stats
+from src.recipe_cost import (
+    RECIPE_COST_FACT, RECIPE_COMPOSITION, INGREDIENTS, INGREDIENT_RECIPES_INDEX, build_fct_recipe_cost,
+)
+
+intermediate = importlib.import_module("src.pipeline.03_intermediate")
+marts = importlib.import_module("src.pipeline.04_marts")
+
+
+@pytest.fixture()
+
+def con():
+    connection = duckdb.connect()
+    connection.execute(f"CREATE SCHEMA {SCHEMA_STAGING}")
+    connection.execute(f"CREATE SCHEMA {SCHEMA_INTERMEDIATE}")
+    connection.execute(f"CREATE SCHEMA {SCHEMA_MARTS}")
+    connection.execute(f"""
+        CREATE TABLE {SCHEMA_STAGING}.stg_flavours (
+            flavour_id INTEGER,
+            flavour_name VARCHAR,
+            flavour_description VARCHAR,
+            generation_date DATE,
+            batch_number INTEGER
+        )
+    """)
+    connection.execute(f"""
+        CREATE TABLE {SCHEMA_STAGING}.stg_customers (
+            customer_id INTEGER,
+            customer_name VARCHAR,
+            generation_date DATE,
+            batch_number INTEGER,
+            hashdiff VARCHAR
+        )
+    """)
+    connection.execute(f"""
+        CREATE TABLE {SCHEMA_STAGING}.stg_sales_transactions (
+            transaction_id INTEGER,
+            customer_id INTEGER,
+            flavour_id INTEGER,
+            quantity_liters INTEGER,
+            transaction_date DATE,
+            transaction_country VARCHAR,
+            transaction_town VARCHAR,
+            postal_code VARCHAR,
+            amount_dollars DOUBLE,
+            generation_date DATE,
+            batch_number INTEGER
+        )
+    """)
+    yield connection
+    connection.close()
+
+
+def add_batch(con, batch_number, generation_date, rows):
+    for flavour_id, description in rows:
+        con.execute(f"INSERT INTO {SCHEMA_STAGING}.stg_flavours VALUES (?, ?, ?, ?, ?)",
+                    [flavour_id, f"flavour {flavour_id}", description, generation_date, batch_number])
+
+
+def reload_raw(con, table_name):
+    # Changes to loaded batches only reach staging through a full raw reload
+    start_history(con, f"{SCHEMA_RAW}.{table_name}")
+
+
+def history(con):
+    return con.execute(f"""
+        SELECT flavour_id, flavour_description, valid_from, valid_to, is_current
+        FROM {intermediate.FLAVOURS_SCD2}
+        ORDER BY flavour_id, valid_from, is_current
+    """).fetchall()
+
+
+class TestFlavoursSCD2:
+    """Verify the SCD2 history handles any number of batches, merged incrementally."""
+
+    def test_flavours_in_one_batch_are_kept(self, con):
+        add_batch(con, 1, "2024-01-01", [(1, "a"), (2, "b")])
+        add_batch(con, 2, "2024-02-01", [(1, "a2"), (3, "c")])
+        intermediate.build_int_flavours_scd2(con)
+        assert history(con) == [
+            (1, "a", date(2024, 1, 1), date(2024, 2, 1), False),
+            (1, "a2", date(2024, 2, 1), None, True),
+            (2, "b", date(2024, 1, 1), None, True),
+            (3, "c", date(2024, 2, 1), None, True),
+        ]
+
+    def test_new_batch_is_merged_incrementally(self, con):
+        add_batch(con, 1, "2024-01-01", [(1, "a"), (2, "b")])
+        add_batch(con, 2, "2024-02-01", [(1, "a2"), (2, "b")])
+        intermediate.build_int_flavours_scd2(con)
+
+        add_batch(con, 3, "2024-03-01", [(1, "a3"), (2, "b")])
+        assert intermediate.build_int_flavours_scd2(con) == 2
+        incremental = history(con)
+
+        intermediate.create_flavours_scd2_table(con)
+        con.execute("DELETE FROM meta.incremental_state")
+        intermediate.build_int_flavours_scd2(con)
+        assert history(con) == incremental
+        assert [row[1] for row in incremental if row[0] == 1] == ["a", "a2", "a3"]
+
+    def test_changed_old_batch_rebuilds_history(self, con):
+        add_batch(con, 1, "2024-01-01", [(1, "a")])
+        intermediate.build_int_flavours_scd2(con)
+        add_batch(con, 1, "2024-01-01", [(2, "b")])
+        reload_raw(con, "flavours")
+        intermediate.build_int_flavours_scd2(con)
+        assert [row[0] for row in history(con)] == [1, 2]
+
+    def test_value_edited_in_old_batch_rebuilds_history(self, con):
+        add_batch(con, 1, "2024-01-01", [(1, "a"), (2, "b")])
+        intermediate.build_int_flavours_scd2(con)
+        con.execute(f"""
+            UPDATE {SCHEMA_STAGING}.stg_flavours SET flavour_description = 'a fixed' WHERE flavour_id = 1
+        """)
+        reload_raw(con, "flavours")
+        intermediate.build_int_flavours_scd2(con)
+        assert [row[1] for row in history(con)] == ["a fixed", "b"]
+
+    def test_merged_batches_are_not_reread_while_raw_history_lasts(self, con):
+        add_batch(con, 1, "2024-01-01", [(1, "a")])
+        intermediate.build_int_flavours_scd2(con)
+        merged = plan_batches(con, intermediate.FLAVOURS_SCD2, f"{SCHEMA_STAGING}.stg_flavours")[1]
+
+        # Without a raw reload the edit can't have come from the source, so batch 1 isn't read again
+        con.execute(f"UPDATE {SCHEMA_STAGING}.stg_flavours SET flavour_description = 'x'")
+        add_batch(con, 2, "2024-02-01", [(1, "a2")])
+        new_batches, batches = plan_batches(con, intermediate.FLAVOURS_SCD2, f"{SCHEMA_STAGING}.stg_flavours")
+        assert new_batches == [2]
+        assert batches[0] == merged[0]
+
+        reload_raw(con, "flavours")
+        assert plan_batches(con, intermediate.FLAVOURS_SCD2, f"{SCHEMA_STAGING}.stg_flavours")[0] is None
+
+
+build_customers = intermediate.build_latest_record_model(
+    "int_customers", "stg_customers", "customer_id", ["customer_name"],
+)
+
+
+def add_customers(con, batch_number, rows):
+    for customer_id, name in rows:
+        con.execute(f"INSERT INTO {SCHEMA_STAGING}.stg_customers VALUES (?, ?, '2024-01-01', ?, MD5(?))",
+                    [customer_id, name, batch_number, name])
+
+
+def customers(con):
+    return con.execute(f"""
+        SELECT customer_id, customer_name
+        FROM {SCHEMA_INTERMEDIATE}.int_customers
+        ORDER BY customer_id
+    """).fetchall()
+
+
+class TestLatestRecord:
+    """Verify latest-record tables only apply changed and new keys from new batches."""
+
+    def test_first_build_takes_latest_batch(self, con):
+        add_customers(con, 1, [(1, "a"), (2, "b")])
+        add_customers(con, 2, [(1, "a2")])
+        assert build_customers(con) == 2
+        assert customers(con) == [(1, "a2"), (2, "b")]
+
+    def test_only_changed_keys_are_written(self, con):
+        add_customers(con, 1, [(1, "a"), (2, "b")])
+        build_customers(con)
+        add_customers(con, 2, [(1, "a"), (2, "b2"), (3, "c")])
+        assert build_customers(con) == 2
+        assert customers(con) == [(1, "a"), (2, "b2"), (3, "c")]
+        assert build_customers(con) == 0
+
+    def test_value_edited_in_merged_batch_rebuilds(self, con):
+        add_customers(con, 1, [(1, "a"), (2, "b")])
+        build_customers(con)
+        con.execute(f"""
+            UPDATE {SCHEMA_STAGING}.stg_customers SET customer_name = 'a fixed', hashdiff = MD5('a fixed')
+            WHERE customer_id = 1
+        """)
+        reload_raw(con, "customers")
+        build_customers(con)
+        assert customers(con) == [(1, "a fixed"), (2, "b")]
+
+
+def add_sales(con, batch_number, rows):
+    for transaction_id, flavour_id, transaction_date in rows:
+        con.execute(f"""
+            INSERT INTO {SCHEMA_STAGING}.stg_sales_transactions
+            VALUES (?, 1, ?, 10, ?, 'US', 'Town', '00000', 1.0, ?, ?)
+        """, [transaction_id, flavour_id, transaction_date, transaction_date, batch_number])
+
+
+def sale_descriptions(con):
+    return con.execute(f"""
+        SELECT s.transaction_id, h.flavour_description
+        FROM {marts.SALES_FACT} s
+        LEFT JOIN {intermediate.FLAVOURS_SCD2} h ON s.flavour_scd_key = h.flavour_scd_key
+        ORDER BY s.transaction_id
+    """).fetchall()
+
+
+class TestSalesFlavourKeys:
+    """Verify sales get the flavour version in force on their date, kept up to date incrementally."""
+
+    def test_version_in_force_at_sale(self, con):
+        add_batch(con, 1, "2024-01-01", [(1, "a")])
+        add_batch(con, 2, "2024-02-01", [(1, "a2")])
+        intermediate.build_int_flavours_scd2(con)
+        add_sales(con, 1, [(1, 1, "2023-12-01"), (2, 1, "2024-01-15"), (3, 1, "2024-02-01")])
+        marts.build_fct_sales_transactions(con)
+        assert sale_descriptions(con) == [(1, "a"), (2, "a"), (3, "a2")]
+
+    def test_version_closed_on_its_first_day_is_skipped(self, con):
+        add_batch(con, 1, "2024-01-01", [(1, "a")])
+        add_batch(con, 2, "2024-01-01", [(1, "a2")])
+        intermediate.build_int_flavours_scd2(con)
+        add_sales(con, 1, [(1, 1, "2023-12-01"), (2, 1, "2024-01-01")])
+        marts.build_fct_sales_transactions(con)
+        assert sale_descriptions(con) == [(1, "a"), (2, "a2")]
+
+    def test_new_batches_are_merged_incrementally(self, con):
+        add_batch(con, 1, "2024-01-01", [(1, "a"), (2, "b")])
+        intermediate.build_int_flavours_scd2(con)
+        add_sales(con, 1, [(1, 1, "2024-01-10"), (2, 1, "2024-03-10"), (3, 2, "2024-03-10")])
+        marts.build_fct_sales_transactions(con)
+
+        # Flavour 1 changes on 2024-03-01: only the later sale is re-keyed
+        add_batch(con, 2, "2024-03-01", [(1, "a2"), (2, "b")])
+        intermediate.build_int_flavours_scd2(con)
+        add_sales(con, 2, [(4, 1, "2024-03-20")])
+        assert marts.build_fct_sales_transactions(con) == 2
+        incremental = sale_descriptions(con)
+        assert incremental == [(1, "a"), (2, "a2"), (3, "b"), (4, "a2")]
+
+        con.execute("DELETE FROM meta.incremental_state")
+        marts.build_fct_sales_transactions(con)
+        assert sale_descriptions(con) == incremental
+
+    def test_value_edited_in_merged_batch_rebuilds(self, con):
+        add_batch(con, 1, "2024-01-01", [(1, "a")])
+        intermediate.build_int_flavours_scd2(con)
+        add_sales(con, 1, [(1, 1, "2024-01-10"), (2, 1, "2024-01-20")])
+        marts.build_fct_sales_transactions(con)
+
+        # Same row count, one amount corrected
+        con.execute(f"UPDATE {SCHEMA_STAGING}.stg_sales_transactions SET amount_dollars = 2.5 WHERE transaction_id = 2")
+        reload_raw(con, "sales_transactions")
+        marts.build_fct_sales_transactions(con)
+        assert con.execute(f"""
+            SELECT transaction_id, amount_dollars FROM {marts.SALES_FACT} ORDER BY transaction_id
+        """).fetchall() == [(1, 1.0), (2, 2.5)]
+
+    def test_table_is_clustered_by_date_across_batches(self, con):
+        add_batch(con, 1, "2024-01-01", [(1, "a")])
+        intermediate.build_int_flavours_scd2(con)
+
+        # Two batches of more than a row group each, both spanning the whole year
+        for batch_number in (1, 2):
+            con.execute(f"""
+                INSERT INTO {SCHEMA_STAGING}.stg_sales_transactions
+                SELECT
+                    {batch_number} * 1000000 + i, 1, 1, 10, DATE '2024-01-01' + (i % 366)::INTEGER,
+                    'US', 'Town', '00000', 1.0, DATE '2024-01-01', {batch_number}
+                FROM range({ROW_GROUP_SIZE + 1000}) AS t(i)
+            """)
+            marts.build_fct_sales_transactions(con)
+
+        stats = pruning_stats(con, marts.SALES_FACT, "transaction_date")
+        assert stats["row_groups"] == 3
+        assert stats["avg_row_groups_read"] < 1.5
+
+
+def add_recipes(con, batch_number, rows):
+    for recipe_key, ingredient_id, ingredient_ratio in rows:
+        con.execute(f"INSERT INTO {RECIPE_COMPOSITION} VALUES (?, ?, ?, ?, 1.0, 80.0, ?)",
+                    [recipe_key, f"R{recipe_key}", ingredient_id, ingredient_ratio, batch_number])
+
+
+def recipe_costs(con):
+    return con.execute(f"""
+        SELECT recipe_key, ingredient_cost_per_gram, recipe_cost_per_gram, cost_per_gram_of_yield
+        FROM {RECIPE_COST_FACT}
+        ORDER BY recipe_key
+    """).fetchall()
+
+
+class TestRecipeCost:
+    """Verify recipes are priced from their ingredient and repriced through the reverse index."""
+
+    @pytest.fixture()
+
+    def con(self, con):
+        con.execute(f"""
+            CREATE TABLE {RECIPE_COMPOSITION} (
+                recipe_key BIGINT,
+                recipe_id VARCHAR,
+                ingredient_id INTEGER,
+                ingredient_ratio DOUBLE,
+                total_ratio DOUBLE,
+                yield_percentage DOUBLE,
+                batch_number INTEGER
+            )
+        """)
+        con.execute(f"CREATE TABLE {INGREDIENTS} (ingredient_id INTEGER, cost_per_gram DOUBLE)")
+        con.execute(f"INSERT INTO {INGREDIENTS} VALUES (101, 10.0), (102, 2.0)")
+        return con
+
+    def test_recipe_priced_from_ingredient_share(self, con):
+        add_recipes(con, 1, [(1, 101, 0.5), (2, 999, 0.5)])
+        build_fct_recipe_cost(con)
+        assert recipe_costs(con) == [(1, 10.0, 5.0, 6.25), (2, None, None, None)]
+
+    def test_only_recipes_of_changed_ingredients_are_repriced(self, con):
+        add_recipes(con, 1, [(1, 101, 0.5), (2, 102, 0.5), (3, 101, 0.2)])
+        build_fct_recipe_cost(con)
+
+        con.execute(f"UPDATE {INGREDIENTS} SET cost_per_gram = 20.0 WHERE ingredient_id = 101")
+        add_recipes(con, 2, [(4, 101, 0.1), (5, 102, 0.1)])
+        # Recipes 1 and 3 repriced, 4 and 5 new
+        assert build_fct_recipe_cost(con) == 4
+        incremental = recipe_costs(con)
+        assert [row[:3] for row in incremental] == [
+            (1, 20.0, 10.0), (2, 2.0, 1.0), (3, 20.0, 4.0), (4, 20.0, 2.0), (5, 2.0, 0.2),
+        ]
+        assert con.execute(f"""
+            SELECT ingredient_id, cost_per_gram, recipe_keys FROM {INGREDIENT_RECIPES_INDEX} ORDER BY ingredient_id
+        """).fetchall() == [(101, 20.0, [1, 3, 4]), (102, 2.0, [2, 5])]
+
+        # Nothing changed: nothing is written
+        assert build_fct_recipe_cost(con) == 0
+
+        # A ratio corrected in an already priced batch reprices from scratch
+        con.execute(f"UPDATE {RECIPE_COMPOSITION} SET ingredient_ratio = 0.25 WHERE recipe_key = 2")
+        reload_raw(con, "recipes")
+        build_fct_recipe_cost(con)
+        assert recipe_costs(con)[1][:3] == (2, 2.0, 0.5)
+        con.execute(f"UPDATE {RECIPE_COMPOSITION} SET ingredient_ratio = 0.5 WHERE recipe_key = 2")
+        reload_raw(con, "recipes")
+        build_fct_recipe_cost(con)
+
+        con.execute("DELETE FROM meta.incremental_state")
+        build_fct_recipe_cost(con)
+        assert recipe_costs(con) == incremental
@@ -0,0 +1,223 @@
+import importlib
+import os
+import pytest
+import duckdb
+from src.build_cache import create_manifest_tables
+from src.utils import table_exists
+
+raw = importlib.import_module("src.pipeline.01_load_raw")
+
+CUSTOMERS = (
+    "customer_id,name,location_city,location_country,generation_date,batch_number\r\n"
+    "1,Acme Corp,New York,USA,08/05/2024,1\r\n"
+    "2,Bold Ventures,London,UK,08/05/2024,1"
+)
+
+
+@pytest.fixture()
+
+def con(tmp_path, monkeypatch):
+    monkeypatch.setattr(raw, "RAW_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(raw, "RAW_CACHE_ENABLED", True)
+    connection = duckdb.connect()
+    connection.execute("CREATE SCHEMA raw")
+    raw.create_watermark_table(connection)
+    create_manifest_tables(connection)
+    yield connection
+    connection.close()
+
+
+@pytest.fixture()
+
+def csv_path(tmp_path):
+    path = tmp_path / "customers.csv"
+    path.write_bytes(CUSTOMERS.encode())
+    return str(path)
+
+
+def cached_files(tmp_path):
+    return sorted(os.listdir(tmp_path / "cache"))
+
+
+def customers(con):
+    return con.execute("SELECT customer_id, name, batch_number FROM raw.customers ORDER BY customer_id").fetchall()
+
+
+class TestRawCache:
+    """Verify parsed CSVs are cached as Parquet and read back instead of parsing again."""
+
+    def test_unchanged_csv_is_not_parsed_again(self, con, csv_path, tmp_path, monkeypatch):
+        assert raw.load_raw_table(con, "customers", csv_path, mode="full") == 2
+        assert len(cached_files(tmp_path)) == 1
+        assert con.execute("""
+            SELECT table_type FROM information_schema.tables WHERE table_schema = 'raw' AND table_name = 'customers'
+        """).fetchone()[0] == "VIEW"
+
+        def fail(*args, **kwargs):
+            raise AssertionError("CSV parsed again")
+
+        monkeypatch.setattr(raw, "parse_csv", fail)
+        assert raw.load_raw_table(con, "customers", csv_path, mode="full") == 2
+        assert customers(con) == [(1, "Acme Corp", 1), (2, "Bold Ventures", 1)]
+
+    def test_changed_csv_replaces_its_copy(self, con, csv_path, tmp_path):
+        raw.load_raw_table(con, "customers", csv_path, mode="full")
+        before = cached_files(tmp_path)
+        with open(csv_path, "w", newline="") as f:
+            f.write(CUSTOMERS.replace("Acme Corp", "Acme Inc"))
+        raw.load_raw_table(con, "customers", csv_path, mode="full")
+        after = cached_files(tmp_path)
+        assert len(after) == 1 and after != before
+        assert customers(con)[0] == (1, "Acme Inc", 1)
+
+    def test_appended_batches_go_into_their_own_copies(self, con, csv_path, tmp_path, monkeypatch):
+        raw.load_raw_table(con, "customers", csv_path)
+        first = cached_files(tmp_path)
+
+        def fail(*args, **kwargs):
+            raise AssertionError("whole CSV hashed again")
+
+        monkeypatch.setattr(raw, "hash_file", fail)
+        for row in (b"\r\n3,Crisp Foods,Paris,France,08/06/2024,2", b"\r\n4,Dune Labs,Lyon,France,08/07/2024,3"):
+            with open(csv_path, "ab") as f:
+                f.write(row)
+            assert raw.plan_load(con, "customers", csv_path) == "append"
+            assert raw.load_raw_table(con, "customers", csv_path) == 1
+
+        assert customers(con)[-2:] == [(3, "Crisp Foods", 2), (4, "Dune Labs", 3)]
+        cache_files = raw.get_watermark(con, "customers")["cache_files"]
+        assert os.path.basename(cache_files[0]) == first[0]
+        assert [con.execute(f"SELECT COUNT(*) FROM '{path}'").fetchone()[0] for path in cache_files] == [2, 1, 1]
+        assert cached_files(tmp_path) == sorted(os.path.basename(path) for path in cache_files)
+
+    def test_full_reload_removes_appended_copies(self, con, csv_path, tmp_path):
+        raw.load_raw_table(con, "customers", csv_path)
+        with open(csv_path, "ab") as f:
+            f.write(b"\r\n3,Crisp Foods,Paris,France,08/06/2024,2")
+        raw.load_raw_table(con, "customers", csv_path)
+        assert len(cached_files(tmp_path)) == 2
+
+        raw.load_raw_table(con, "customers", csv_path, mode="full")
+        assert cached_files(tmp_path) == [os.path.basename(raw.raw_cache_path(con, "customers", csv_path))]
+        assert len(customers(con)) == 3
+
+    def test_only_reloads_start_a_new_history(self, con, csv_path):
+        def history_id():
+            return con.execute("SELECT history_id FROM meta.incremental_state WHERE relation = 'raw.customers'").fetchone()[0]
+
+        raw.load_raw_table(con, "customers", csv_path)
+        first = history_id()
+        with open(csv_path, "ab") as f:
+            f.write(b"\r\n3,Crisp Foods,Paris,France,08/06/2024,2")
+        raw.load_raw_table(con, "customers", csv_path)
+        assert history_id() == first
+
+        raw.load_raw_table(con, "customers", csv_path, mode="full")
+        assert history_id() != first
+
+    def test_other_database_keeps_its_copies(self, con, csv_path, tmp_path):
+        raw.load_raw_table(con, "customers", csv_path)
+
+        # A second database sharing the cache directory loads another file
+        other = duckdb.connect()
+        other.execute("CREATE SCHEMA raw")
+        raw.create_watermark_table(other)
+        create_manifest_tables(other)
+        other_csv = tmp_path / "other.csv"
+        other_csv.write_bytes(CUSTOMERS.replace("Acme Corp", "Acme Inc").encode())
+        raw.load_raw_table(other, "customers", str(other_csv))
+        other.close()
+
+        assert len(cached_files(tmp_path)) == 2
+        assert customers(con) == [(1, "Acme Corp", 1), (2, "Bold Ventures", 1)]
+
+    def test_deleted_copy_is_reloaded(self, con, csv_path, tmp_path):
+        raw.load_raw_table(con, "customers", csv_path)
+        for name in cached_files(tmp_path):
+            os.remove(tmp_path / "cache" / name)
+        assert raw.plan_load(con, "customers", csv_path) == "full"
+        assert raw.load_raw_table(con, "customers", csv_path) == 2
+        assert customers(con) == [(1, "Acme Corp", 1), (2, "Bold Ventures", 1)]
+
+    def test_cache_off_loads_a_table(self, con, csv_path, monkeypatch):
+        raw.load_raw_table(con, "customers", csv_path)
+        monkeypatch.setattr(raw, "RAW_CACHE_ENABLED", False)
+        assert raw.plan_load(con, "customers", csv_path) == "full"
+        raw.load_raw_table(con, "customers", csv_path)
+        assert con.execute("""
+            SELECT table_type FROM information_schema.tables WHERE table_schema = 'raw' AND table_name = 'customers'
+        """).fetchone()[0] == "BASE TABLE"
+
+
+class TestAppend:
+    """Verify rows appended to a CSV are inserted once and advance the watermark."""
+
+    def test_crlf_batch_appended_without_cache(self, con, csv_path, monkeypatch):
+        monkeypatch.setattr(raw, "RAW_CACHE_ENABLED", False)
+        raw.load_raw_table(con, "customers", csv_path)
+        before = raw.get_watermark(con, "customers")
+
+        with open(csv_path, "ab") as f:
+            f.write(b"\r\n3,Crisp Foods,Paris,France,08/06/2024,2")
+        assert raw.plan_load(con, "customers", csv_path) == "append"
+        assert raw.load_raw_table(con, "customers", csv_path) == 1
+        assert customers(con) == [(1, "Acme Corp", 1), (2, "Bold Ventures", 1), (3, "Crisp Foods", 2)]
+
+        after = raw.get_watermark(con, "customers")
+        assert (before["max_batch_number"], after["max_batch_number"]) == (1, 2)
+        assert before["file_size"] < after["file_size"] == os.path.getsize(csv_path)
+        assert raw.plan_load(con, "customers", csv_path) == "skip"
+
+
+class TestParallelLoad:
+    """Verify loading the CSVs on several workers gives the same tables as loading them one at a time."""
+
+    def test_parallel_load_matches_serial_load(self, monkeypatch):
+        monkeypatch.setattr(raw, "RAW_CACHE_ENABLED", False)
+
+        def load(workers):
+            con = duckdb.connect()
+            raw.load_raw_data(mode="full", workers=workers, con=con)
+            tables = {
+                table_name: con.execute(f"""
+                    SELECT COUNT(*), SUM(md5_number_lower(CAST(t AS VARCHAR))) FROM raw.{table_name} t
+                """).fetchone()
+                for table_name in raw.CSV_FILES
+                if table_exists(con, "raw", table_name)
+            }
+            con.close()
+            return tables
+
+        serial = load(1)
+        assert "sales_transactions" in serial
+        assert load(4) == serial
+
+
+class TestSourceContract:
+    """Verify a changed source contract reloads the raw table even when its CSV is unchanged."""
+
+    def test_changed_column_type_reloads(self, con, csv_path, monkeypatch):
+        raw.load_raw_table(con, "customers", csv_path)
+        assert raw.plan_load(con, "customers", csv_path) == "skip"
+
+        contract = {**raw.SOURCE_SCHEMAS["customers"], "customer_id": {"type": "VARCHAR", "nullable": False}}
+        monkeypatch.setitem(raw.SOURCE_SCHEMAS, "customers", contract)
+        assert raw.plan_load(con, "customers", csv_path) == "full"
+        raw.load_raw_table(con, "customers", csv_path)
+        assert con.execute("""
+            SELECT data_type FROM information_schema.columns
+            WHERE table_schema = 'raw' AND table_name = 'customers' AND column_name = 'customer_id'
+        """).fetchone()[0] == "VARCHAR"
+        assert raw.plan_load(con, "customers", csv_path) == "skip"
+
+
+class TestFullRefresh:
+    """Verify a full refresh makes the raw models reload their CSVs in full."""
+
+    def test_reset_forgets_the_watermark(self, con, csv_path):
+        raw.load_raw_table(con, "customers", csv_path)
+        assert raw.plan_load(con, "customers", csv_path) == "skip"
+
+        model = next(model for model in raw.MODELS if model.name == "customers")
+        model.reset_progress(con)
+        assert raw.plan_load(con, "customers", csv_path) == "full"
@@ -0,0 +1,56 @@
+import json
+import pytest
+import duckdb
+from src.dag import Model
+from src.metrics import build_with_metrics
+
+
+@pytest.fixture()
+def db_path(tmp_path, monkeypatch):
+    import src.dag as dag
+    path = str(tmp_path / "pipeline.duckdb")
+    monkeypatch.setattr(dag, "get_connection", lambda: duckdb.connect(path))
+    yield path
+    # Forget the models registered while load_models() was patched
+    dag.registered_models.cache_clear()
+
+
+class TestBuildMetrics:
+    """Verify build metrics describe the model's own build."""
+
+    def test_profile_is_the_build_statement(self, monkeypatch):
+        import src.dag as dag
+        monkeypatch.setattr(dag, "PRUNING_STATS", True)
+
+        con = duckdb.connect()
+        model = Model(name="dst", schema="main", sort_by=["x"],
+                      sql="SELECT range AS x FROM range(1000)")
+        metrics = build_with_metrics(con, model)
+        assert metrics["rows_written"] == 1000
+        assert metrics["wall_seconds"] >= 0
+        # Not the pruning statistics query logged after the build
+        assert "CREATE OR REPLACE TABLE main.dst" in json.loads(metrics["query_profile"])["query_name"]
+        con.close()
+
+    def test_run_records_a_row_per_built_model(self, db_path, monkeypatch):
+        import src.dag as dag
+
+        def build_b(con):
+            return con.execute("CREATE OR REPLACE TABLE s.b AS SELECT * FROM s.a WHERE x < 3").fetchone()[0]
+
+        models = [
+            Model(name="a", schema="s", sql="SELECT range AS x FROM range(5)"),
+            Model(name="b", schema="s", run=build_b, depends_on=["s.a"]),
+        ]
+        monkeypatch.setattr(dag, "load_models", lambda: models)
+        dag.run_models()
+
+        con = duckdb.connect(db_path)
+        rows = con.execute("""
+            SELECT m.relation, m.rows_written, m.wall_seconds >= 0, m.query_profile IS NOT NULL
+            FROM meta.run_metrics m
+            JOIN meta.pipeline_runs r ON m.run_id = r.run_id
+            ORDER BY m.relation
+        """).fetchall()
+        con.close()
+        assert rows == [("s.a", 5, True, True), ("s.b", 3, True, True)]
@@ -0,0 +1,100 @@
+import pytest
+import duckdb
+from src.quality import (
+    Check, DQ_RESULTS_TABLE, foreign_key, primary_key, row_count, run_quality_checks, violations,
+)
+
+
+@pytest.fixture()
+
+def con():
+    connection = duckdb.connect()
+    connection.execute("CREATE TABLE parent AS SELECT * FROM range(1, 4) t(id)")
+    connection.execute("CREATE TABLE child AS SELECT * FROM (VALUES (1, 1), (2, 2), (3, 9), (3, 0)) t(id, parent_id)")
+    yield connection
+    connection.close()
+
+
+def results(con):
+    return dict(con.execute(f"SELECT check_name, passed FROM {DQ_RESULTS_TABLE}").fetchall())
+
+
+class TestChecks:
+    """Verify checks evaluate and record their results."""
+
+    def test_passing_checks(self, con):
+        checks = primary_key("parent", "id") + [
+            foreign_key("child", "parent_id", "parent", "id", min_value=2, max_value=2),
+        ]
+        assert run_quality_checks(checks, workers=2, con=con)
+        assert all(results(con).values())
+
+    def test_failing_checks_are_recorded(self, con):
+        checks = primary_key("child", "id") + [
+            violations("no zero parents", "child", "parent_id = 0"),
+            foreign_key("child", "parent_id", "parent", "id"),
+        ]
+        assert not run_quality_checks(checks, workers=2, con=con)
+        recorded = results(con)
+        assert recorded["child.id not null"]
+        assert not recorded["child.id unique"]
+        assert not recorded["no zero parents"]
+        assert not recorded["child.parent_id -> parent.id"]
+
+    def test_unbounded_expectations(self):
+        check = Check("at least one", "t", "COUNT(*)", min_value=1, max_value=None)
+        assert check.passed(10)
+        assert not check.passed(0)
+        assert not check.passed(None)
+
+
+def observe(con, check):
+    sql = check.query if check.query is not None else f"SELECT {check.expression} FROM {check.table}"
+    return con.execute(sql).fetchone()[0]
+
+
+class TestBuilders:
+    """Verify each check builder measures what its name says."""
+
+    def test_primary_key(self, con):
+        con.execute("CREATE TABLE keys AS SELECT * FROM (VALUES (1), (1), (2), (NULL)) t(id)")
+        checks = {check.name: check for check in primary_key("keys", "id")}
+        assert {name: observe(con, check) for name, check in checks.items()} == {
+            "keys.id not empty": 4,
+            "keys.id not null": 1,
+            "keys.id unique": 1,
+        }
+        assert checks["keys.id not empty"].passed(4)
+        assert not checks["keys.id not empty"].passed(0)
+        assert not checks["keys.id not null"].passed(1)
+
+    def test_primary_key_of_empty_table_fails(self, con):
+        con.execute("CREATE TABLE empty (id INTEGER)")
+        not_empty = primary_key("empty", "id")[0]
+        assert not not_empty.passed(observe(con, not_empty))
+
+    def test_foreign_key_counts_orphans(self, con):
+        assert observe(con, foreign_key("child", "parent_id", "parent", "id")) == 2
+
+    def test_foreign_key_extra_filter_restricts_parents(self, con):
+        check = foreign_key("child", "parent_id", "parent", "id", extra_filter="p.id > 1")
+        assert observe(con, check) == 3
+
+    def test_foreign_key_known_orphans(self, con):
+        check = foreign_key("child", "parent_id", "parent", "id", min_value=2, max_value=2)
+        assert check.passed(observe(con, check))
+        assert not check.passed(1)
+        assert not check.passed(3)
+
+    def test_violations(self, con):
+        check = violations("zero parents", "child", "parent_id = 0")
+        assert observe(con, check) == 1
+        assert not check.passed(1)
+        assert violations("zero parents", "child", "parent_id = 0", expected=1).passed(1)
+
+    def test_row_count(self, con):
+        check = row_count("child", 4)
+        assert check.name == "child row count"
+        assert check.passed(observe(con, check))
+        assert not check.passed(3)
+        assert not check.passed(5)
@@ -0,0 +1,66 @@
+from datetime import datetime
+import pytest
+import duckdb
+from src.config import DB_PATH
+import src.query_benchmark as query_benchmark
+
+
+@pytest.fixture()
+
+def results():
+    connection = duckdb.connect()
+    query_benchmark.create_query_results_tables(connection)
+    yield connection
+    connection.close()
+
+
+def add_result(con, run_id, name, p50_ms, result_hash="h"):
+    con.execute(f"""
+        INSERT INTO {query_benchmark.QUERY_RESULTS_TABLE}
+        VALUES (?, 1, NULL, 'db', ?, 0, ?, 0, 0, 100, 0, 1, ?, ?)
+    """, [run_id, name, p50_ms, result_hash, datetime.now()])
+
+
+def set_baseline(con, run_id):
+    con.execute(f"INSERT OR REPLACE INTO {query_benchmark.QUERY_BASELINES_TABLE} VALUES (1, 'db', ?)", [run_id])
+
+
+class TestBaselineComparison:
+    """Verify query runs are judged against the stored baseline."""
+
+    def test_no_baseline(self, results):
+        add_result(results, "run1", "q", 10)
+        assert query_benchmark.compare_to_baseline(results, "run1") == []
+
+    def test_slower_query_regresses(self, results):
+        add_result(results, "run1", "fast", 100)
+        add_result(results, "run1", "slow", 100)
+        set_baseline(results, "run1")
+        add_result(results, "run2", "fast", 105)
+        add_result(results, "run2", "slow", 300)
+        regressed = {row["query_name"]: row["regressed"]
+                     for row in query_benchmark.compare_to_baseline(results, "run2")}
+        assert regressed == {"fast": False, "slow": True}
+
+    def test_changed_result_regresses(self, results):
+        add_result(results, "run1", "q", 10, result_hash="a")
+        set_baseline(results, "run1")
+        add_result(results, "run2", "q", 10, result_hash="b")
+        [row] = query_benchmark.compare_to_baseline(results, "run2")
+        assert row["result_changed"] and row["regressed"]
+
+    def test_result_hash_ignores_float_noise(self):
+        assert query_benchmark.result_hash([("a", 0.1 + 0.2)]) == query_benchmark.result_hash([("a", 0.3)])
+        assert query_benchmark.result_hash([("a", 0.3)]) != query_benchmark.result_hash([("a", 0.4)])
+
+
+class TestQuerySuite:
+    """Verify every suite query runs against the built marts."""
+
+    def test_queries_return_rows(self):
+        con = duckdb.connect(DB_PATH, read_only=True)
+        try:
+            for name, sql in query_benchmark.QUERY_SUITE.items():
+                assert con.execute(sql).fetchall(), name
+        finally:
+            con.close()
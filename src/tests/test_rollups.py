@@ -0,0 +1,101 @@
+import pytest
+import duckdb
+from src.config import SCHEMA_MARTS
+from src.incremental import start_history
+from src.rollups import ROLLUPS, SALES_FACT, build_rollup_model, query_sales, route
+
+
+@pytest.fixture()
+
+def con():
+    connection = duckdb.connect()
+    connection.execute(f"CREATE SCHEMA {SCHEMA_MARTS}")
+    connection.execute(f"""
+        CREATE TABLE {SALES_FACT} (
+            transaction_id INTEGER,
+            customer_id INTEGER,
+            flavour_id INTEGER,
+            transaction_country VARCHAR,
+            transaction_town VARCHAR,
+            quantity_liters INTEGER,
+            amount_dollars DOUBLE,
+            transaction_year INTEGER,
+            transaction_quarter INTEGER,
+            transaction_year_quarter VARCHAR,
+            batch_number INTEGER
+        )
+    """)
+    yield connection
+    connection.close()
+
+
+def add_sales(con, batch_number, rows):
+    for transaction_id, flavour_id, amount in rows:
+        con.execute(f"""
+            INSERT INTO {SALES_FACT}
+            VALUES (?, 1, ?, 'FRANCE', 'Paris', 1, ?, 2024, 1, '2024-Q1', ?)
+        """, [transaction_id, flavour_id, amount, batch_number])
+
+
+def build_all(con):
+    for name, dimensions in ROLLUPS.items():
+        build_rollup_model(name, dimensions)(con)
+
+
+class TestRollups:
+    """Verify rollups stay equal to the fact table as batches arrive."""
+
+    def test_new_batch_is_added_to_totals(self, con):
+        add_sales(con, 1, [(1, 1, 10.0), (2, 2, 20.0)])
+        build_all(con)
+        add_sales(con, 2, [(3, 1, 5.0), (4, 3, 1.0)])
+        build_rollup_model("agg_sales_by_flavour_quarter", ROLLUPS["agg_sales_by_flavour_quarter"])(con)
+
+        rows = con.execute(f"""
+            SELECT flavour_id, transactions, amount_dollars
+            FROM {SCHEMA_MARTS}.agg_sales_by_flavour_quarter
+            ORDER BY flavour_id
+        """).fetchall()
+        assert rows == [(1, 2, 15.0), (2, 1, 20.0), (3, 1, 1.0)]
+
+    def test_value_edited_in_merged_batch_rebuilds(self, con):
+        add_sales(con, 1, [(1, 1, 10.0), (2, 2, 20.0)])
+        build_all(con)
+        # As a rebuild of the fact would
+        con.execute(f"UPDATE {SALES_FACT} SET amount_dollars = 12.0 WHERE transaction_id = 1")
+        start_history(con, SALES_FACT)
+        build_all(con)
+        assert con.execute(f"""
+            SELECT amount_dollars FROM {SCHEMA_MARTS}.agg_sales_by_quarter
+        """).fetchall() == [(32.0,)]
+
+    def test_columns_the_rollup_does_not_read_are_ignored(self, con):
+        add_sales(con, 1, [(1, 1, 10.0), (2, 2, 20.0)])
+        build_all(con)
+        con.execute(f"UPDATE {SALES_FACT} SET transaction_town = 'Lyon' WHERE transaction_id = 1")
+        start_history(con, SALES_FACT)
+        assert build_rollup_model("agg_sales_by_quarter", ROLLUPS["agg_sales_by_quarter"])(con) == 0
+
+
+class TestRouter:
+    """Verify queries go to the smallest rollup that can answer them."""
+
+    def test_routing(self, con):
+        add_sales(con, 1, [(1, 1, 10.0), (2, 2, 20.0)])
+        build_all(con)
+        assert route(con, ["transaction_year"]) == f"{SCHEMA_MARTS}.agg_sales_by_quarter"
+        assert route(con, ["flavour_id", "transaction_quarter"]) == f"{SCHEMA_MARTS}.agg_sales_by_flavour_quarter"
+        assert route(con, ["transaction_country"]) == f"{SCHEMA_MARTS}.agg_sales_by_customer_country_quarter"
+        assert route(con, ["transaction_town"]) == SALES_FACT
+
+    def test_rollup_and_fact_answers_match(self, con):
+        add_sales(con, 1, [(1, 1, 10.0), (2, 2, 20.0), (3, 1, 5.0)])
+        _, from_fact = query_sales(con, ["flavour_id"], transaction_year=2024)
+        build_all(con)
+        relation, from_rollup = query_sales(con, ["flavour_id"], transaction_year=2024)
+        assert relation != SALES_FACT
+        assert from_rollup == from_fact
+
+    def test_rejects_non_columns(self, con):
+        with pytest.raises(ValueError, match="Not a column"):
+            query_sales(con, ["flavour_id; DROP TABLE x"])
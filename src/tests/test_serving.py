@@ -0,0 +1,92 @@
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import duckdb
+from src.serving.queries import QUERIES, Query, render_params
+from src.serving.service import ConnectionPool, QueryService
+
+
+@pytest.fixture()
+
+def service(tmp_path):
+    db_path = str(tmp_path / "serving.duckdb")
+    con = duckdb.connect(db_path)
+    con.execute("CREATE SCHEMA marts")
+    con.execute("""
+        CREATE TABLE marts.fct_sales_transactions AS
+        SELECT * FROM (VALUES
+            (1, 1, 10, 100.0, 2024, 1),
+            (1, 2, 5, 50.0, 2024, 1),
+            (2, 1, 1, 10.0, 2024, 2)
+        ) t(customer_id, flavour_id, quantity_liters, amount_dollars, transaction_year, transaction_quarter)
+    """)
+    con.execute("""
+        CREATE TABLE marts.dim_flavours AS
+        SELECT * FROM (VALUES
+            (1, 'Vanilla', 'old', DATE '2024-01-01', FALSE),
+            (1, 'Vanilla', 'new', DATE '2024-05-05', TRUE),
+            (2, 'Lemon', 'tart', DATE '2024-01-01', TRUE)
+        ) t(flavour_id, flavour_name, flavour_description, valid_from, is_current)
+    """)
+    con.execute("""
+        CREATE TABLE marts.dim_customers AS
+        SELECT * FROM (VALUES (1, 'Acme', 'France'), (2, 'Globex', 'Spain'))
+            t(customer_id, customer_name, customer_country)
+    """)
+    con.close()
+
+    query_service = QueryService(ConnectionPool(db_path, size=2))
+    yield query_service
+    query_service.close()
+
+
+class TestQueryService:
+    """Verify prepared dashboard queries are served from the pool."""
+
+    def test_current_flavour(self, service):
+        rows = service.run("current_flavour", flavour_id=1)
+        assert [row["flavour_description"] for row in rows] == ["new"]
+
+    def test_sales_by_flavour(self, service):
+        rows = service.run("sales_by_flavour", year=2024, quarter=1)
+        assert [(row["flavour_name"], row["amount_dollars"]) for row in rows] == [
+            ("Vanilla", 100.0), ("Lemon", 50.0),
+        ]
+
+    def test_concurrent_calls_are_measured(self, service):
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(
+                lambda _: service.run("sales_by_customer", year=2024, quarter=1), range(20)
+            ))
+        assert all(len(rows) == 1 for rows in results)
+        assert service.latency.snapshot()["sales_by_customer"]["calls"] == 20
+
+    def test_aggregate_without_rollups_reads_fact_table(self, service):
+        rows = service.aggregate(["flavour_id"], transaction_year=2024)
+        assert [(row["flavour_id"], row["transactions"]) for row in rows] == [(1, 2), (2, 1)]
+        assert "aggregate:marts.fct_sales_transactions" in service.latency.snapshot()
+
+    def test_unknown_query(self, service):
+        with pytest.raises(ValueError, match="Unknown query"):
+            service.run("drop_everything")
+
+
+class TestRenderParams:
+    """Verify EXECUTE arguments are validated and quoted."""
+
+    def test_wrong_parameters(self):
+        with pytest.raises(ValueError, match="takes parameters"):
+            render_params(QUERIES["sales_by_flavour"], {"year": 2024})
+
+    def test_values_are_coerced(self):
+        with pytest.raises(ValueError):
+            render_params(QUERIES["current_flavour"], {"flavour_id": "1; DROP TABLE x"})
+        assert render_params(QUERIES["current_flavour"], {"flavour_id": "7"}) == "7"
+
+    def test_non_finite_floats_are_valid_sql(self):
+        query = Query(name="echo", sql="SELECT $1::DOUBLE AS x", params=[("x", float)])
+        con = duckdb.connect()
+        con.execute(f"PREPARE echo AS {query.sql}")
+        for value in [float("nan"), float("inf"), float("-inf"), 1.5]:
+            result = con.execute(f"EXECUTE echo({render_params(query, {'x': value})})").fetchone()[0]
+            assert repr(result) == repr(value)
+        con.close()
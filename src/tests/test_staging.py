@@ -0,0 +1,48 @@
+import importlib
+from datetime import date
+import pytest
+import duckdb
+from src.config import DATE_FORMATS, SCHEMA_RAW, SCHEMA_STAGING
+
+staging = importlib.import_module("src.pipeline.02_staging")
+
+
+@pytest.fixture()
+def con():
+    connection = duckdb.connect()
+    connection.execute(f"CREATE SCHEMA {SCHEMA_RAW}")
+    connection.execute(f"CREATE SCHEMA {SCHEMA_STAGING}")
+    # Recipes mix every format in DATE_FORMATS
+    connection.execute(f"""
+        CREATE TABLE {SCHEMA_RAW}.recipes AS
+        SELECT * FROM (VALUES ('5/5/24'), ('05/06/2024'), ('7-May-24'), ('5/5/24'), ('not a date')) AS t(generation_date)
+    """)
+    yield connection
+    connection.close()
+
+
+def lookup(con):
+    staging.build_date_lookup_model("recipes").build(con)
+    return {
+        raw_value: (parsed_date, date_format)
+        for raw_value, parsed_date, date_format in con.execute(f"""
+            SELECT raw_value, parsed_date, date_format FROM {staging.date_lookup_relation("recipes")}
+        """).fetchall()
+    }
+
+
+class TestDateLookup:
+    """Verify each distinct raw date is parsed once, with the first format that matches it."""
+
+    def test_two_digit_year_is_not_year_24(self, con):
+        assert lookup(con)["5/5/24"] == (date(2024, 5, 5), "%m/%d/%y")
+
+    def test_every_format_resolves(self, con):
+        dates = lookup(con)
+        assert dates == {
+            "5/5/24": (date(2024, 5, 5), "%m/%d/%y"),
+            "05/06/2024": (date(2024, 5, 6), "%m/%d/%Y"),
+            "7-May-24": (date(2024, 5, 7), "%-d-%b-%y"),
+            "not a date": (None, None),
+        }
+        assert {date_format for _, date_format in dates.values()} - {None} == set(DATE_FORMATS)
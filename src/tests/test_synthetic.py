@@ -0,0 +1,90 @@
+import os
+from datetime import datetime
+import pytest
+import duckdb
+from src.config import CSV_FILES, SOURCE_SCHEMAS
+from src.synthetic import generate_sources, source_row_counts
+import src.benchmark as benchmark
+
+
+def read_source(directory, source):
+    return duckdb.sql(f"""
+        SELECT * FROM read_csv('{os.path.join(directory, CSV_FILES[source])}', all_varchar = true)
+    """)
+
+
+# 1. GENERATOR
+
+class TestGenerator:
+    """Verify generated sources follow the source contracts and keep the known quirks."""
+
+    def test_sources_match_contracts(self, tmp_path):
+        counts = generate_sources(0.02, tmp_path)
+        for source in CSV_FILES:
+            relation = read_source(tmp_path, source)
+            assert relation.columns == list(SOURCE_SCHEMAS[source])
+            assert relation.count("*").fetchone()[0] == counts[source]
+
+    def test_output_is_deterministic(self, tmp_path):
+        generate_sources(0.02, tmp_path / "a")
+        generate_sources(0.02, tmp_path / "b")
+        for file_name in CSV_FILES.values():
+            assert (tmp_path / "a" / file_name).read_bytes() == (tmp_path / "b" / file_name).read_bytes()
+
+    def test_dates_match_contract_formats(self, tmp_path):
+        generate_sources(0.02, tmp_path)
+        for source, columns in SOURCE_SCHEMAS.items():
+            for column, spec in columns.items():
+                if "date_formats" not in spec:
+                    continue
+                parsed = " OR ".join(f"TRY_STRPTIME({column}, '{f}') IS NOT NULL" for f in spec["date_formats"])
+                unparsed = read_source(tmp_path, source).filter(f"NOT ({parsed})").count("*").fetchone()[0]
+                assert unparsed == 0, f"{source}.{column}"
+
+    def test_flavours_change_in_second_batch(self, tmp_path):
+        generate_sources(1, tmp_path)
+        changed = duckdb.sql(f"""
+            SELECT COUNT(*)
+            FROM read_csv('{tmp_path / "flavours.csv"}') b1
+            JOIN read_csv('{tmp_path / "flavours.csv"}') b2 USING (flavour_id)
+            WHERE b1.batch_number = 1 AND b2.batch_number = 2
+              AND b1.description != b2.description
+        """).fetchone()[0]
+        assert changed == 99
+        assert source_row_counts(1)["sales_transactions"] == 50_000
+
+
+# 2. BENCHMARK RESULTS
+
+@pytest.fixture()
+
+def results():
+    connection = duckdb.connect()
+    benchmark.create_results_table(connection)
+    yield connection
+    connection.close()
+
+
+def add_result(con, run_id, name, seconds):
+    con.execute(f"INSERT INTO {benchmark.BENCHMARK_RESULTS_TABLE} VALUES (?, NULL, 1, 'table', ?, ?, 0, 0, ?)",
+                [run_id, name, seconds, datetime.now()])
+
+
+class TestRegressions:
+    """Verify runs are compared with the previous run at the same scale factor."""
+
+    def test_slower_tables_are_reported(self, results):
+        add_result(results, "run1", "marts.fct", 1.0)
+        add_result(results, "run1", "marts.dim", 1.0)
+        add_result(results, "run2", "marts.fct", 2.0)
+        add_result(results, "run2", "marts.dim", 1.1)
+        assert benchmark.find_regressions(results, "run2") == [(1, "table", "marts.fct", 1.0, 2.0)]
+
+    def test_small_differences_are_noise(self, results):
+        add_result(results, "run1", "marts.fct", 0.01)
+        add_result(results, "run2", "marts.fct", 0.05)
+        assert benchmark.find_regressions(results, "run2") == []
+
+    def test_first_run_has_nothing_to_compare(self, results):
+        add_result(results, "run1", "marts.fct", 1.0)
+        assert benchmark.find_regressions(results, "run1") == []
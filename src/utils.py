@@ -1,23 +1,127 @@
+import sys
+from contextlib import contextmanager
 import duckdb
-from src.config import DB_PATH
+from src.config import DB_PATH, DATE_FORMATS, OUT_OF_CORE, MEMORY_LIMIT, THREADS, TEMP_DIRECTORY
+
+
+def get_duckdb_config() -> dict:
+    if not OUT_OF_CORE:
+        return {}
+    # Without insertion order DuckDB can stream CREATE TABLE AS and COPY
+    # instead of buffering rows to keep them in input order
+    return {
+        "memory_limit": MEMORY_LIMIT,
+        "threads": THREADS,
+        "temp_directory": TEMP_DIRECTORY,
+        "preserve_insertion_order": False,
+    }
 
 
 def get_connection() -> duckdb.DuckDBPyConnection:
-    return duckdb.connect(DB_PATH)
+    return duckdb.connect(DB_PATH, config=get_duckdb_config())
 
 
-def get_parse_date_sql(column_name: str) -> str:
+def get_parse_date_sql(column_name: str, date_formats=DATE_FORMATS) -> str:
+    attempts = ",\n        ".join(
+        f"TRY_STRPTIME({column_name}::VARCHAR, '{date_format}')" for date_format in date_formats
+    )
     return f"""COALESCE(
-        TRY_STRPTIME({column_name}::VARCHAR, '%m/%d/%Y'),
-        TRY_STRPTIME({column_name}::VARCHAR, '%m/%d/%y'),
-        TRY_STRPTIME({column_name}::VARCHAR, '%-d-%b-%y')
+        {attempts}
     )::DATE"""
 
 
+def get_surrogate_key_sql(*expressions) -> str:
+    # 63 bits of the MD5 of the key parts. Unlike hash(), MD5 gives the same
+    # key on every DuckDB version, which incremental tables rely on.
+    parts = " || '|' || ".join(f"COALESCE({expression}::VARCHAR, '')" for expression in expressions)
+    return f"(md5_number_lower({parts}) >> 1)::BIGINT"
+
+
+def get_date_key_sql(column_name: str) -> str:
+    # yyyymmdd as an INTEGER
+    return (
+        f"(EXTRACT(YEAR FROM {column_name}) * 10000 + EXTRACT(MONTH FROM {column_name}) * 100"
+        f" + EXTRACT(DAY FROM {column_name}))::INTEGER"
+    )
+
+
+def get_hashdiff_sql(columns) -> str:
+    # NULL and '' must hash differently, and CONCAT_WS would drop NULLs
+    parts = ", ".join(f"COALESCE({column}::VARCHAR, '^^')" for column in columns)
+    return f"MD5(CONCAT_WS('||', {parts}))"
+
+
+# ids of connections with a transaction opened by transaction() below
+_open_transactions = set()
+
+
+@contextmanager
+def transaction(con: duckdb.DuckDBPyConnection):
+    """
+    Run a block in a transaction on con. DuckDB has no nested transactions,
+    so a block on a connection already inside transaction() just joins the
+    outer one.
+    """
+    if id(con) in _open_transactions:
+        yield
+        return
+
+    con.execute("BEGIN TRANSACTION")
+    _open_transactions.add(id(con))
+    try:
+        yield
+    except BaseException:
+        con.execute("ROLLBACK")
+        raise
+    else:
+        con.execute("COMMIT")
+    finally:
+        _open_transactions.discard(id(con))
+
+
 def create_schema_if_not_exists(con: duckdb.DuckDBPyConnection, schema_name: str):
     con.execute(f"CREATE SCHEMA IF NOT EXISTS {schema_name}")
 
 
-def print_table_info(con: duckdb.DuckDBPyConnection, schema: str, table: str):
-    count = con.execute(f"SELECT COUNT(*) FROM {schema}.{table}").fetchone()[0]
-    print(f"  {schema}.{table}: {count:,} rows")
+def table_exists(con: duckdb.DuckDBPyConnection, schema: str, table: str) -> bool:
+    result = con.execute("""
+        SELECT COUNT(*)
+        FROM information_schema.tables
+        WHERE table_schema = ? AND table_name = ?
+    """, [schema, table]).fetchone()
+    return result[0] > 0
+
+
+def relation_binds(con: duckdb.DuckDBPyConnection, relation: str) -> bool:
+    """
+    True if relation can be queried. A view can outlive what it reads, e.g.
+    a raw view whose cached Parquet files were deleted, and then fails to
+    bind. Nothing is scanned.
+    """
+    try:
+        con.execute(f"SELECT * FROM {relation} LIMIT 0")
+    except duckdb.Error:
+        return False
+    return True
+
+
+def drop_relation(con: duckdb.DuckDBPyConnection, relation: str, keep: str = None):
+    """
+    Drop the table or view named relation, unless it is already a keep
+    ("table" or "view"). DuckDB won't drop or replace a table as a view or
+    the other way around, so check which one it is first.
+    """
+    schema, name = relation.split(".")
+    row = con.execute("""
+        SELECT 'table' FROM duckdb_tables() WHERE schema_name = ? AND table_name = ?
+        UNION ALL
+        SELECT 'view' FROM duckdb_views() WHERE schema_name = ? AND view_name = ?
+    """, [schema, name, schema, name]).fetchone()
+    if row is not None and row[0] != keep:
+        con.execute(f"DROP {row[0].upper()} {relation}")
+
+
+def log(message: str):
+    # One write per line, so lines from models built on different threads don't interleave
+    sys.stdout.write(f"{message}\n")
+    sys.stdout.flush()